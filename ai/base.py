@@ -7,9 +7,18 @@ class AI:
     def generate(self, instruct, console):
         pass
 
+    def agenerate(self, instruct, console):
+        """异步生成，返回 (cmd, think) 的异步迭代器；默认在线程池中驱动同步的generate。"""
+        import aio
+        return aio.to_async(self.generate(instruct, console))
+
     def save(self, instruct, console, output):
         pass
 
+    def cache_key(self, instruct, console):
+        """返回渲染后的请求内容，用于缓存键；返回None表示不可缓存。"""
+        return None
+
     def print(self, **kwargs):
         pass
 
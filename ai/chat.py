@@ -21,6 +21,19 @@ class ChatAI(AI):
         self.system_instruct = None
         self.default_instruct = '继续'
         self.console_max_height = 30
+        self.console_max_tokens = 2000
+        self.use_cache = 0
+        self.cache_retry = 0
+        self.first_token_timeout = 0.0  # 首token超时（秒），0为不限制：推理模型的首token可能很慢
+        self.chunk_timeout = 30.0
+        self.max_retries = 2
+        self.retry_backoff = 0.5
+        self.hedge_percentile = 0.0
+        self.example_count = 3
+        self.example_max_chars = 1000
+        self.history_max_messages = 20
+        self.history_max_chars = 20000
+        self.summary_max_chars = 2000
         self.messages = []
         if system_instruct is not None:
             self.system_instruct = system_instruct
@@ -36,53 +49,120 @@ class ChatAI(AI):
         return m
 
     def create_user_message(self, instruct, console):
-        lines = console.split('\n')
-        if len(lines) > self.console_max_height:
-            lines = lines[-self.console_max_height:]
-        console = '\n'.join(lines)
+        from context import build_context
+        # 有token预算时由预算决定保留多少行，否则按行数截取
+        max_lines = None if self.console_max_tokens > 0 else self.console_max_height
+        console = build_context(console, self.console_max_tokens, max_lines=max_lines)
         c = self.user_template.format(instruct=instruct, console=console)
         m = dict(role=self.user, content=c, instruct=instruct, console=console)
         return m
 
+    def example_messages(self, instruct):
+        if self.example_count <= 0:
+            return []
+        from retrieval import get_index
+        messages = []
+        for i, c in reversed(get_index().examples(instruct, self.example_count, self.example_max_chars)):
+            messages.append(dict(role=self.user, content=i))
+            messages.append(dict(role=self.assistant, content=c))
+        return messages
+
+    def request_append(self, instruct, console):
+        m_user = self.create_user_message(instruct, console)
+        return [*self.example_messages(instruct), m_user]
+
     def add_user(self, instruct, console):
         m = self.create_user_message(instruct, console)
         return self.add_messages(m)
 
+    def fold_history(self):
+        """
+        将超出窗口（消息数或总字符数）的最早对话折叠进摘要消息，保持请求大小基本恒定。
+        """
+        turns = [m for m in self.messages if m['role'] != self.system]
+        size = sum(len(m['content']) for m in turns)
+        folded = []
+        while len(turns) > 2 and (len(turns) > self.history_max_messages or size > self.history_max_chars):
+            m = turns.pop(0)
+            size -= len(m['content'])
+            if m['role'] == self.user:
+                folded.append(m.get('instruct', m['content']))
+            elif folded:
+                folded[-1] = f"{folded[-1]} => {m['content']}"
+            else:
+                folded.append(f"=> {m['content']}")
+        if not folded:
+            return
+        summary = None
+        for m in self.messages:
+            if m.get('summary'):
+                summary = m
+        entries = summary['entries'] if summary else []
+        entries += ['- ' + e.replace('\n', ' ') for e in folded]
+        while len(entries) > 1 and sum(len(e) + 1 for e in entries) > self.summary_max_chars:
+            entries.pop(0)
+        content = '之前的对话摘要(指令 => 命令):\n' + '\n'.join(entries)
+        if summary is None:
+            summary = dict(role=self.system, content=content, summary=True, entries=entries)
+        else:
+            summary['content'] = content
+        head = [m for m in self.messages if m['role'] == self.system and not m.get('summary')]
+        self.messages = [*head, summary, *turns]
+
     def pop(self):
         if len(self.messages) > 0:
             m = self.messages[-1]
             self.messages = self.messages[:-1]
             return m
 
-    def _generate(self, callback=None, append_messages=None):
-        yield '', ''
-        from generate import get_openai_client, convert_output
-        client = get_openai_client()
+    def request_messages(self, append_messages=None):
         messages = []
         for m in self.messages:
             messages.append(dict(role=m['role'], content=m['content']))
         if append_messages is not None:
             for m in append_messages:
                 messages.append(dict(role=m['role'], content=m['content']))
-        stream = client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            stream=True,
-        )
-        output = ''
+        return messages
+
+    async def _agenerate(self, callback=None, append_messages=None):
+        yield '', ''
         cmd, think = '', ''
+        parser = None
         try:
-            for chunk in stream:
-                output += chunk.choices[0].delta.content or ''
-                cmd, think = convert_output(output)
+            from generate import get_openai_client, ThinkParser, stream_chunks
+            client = get_openai_client()
+            messages = self.request_messages(append_messages)
+            create = lambda: client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+            )
+            parser = ThinkParser()
+            async for chunk in stream_chunks(create, self):
+                if chunk.choices:
+                    yield parser.feed(chunk.choices[0].delta.content)
+            pending = parser.hold
+            cmd, think = parser.flush()
+            if pending:
                 yield cmd, think
+        except Exception as e:
+            cmd, think = f'error: {e}', ''
+            yield cmd, think
         finally:
             if callback:
+                if parser is not None and not cmd:
+                    cmd, think = parser.cmd.value(), parser.think.value()
                 callback(cmd, think)
 
+    def agenerate(self, instruct, console):
+        return self._agenerate(append_messages=self.request_append(instruct, console))
+
     def generate(self, instruct, console):
-        m_user = self.create_user_message(instruct, console)
-        return self._generate(append_messages=[m_user])
+        import aio
+        return aio.to_sync(self.agenerate(instruct, console))
+
+    def cache_key(self, instruct, console):
+        return json.dumps(self.request_messages(self.request_append(instruct, console)), ensure_ascii=False)
 
     def save(self, instruct, console, output):
         if instruct is None:
@@ -91,6 +171,7 @@ class ChatAI(AI):
         m_ass = dict(role=self.assistant, content=output)
         self.add_messages(m_user)
         self.add_messages(m_ass)
+        self.fold_history()
 
     def print(self, end='\r\n', simple=False):
         winsize = os.get_terminal_size()
@@ -117,6 +198,19 @@ class ChatAI(AI):
         s.system_instruct = config.get('system_instruct', s.system_instruct)
         s.default_instruct = config.get('default_instruct', s.default_instruct)
         s.console_max_height = config.get('console_max_height', s.console_max_height)
+        s.console_max_tokens = config.get('console_max_tokens', s.console_max_tokens)
+        s.use_cache = config.get('use_cache', s.use_cache)
+        s.cache_retry = config.get('cache_retry', s.cache_retry)
+        s.first_token_timeout = config.get('first_token_timeout', s.first_token_timeout)
+        s.chunk_timeout = config.get('chunk_timeout', s.chunk_timeout)
+        s.max_retries = config.get('max_retries', s.max_retries)
+        s.retry_backoff = config.get('retry_backoff', s.retry_backoff)
+        s.hedge_percentile = config.get('hedge_percentile', s.hedge_percentile)
+        s.example_count = config.get('example_count', s.example_count)
+        s.example_max_chars = config.get('example_max_chars', s.example_max_chars)
+        s.history_max_messages = config.get('history_max_messages', s.history_max_messages)
+        s.history_max_chars = config.get('history_max_chars', s.history_max_chars)
+        s.summary_max_chars = config.get('summary_max_chars', s.summary_max_chars)
         s.messages = []
         if s.system_instruct is not None:
             s.add(s.system, s.system_instruct)
@@ -132,6 +226,19 @@ class ChatAI(AI):
             'system_instruct': self.system_instruct,
             'default_instruct': self.default_instruct,
             'console_max_height': self.console_max_height,
+            'console_max_tokens': self.console_max_tokens,
+            'use_cache': self.use_cache,
+            'cache_retry': self.cache_retry,
+            'first_token_timeout': self.first_token_timeout,
+            'chunk_timeout': self.chunk_timeout,
+            'max_retries': self.max_retries,
+            'retry_backoff': self.retry_backoff,
+            'hedge_percentile': self.hedge_percentile,
+            'example_count': self.example_count,
+            'example_max_chars': self.example_max_chars,
+            'history_max_messages': self.history_max_messages,
+            'history_max_chars': self.history_max_chars,
+            'summary_max_chars': self.summary_max_chars,
         }
         if path:
             with open(path, 'w') as f:
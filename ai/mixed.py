@@ -2,7 +2,10 @@
 from .base import AI
 from .registry import register_ai_type, to_ai_type, get_ai_type
 import traceback
+import asyncio
 import json
+import cache
+from completion import Trie
 
 class MixedAI(AI):
     """
@@ -12,19 +15,26 @@ class MixedAI(AI):
         self.ais = {}
         self.ai = None
         self.current_ai_id = None
+        self.fanout_mode = None  # None/'race'/'compare'
+        self.fanout_ids = []
+        self.id_trie = Trie()  # AI id 的前缀树，用于 Tab 补全
 
     def add(self, id, ai):
         self.ais[id] = ai
+        self.id_trie.insert(id)
 
     def remove(self, id):
         if id in self.ais.keys():
             a = self.ais[id]
             del self.ais[id]
+            self.id_trie.remove(id)
             if a == self.ai:
                 if len(self.ais) == 0:
                     self.ai = None
+                    self.current_ai_id = None
                 else:
-                    self.ai = self.ais[list(self.ais.keys())[0]]
+                    self.current_ai_id = list(self.ais.keys())[0]
+                    self.ai = self.ais[self.current_ai_id]
 
     def switch(self, id):
         if id in self.ais.keys():
@@ -37,15 +47,82 @@ class MixedAI(AI):
         if id in self.ais.keys():
             self.ais[new_id] = self.ais[id]
             del self.ais[id]
+            self.id_trie.remove(id)
+            self.id_trie.insert(new_id)
+            if self.current_ai_id == id:
+                self.current_ai_id = new_id
+            self.fanout_ids = [new_id if i == id else i for i in self.fanout_ids]
 
-    def generate(self, instruct, console):
+    async def fanout(self, instruct, console, ids, mode='race', retry=False):
+        """
+        将同一请求并发发送给多个AI（同一事件循环中的多个任务）。
+        race: 第一个完整且非空的命令胜出，其余取消；流式过程中输出最先有内容的AI的结果。
+        compare: 所有候选同时流式输出，产出 (cmd, think, candidates)，candidates 为 [(id, cmd, think), ...]。
+        """
+        q = asyncio.Queue()
+        generators = {id: cache.cached_generate(id, self.ais[id], instruct, console, retry=retry) for id in ids}
+
+        async def run(id):
+            g = generators[id]
+            chunk = ('', '')
+            try:
+                async for chunk in g:
+                    q.put_nowait((id, chunk, False))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                chunk = (f'error: {e}', '')
+            finally:
+                if hasattr(g, 'aclose'):
+                    await g.aclose()
+                q.put_nowait((id, chunk, True))
+
+        tasks = [asyncio.ensure_future(run(id)) for id in ids]
+        yield '', ''
+        try:
+            results = {id: ('', '') for id in ids}
+            remaining = len(ids)
+            leader = None
+            while remaining > 0:
+                id, chunk, done = await q.get()
+                results[id] = chunk
+                if done:
+                    remaining -= 1
+                if mode == 'race':
+                    if done and chunk[0] and not chunk[0].startswith('error:'):
+                        yield chunk
+                        return
+                    if leader is None and (chunk[0] or chunk[1]):
+                        leader = id
+                    if id == leader and not done:
+                        yield chunk
+                else:
+                    candidates = [(i, *results[i]) for i in ids]
+                    lead = next((c for c in candidates if c[1]), candidates[0])
+                    yield lead[1], lead[2], candidates
+            if mode == 'race':
+                # 没有成功的结果，输出第一个有内容的结果（如错误信息）
+                lead = next((results[i] for i in ids if results[i][0]), ('', ''))
+                yield lead[0], lead[1]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def agenerate(self, instruct, console, retry=False):
+        ids = [id for id in self.fanout_ids if id in self.ais]
+        if self.fanout_mode in ['race', 'compare'] and len(ids) > 1:
+            return self.fanout(instruct, console, ids, self.fanout_mode, retry=retry)
         if self.ai:
-            return self.ai.generate(instruct, console)
+            return cache.cached_generate(self.current_ai_id, self.ai, instruct, console, retry=retry)
         else:
-            def fun():
+            async def fun():
                 yield '', 'no selected ai'
             return fun()
 
+    def generate(self, instruct, console, retry=False):
+        import aio
+        return aio.to_sync(self.agenerate(instruct, console, retry=retry))
+
     def save(self, instruct, console, output):
         if self.ai:
             self.ai.save(instruct, console, output)
@@ -94,6 +171,9 @@ class MixedAI(AI):
                     except Exception as e:
                         err = traceback.format_exc().replace('\n', '\r\n')
                         print(f"prase ai config '{id}' failed:", err, end='\r\n')
+            fanout = config.get('fanout') or {}
+            s.fanout_mode = fanout.get('mode')
+            s.fanout_ids = fanout.get('ids', [])
             id = config.get('current_ai_id')
             if id:
                 s.switch(id)
@@ -105,6 +185,7 @@ class MixedAI(AI):
     def save_config(self, path=None):
         config = {
             'current_ai_id': self.current_ai_id,
+            'fanout': {'mode': self.fanout_mode, 'ids': self.fanout_ids},
             'ai': {},
         }
         for id in self.ais.keys():
@@ -12,22 +12,53 @@ class TextCompletionAI(AI):
         self.model = model
         self.prompt_template = prompt_template
         self.post_processor = None
+        self.console_max_tokens = 2000
+        self.use_cache = 0
+        self.cache_retry = 0
+        self.first_token_timeout = 0.0  # 首token超时（秒），0为不限制：推理模型的首token可能很慢
+        self.chunk_timeout = 30.0
+        self.max_retries = 2
+        self.retry_backoff = 0.5
+        self.hedge_percentile = 0.0
+        self.example_count = 3
+        self.example_max_chars = 1000
 
-    def generate(self, instruct, console):
+    def render_examples(self, instruct):
+        if self.example_count <= 0 or '{examples}' not in self.prompt_template:
+            return ''
+        from retrieval import get_index
+        examples = get_index().examples(instruct, self.example_count, self.example_max_chars)
+        return ''.join(f"指令: {i}\n命令: {c}\n\n" for i, c in examples)
+
+    def render_prompt(self, instruct, console):
+        from context import build_context
+        console = build_context(console, self.console_max_tokens)
+        examples = self.render_examples(instruct)
+        return self.prompt_template.format(instruct=instruct, console=console, examples=examples)
+
+    def cache_key(self, instruct, console):
+        return self.render_prompt(instruct, console) + '\0' + (self.post_processor or '')
+
+    async def agenerate(self, instruct, console):
         yield '', ''
         try:
-            from generate import get_openai_client, convert_output
+            import aio
+            from generate import get_openai_client, ThinkParser, stream_chunks
             client = get_openai_client()
-            prompt = self.prompt_template.format(instruct=instruct, console=console)
-            stream = client.completions.create(
+            # 渲染提示词可能读取少样本示例索引，在线程池中执行，不阻塞事件循环
+            prompt = await aio.run_in_worker(self.render_prompt, instruct, console)
+            create = lambda: client.completions.create(
                 model=self.model,
                 prompt=prompt,
                 stream=True,
             )
-            output = ''
-            for chunk in stream:
-                output += chunk.choices[0].text or ''
-                cmd, think = convert_output(output)
+            parser = ThinkParser()
+            async for chunk in stream_chunks(create, self):
+                if chunk.choices:
+                    yield parser.feed(chunk.choices[0].text)
+            pending = parser.hold
+            cmd, think = parser.flush()
+            if pending:
                 yield cmd, think
             if self.post_processor:
                 local_vars = { 'cmd': cmd, 'think': think }
@@ -38,6 +69,10 @@ class TextCompletionAI(AI):
         except Exception as e:
             yield f'error: {e}', ''
 
+    def generate(self, instruct, console):
+        import aio
+        return aio.to_sync(self.agenerate(instruct, console))
+
     def print(self, end='\r\n'):
         print(self.prompt_template.replace('\n', end), end=end)
 
@@ -50,6 +85,16 @@ class TextCompletionAI(AI):
         s.model = config.get('model', s.model)
         s.prompt_template = config.get('prompt_template', s.prompt_template)
         s.post_processor = config.get('post_processor', s.post_processor)
+        s.console_max_tokens = config.get('console_max_tokens', s.console_max_tokens)
+        s.use_cache = config.get('use_cache', s.use_cache)
+        s.cache_retry = config.get('cache_retry', s.cache_retry)
+        s.first_token_timeout = config.get('first_token_timeout', s.first_token_timeout)
+        s.chunk_timeout = config.get('chunk_timeout', s.chunk_timeout)
+        s.max_retries = config.get('max_retries', s.max_retries)
+        s.retry_backoff = config.get('retry_backoff', s.retry_backoff)
+        s.hedge_percentile = config.get('hedge_percentile', s.hedge_percentile)
+        s.example_count = config.get('example_count', s.example_count)
+        s.example_max_chars = config.get('example_max_chars', s.example_max_chars)
         return s
 
     def save_config(self, path=None):
@@ -57,6 +102,16 @@ class TextCompletionAI(AI):
             'model': self.model,
             'prompt_template': self.prompt_template,
             'post_processor': self.post_processor,
+            'console_max_tokens': self.console_max_tokens,
+            'use_cache': self.use_cache,
+            'cache_retry': self.cache_retry,
+            'first_token_timeout': self.first_token_timeout,
+            'chunk_timeout': self.chunk_timeout,
+            'max_retries': self.max_retries,
+            'retry_backoff': self.retry_backoff,
+            'hedge_percentile': self.hedge_percentile,
+            'example_count': self.example_count,
+            'example_max_chars': self.example_max_chars,
         }
         if path:
             with open(path, 'w') as f:
@@ -0,0 +1,139 @@
+"""
+aio.py
+共享的后台事件循环，以及同步/异步迭代器之间的适配。
+所有AI流式请求都在这一个事件循环上并发执行，同步调用方通过 to_sync 逐项取结果。
+"""
+
+import asyncio
+import threading
+import concurrent.futures
+import workers
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+def get_loop():
+    """获取（首次调用时启动）后台事件循环。"""
+    global _loop, _thread
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=loop.run_forever, name='lls-aio', daemon=True)
+            _thread.start()
+            _loop = loop
+    return _loop
+
+def in_loop():
+    """当前线程是否为事件循环线程。"""
+    return _thread is not None and threading.current_thread() is _thread
+
+def submit(coro):
+    """在后台事件循环中执行协程，返回 concurrent.futures.Future。"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def run(coro, timeout=None):
+    """在后台事件循环中执行协程并阻塞等待结果（不能在事件循环线程中调用）。"""
+    if in_loop():
+        raise RuntimeError('aio.run() called from the event loop thread')
+    return submit(coro).result(timeout)
+
+class SyncIterator:
+    """
+    异步迭代器的同步包装，每次取值时在后台事件循环中执行一步。
+    关闭时异步迭代器也随之关闭；cancel 可在其他线程中调用，取消进行中的取值（及其中的请求），不必等到下一项到达。
+    """
+    def __init__(self, aiterator):
+        self.aiterator = aiterator
+        self._future = None
+        self._done = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            if self._done:
+                raise StopIteration
+            self._future = submit(self.aiterator.__anext__())
+        try:
+            return self._future.result()
+        except (StopAsyncIteration, concurrent.futures.CancelledError):
+            self.close()
+            raise StopIteration
+        except BaseException:
+            self.close()
+            raise
+
+    def cancel(self):
+        with self._lock:
+            self._done = True
+            if self._future is not None:
+                self._future.cancel()
+
+    def close(self):
+        with self._lock:
+            self._done = True
+            future, self._future = self._future, None
+        if future is not None and not future.done():
+            future.cancel()  # 关闭时仍有进行中的取值（在其他线程中）
+        if hasattr(self.aiterator, 'aclose'):
+            try:
+                run(self.aiterator.aclose())
+            except Exception:
+                pass
+
+def to_sync(aiterator):
+    """将异步迭代器转换为同步迭代器（见 SyncIterator）。"""
+    if in_loop():
+        raise RuntimeError('aio.to_sync() called from the event loop thread')
+    return SyncIterator(aiterator)
+
+def run_in_worker(fn, *args):
+    """在线程池中执行阻塞函数，返回可在事件循环中等待的 Future。"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result, error):
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def fun():
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(set_result, None, e)
+        else:
+            loop.call_soon_threadsafe(set_result, result, None)
+    workers.submit(fun)
+    return future
+
+async def to_async(iterator):
+    """
+    将同步迭代器（如自定义AI的generate）转换为异步生成器，阻塞的取值在线程池中执行。
+    """
+    it = iter(iterator)
+    lock = threading.Lock()  # 保证关闭时不与进行中的取值并发
+    end = object()
+
+    def step():
+        with lock:
+            return next(it, end)
+
+    def close():
+        with lock:
+            if hasattr(it, 'close'):
+                it.close()
+    try:
+        while True:
+            item = await run_in_worker(step)
+            if item is end:
+                return
+            yield item
+    finally:
+        workers.submit(close)
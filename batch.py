@@ -0,0 +1,193 @@
+"""
+batch.py
+非交互批量生成：从JSONL读取指令，按并发上限调用AI，结果以JSONL流式输出（按完成顺序）。
+
+用法：
+    python lls.py --batch runbook.jsonl -o out.jsonl -j 16
+    cat instructs.txt | python lls.py --batch - --ai chat --console-file ctx.txt
+
+输入每行是一个JSON对象，也可以是一行纯文本指令：
+    {"id": "disk-1", "instruct": "查看磁盘占用", "console": "...", "console_file": "ctx/disk-1.txt"}
+console_file 为相对路径时相对于输入文件所在目录。
+输出每行：{"id", "instruct", "cmd", "think", "error", "ttft", "latency"}（compare 模式另有 candidates）。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import aclosing, redirect_stdout
+
+def parse_item(line, n):
+    """解析一行输入，返回 dict；空行返回None。"""
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('{'):
+        item = json.loads(line)
+    else:
+        item = dict(instruct=line)
+    item.setdefault('id', n)
+    return item
+
+def read_items(f, base_dir, default_console):
+    for n, line in enumerate(f, 1):
+        try:
+            item = parse_item(line, n)
+        except ValueError as e:
+            yield dict(id=n, error=f'invalid input line: {e}')
+            continue
+        if item is None:
+            continue
+        if 'console' not in item:
+            path = item.get('console_file')
+            if path:
+                try:
+                    with open(os.path.join(base_dir, path), 'r', errors='replace') as cf:
+                        item['console'] = cf.read()
+                except OSError as e:
+                    item['error'] = f'console_file: {e}'
+            else:
+                item['console'] = default_console
+        yield item
+
+async def generate_one(ai, item):
+    """生成单条结果，记录首个非空输出耗时与总耗时。"""
+    res = dict(id=item['id'], instruct=item.get('instruct', ''), cmd='', think='', error=item.get('error'))
+    if res['error'] or not res['instruct']:
+        res['error'] = res['error'] or 'empty instruct'
+        res['ttft'] = res['latency'] = None
+        return res
+    begin = time.monotonic()
+    ttft = None
+    chunk = ('', '')
+    try:
+        async with aclosing(ai.agenerate(res['instruct'], item.get('console', ''))) as g:
+            async for chunk in g:
+                if ttft is None and (chunk[0] or chunk[1]):
+                    ttft = time.monotonic() - begin
+        cmd, think = str(chunk[0]), str(chunk[1])
+        if cmd.startswith('error:'):
+            res['error'] = cmd[len('error:'):].strip()
+        else:
+            res['cmd'], res['think'] = cmd, think
+        if len(chunk) > 2:
+            res['candidates'] = [dict(id=i, cmd=str(c), think=str(t)) for i, c, t in chunk[2]]
+    except Exception as e:
+        res['error'] = f'{type(e).__name__}: {e}'
+    res['ttft'] = None if ttft is None else round(ttft, 3)
+    res['latency'] = round(time.monotonic() - begin, 3)
+    return res
+
+def run(ai, items, out, concurrency=8):
+    """
+    并发执行所有条目，结果写入out，返回 (总数, 失败数)。
+    输入按需读取：同时进行中的请求不超过concurrency个，所有请求共享 aio 的事件循环。
+    写入out出错时不再提交新的条目，等进行中的请求结束后抛出该异常。
+    """
+    import aio
+    slots = threading.BoundedSemaphore(concurrency)
+    done = threading.Condition()
+    pending = set()
+    errors = []
+    counts = [0, 0]
+
+    async def process(item):
+        res = await generate_one(ai, item)
+        out.write(json.dumps(res, ensure_ascii=False) + '\n')
+        out.flush()
+        counts[0] += 1
+        if res['error']:
+            counts[1] += 1
+
+    def finished(future):
+        slots.release()
+        with done:
+            if future.exception() is not None:
+                errors.append(future.exception())
+            pending.discard(future)
+            done.notify_all()
+
+    for item in items:
+        slots.acquire()
+        if errors:
+            slots.release()
+            break
+        future = aio.submit(process(item))
+        with done:
+            pending.add(future)
+        future.add_done_callback(finished)
+    with done:
+        done.wait_for(lambda: not pending)
+    if errors:
+        raise errors[0]
+    return counts[0], counts[1]
+
+def select_ai(state, ids, fanout):
+    """按命令行参数选择AI；未配置任何AI时使用一个默认的对话AI。"""
+    mixed = state.ai
+    if not mixed.ais:
+        from ai.chat import ChatAI
+        mixed.add('chat', ChatAI())
+        mixed.switch('chat')
+    if ids:
+        for id in ids:
+            if id not in mixed.ais:
+                raise ValueError(f"no such ai '{id}' [{','.join(mixed.ais.keys())}]")
+        mixed.switch(ids[0])
+        if len(ids) > 1:
+            mixed.fanout_ids = ids
+            mixed.fanout_mode = fanout or 'race'
+        elif not fanout:
+            mixed.fanout_mode = None
+    if fanout:
+        mixed.fanout_mode = None if fanout == 'off' else fanout
+    return mixed
+
+def main(state, argv):
+    parser = argparse.ArgumentParser(prog='lls.py --batch', description='generate shell commands for many instructions')
+    parser.add_argument('input', nargs='?', default='-', help="JSONL or plain-text instructions ('-' for stdin)")
+    parser.add_argument('-o', '--output', default='-', help="JSONL results ('-' for stdout)")
+    parser.add_argument('-j', '--concurrency', type=int, default=8)
+    parser.add_argument('--ai', help='ai id, or comma separated ids to fan out')
+    parser.add_argument('--fanout', choices=['race', 'compare', 'off'])
+    parser.add_argument('--console-file', help='default console context for items without one')
+    args = parser.parse_args(argv)
+
+    from common import load_config, load_ai
+    # 载入配置时的提示与错误（如缺少 ~/.lls_ai_config）输出到stderr，stdout只有JSONL结果
+    with redirect_stdout(sys.stderr):
+        load_config(state)
+        load_ai(state)
+    try:
+        ai = select_ai(state, [i for i in (args.ai or '').split(',') if i], args.fanout)
+    except ValueError as e:
+        print('error:', e, file=sys.stderr)
+        return 2
+
+    default_console = ''
+    if args.console_file:
+        with open(args.console_file, 'r', errors='replace') as f:
+            default_console = f.read()
+    if args.input == '-':
+        f_in, base_dir = sys.stdin, os.getcwd()
+    else:
+        f_in, base_dir = open(args.input, 'r'), os.path.dirname(os.path.abspath(args.input))
+    f_out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    begin = time.monotonic()
+    try:
+        total, failed = run(ai, read_items(f_in, base_dir, default_console), f_out, max(1, args.concurrency))
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        print('error:', e, file=sys.stderr)
+        return 1
+    finally:
+        if f_in is not sys.stdin:
+            f_in.close()
+        if f_out is not sys.stdout:
+            f_out.close()
+    print(f'{total} items, {failed} failed, {time.monotonic() - begin:.2f}s', file=sys.stderr)
+    return 1 if failed else 0
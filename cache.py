@@ -0,0 +1,207 @@
+"""
+cache.py
+AI生成结果缓存，内存LRU + 磁盘持久化两级存储。
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import aclosing
+from collections import OrderedDict
+import aio
+
+memory_size = int(os.environ.get('LLS_CACHE_MEMORY_SIZE', '128'))
+disk_dir = os.environ.get('LLS_CACHE_DIR', os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_cache'))
+disk_ttl = float(os.environ.get('LLS_CACHE_TTL', str(7 * 24 * 3600)))
+disk_max_bytes = int(os.environ.get('LLS_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+class ResponseCache:
+    """
+    生成结果缓存，键为 (AI id, 模型, 渲染后请求内容) 的哈希。
+    内存层为有界LRU，磁盘层每个键一个文件，按TTL过期、按总大小淘汰最旧条目。
+    """
+    def __init__(self, memory_size=memory_size, disk_dir=disk_dir, ttl=disk_ttl, max_bytes=disk_max_bytes):
+        self.memory_size = memory_size
+        self.disk_dir = disk_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(ai_id, model, prompt):
+        h = hashlib.sha256()
+        for part in (ai_id, model, prompt):
+            h.update(str(part).encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + '.json')
+
+    def get(self, key):
+        """查询缓存，命中返回 (cmd, think)，否则返回None。"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry['time'] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry['cmd'], entry['think']
+                del self._memory[key]
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return entry['cmd'], entry['think']
+
+    def put(self, key, cmd, think):
+        """写入缓存（内存与磁盘）。"""
+        entry = dict(time=time.time(), cmd=cmd, think=think)
+        with self._lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+            if now - entry['time'] > self.ttl:
+                os.remove(path)
+                return None
+            os.utime(path)
+            return entry
+        except Exception:
+            return None
+
+    def _write_disk(self, key, entry):
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._path(key)
+            tmp = path + '.tmp'
+            data = json.dumps(entry).encode()
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = self._scan()[1]
+                else:
+                    self._disk_bytes += len(data)
+                if self._disk_bytes > self.max_bytes:
+                    self._evict()
+        except Exception:
+            pass
+
+    def _scan(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        return files, total
+
+    def _evict(self):
+        """淘汰过期及最旧的磁盘条目，直到总大小降到上限的80%以下（调用方持有锁）。"""
+        files, total = self._scan()
+        files.sort()
+        now = time.time()
+        for mtime, size, path in files:
+            if total <= self.max_bytes * 0.8 and now - mtime <= self.ttl:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def clear(self):
+        """清空内存与磁盘缓存（只删除缓存条目文件，目录中的其他文件不受影响）。"""
+        with self._lock:
+            self._memory.clear()
+            if os.path.isdir(self.disk_dir):
+                for name in os.listdir(self.disk_dir):
+                    if not name.endswith(('.json', '.json.tmp')):
+                        continue
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except OSError:
+                        pass
+            self._disk_bytes = 0
+
+_cache = None
+
+def get_cache():
+    """获取全局缓存实例。"""
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
+
+async def replay(cmd, think):
+    """以异步生成器形式回放缓存结果，与AI.agenerate接口一致。"""
+    yield '', ''
+    yield cmd, think
+
+async def record(key, generator, cache=None):
+    """
+    透传异步生成器输出，完整结束后将最终结果写入缓存。
+    中途取消或输出错误时不写入。
+    """
+    if cache is None:
+        cache = get_cache()
+    chunk = ('', '')
+    try:
+        async for chunk in generator:
+            yield chunk
+    finally:
+        if hasattr(generator, 'aclose'):
+            await generator.aclose()
+    cmd, think = chunk[0], chunk[1]
+    if cmd and not cmd.startswith('error:'):
+        await aio.run_in_worker(cache.put, key, cmd, think)
+
+async def cached_generate(ai_id, ai, instruct, console, retry=False):
+    """
+    带缓存的异步生成：命中则立即回放，否则调用ai.agenerate并记录结果。
+    ai.use_cache为0时不使用缓存；重试时除非ai.cache_retry为1，否则跳过读取缓存。
+    构建请求（可能读取少样本示例索引）与读取磁盘缓存在线程池中执行，不阻塞事件循环中的其他请求。
+    """
+    def prepare():
+        prompt = ai.cache_key(instruct, console) if getattr(ai, 'use_cache', 0) else None
+        if prompt is None:
+            return ai.agenerate(instruct, console)
+        cache = get_cache()
+        key = cache.key(ai_id, getattr(ai, 'model', None), prompt)
+        if not retry or getattr(ai, 'cache_retry', 0):
+            hit = cache.get(key)
+            if hit is not None:
+                return replay(*hit)
+        return record(key, ai.agenerate(instruct, console), cache)
+    async with aclosing(await aio.run_in_worker(prepare)) as g:
+        async for chunk in g:
+            yield chunk
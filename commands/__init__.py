@@ -8,20 +8,22 @@ import sys
 import time
 import traceback
 from display import show_line, read_line
-from common import print_context
+from common import print_context, char_mode
 from commands.registry import register
+from completion import complete_line, complete_ai_id, complete_config_key, complete_fanout
 
 # Step 1: 导入所有命令
 from commands.core import (
     cmd_quit, cmd_show_status, cmd_raw, cmd_chat, cmd_reset, 
-    cmd_clear, cmd_err, cmd_conf
+    cmd_clear, cmd_err, cmd_conf, cmd_cache, cmd_stats, cmd_rpc
 )
-from commands.terminal import cmd_watch, cmd_tty, cmd_esc
+from commands.terminal import cmd_watch, cmd_tty, cmd_esc, cmd_new, cmd_session, cmd_next, cmd_prev, cmd_detach
 from commands.generate import (
     cmd_generate_wrap, cmd_exec, cmd_exec_wrap, cmd_input, cmd_auto
 )
 from commands.ai import (
-    cmd_mode, cmd_create, cmd_remove, cmd_rename, cmd_ls, cmd_set, cmd_get
+    cmd_mode, cmd_create, cmd_remove, cmd_rename, cmd_ls, cmd_set, cmd_get,
+    cmd_fanout
 )
 
 # Step 2: 依次注册 - 就这一件事
@@ -34,19 +36,28 @@ register(['c', 'clear'], cmd_clear)
 register(['w', 'watch'], cmd_watch)
 register(['t', 'tty'], cmd_tty)
 register(['esc'], cmd_esc)
+register(['new'], cmd_new)
+register(['ss', 'session', 'sessions'], cmd_session)
+register(['next'], cmd_next)
+register(['prev'], cmd_prev)
+register(['detach'], cmd_detach)
 register(['g', 'gen', 'generate'], cmd_generate_wrap)
 register(['e', 'exec'], cmd_exec_wrap)
 register(['i', 'input'], cmd_input)
 register(['a', 'auto'], cmd_auto)
 register(['err'], cmd_err)
 register(['conf', 'config', 'configs'], cmd_conf)
-register(['set'], cmd_set)
-register(['get'], cmd_get)
-register(['m', 'mode'], cmd_mode)
+register(['cache'], cmd_cache)
+register(['stats'], cmd_stats)
+register(['rpc'], cmd_rpc)
+register(['set'], cmd_set, complete=complete_config_key)
+register(['get'], cmd_get, complete=complete_config_key)
+register(['m', 'mode'], cmd_mode, complete=complete_ai_id)
 register(['create'], cmd_create)
-register(['remove', 'del', 'delete'], cmd_remove)
+register(['remove', 'del', 'delete'], cmd_remove, complete=complete_ai_id)
 register(['rename'], cmd_rename)
 register(['l', 'ls'], cmd_ls)
+register(['fanout'], cmd_fanout, complete=complete_fanout)
 
 # 导出注册接口
 from commands.registry import execute_command, get_command
@@ -89,7 +100,8 @@ def line_mode(state):
         while True:
             try:
                 # 读取行模式下的用户输入
-                cmd = read_line(cancel='q', include_last=False, id='line_mode', no_save=['q'])
+                cmd = read_line(cancel='q', include_last=False, id='line_mode', no_save=['q'],
+                                complete=lambda text: complete_line(state, text))
                 cmd = cmd.strip()
                 args = None
                 
@@ -118,27 +130,4 @@ def line_mode(state):
         state.mode = 'char'
 
 
-def char_mode(state):
-    """
-    字符模式，逐字符读取，支持模式切换
-    Ctrl-E 切换到 line_mode
-    Ctrl-G 切换到 prompt_mode
-    """
-    try:
-        output = ''
-        chars = os.read(sys.stdin.fileno(), 10240).decode()
-        for c in chars:
-            if c in ['\005']:  # Ctrl-E
-                state.mode = 'line'
-            elif c in ['\007']:  # Ctrl-G
-                state.mode = 'prompt'
-            else:
-                output += c
-        return output
-    except Exception as e:
-        print('error:', e, end='\r\n')
-        state.err = traceback.format_exc()
-        return ''
-
-
 __all__ = ['execute_command', 'get_command', 'read_command', 'char_mode', 'line_mode', 'prompt_mode']
@@ -5,6 +5,7 @@ AI 实例管理相关命令：mode, create, remove, rename, ls, set, get 等
 
 from display import show_line, read_line, read_lines
 from ai.registry import to_ai_type
+from completion import complete_ai_id
 
 
 def cmd_mode(state, args):
@@ -22,7 +23,7 @@ def cmd_mode(state, args):
             if state.ai.ais[id] == state.ai.ai:
                 info = f"(select-ai) current ai is '{id}' {ids} "
                 break
-        id = read_line(info, cancel='', include_last=False)
+        id = read_line(info, cancel='', include_last=False, complete=lambda text: complete_ai_id(state, text))
     
     if not id:
         return
@@ -75,7 +76,8 @@ def cmd_remove(state, args):
         for id in state.ai.ais.keys():
             if state.ai.ais[id] == state.ai.ai:
                 break
-        id = read_line(f"(remove-ai) current ai is '{id}' {ids} ", cancel='', include_last=False)
+        id = read_line(f"(remove-ai) current ai is '{id}' {ids} ", cancel='', include_last=False,
+                       complete=lambda text: complete_ai_id(state, text))
         if not id:
             return
     
@@ -96,7 +98,8 @@ def cmd_rename(state, args):
         if state.ai.ais[id] == state.ai.ai:
             break
     
-    id = read_line(f"(rename-ai) current ai is '{id}' {ids} ", cancel='', include_last=False)
+    id = read_line(f"(rename-ai) current ai is '{id}' {ids} ", cancel='', include_last=False,
+                   complete=lambda text: complete_ai_id(state, text))
     if not id:
         return
     
@@ -181,3 +184,37 @@ def cmd_get(state, args):
         import traceback
         print('error:', e, end='\r\n')
         state.err = traceback.format_exc()
+
+
+def cmd_fanout(state, args):
+    """
+    设置多 AI 并发生成模式
+
+    格式：fanout <race|compare> <id1,id2,...>，fanout off 关闭
+    race: 第一个完成的非空命令胜出；compare: 所有结果并列显示，按数字键选择
+    """
+    if not args:
+        ids = ','.join(state.ai.fanout_ids)
+        show_line(f"fanout mode: {state.ai.fanout_mode or 'off'} [{ids}]")
+        return
+
+    args = args.split()
+    mode = args[0]
+    if mode in ['off', 'none']:
+        state.ai.fanout_mode = None
+        show_line('fanout off')
+        return
+
+    if mode not in ['race', 'compare'] or len(args) < 2:
+        print('usage: fanout <race|compare> <id1,id2,...> | fanout off', end='\r\n')
+        return
+
+    ids = [id for id in ','.join(args[1:]).split(',') if id]
+    unknown = [id for id in ids if id not in state.ai.ais]
+    if unknown:
+        show_line(f"no such ai '{','.join(unknown)}'")
+        return
+
+    state.ai.fanout_mode = mode
+    state.ai.fanout_ids = ids
+    show_line(f"fanout {mode} [{','.join(ids)}]")
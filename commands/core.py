@@ -5,6 +5,7 @@ commands/core.py
 
 import sys
 import os
+import traceback
 import termios
 from terminal import print_screen_perfect
 from display import show_line
@@ -85,3 +86,55 @@ def cmd_conf(state, args):
     显示当前 AI 实例的参数配置
     """
     state.ai.printConfigs(end='\r\n')
+
+
+def cmd_cache(state, args):
+    """
+    显示 AI 生成缓存状态
+
+    子命令：clear 清空缓存
+    """
+    from cache import get_cache
+    c = get_cache()
+    if args in ['clear']:
+        c.clear()
+        print('cache cleared', end='\r\n')
+    else:
+        print(f'cache hits: {c.hits}, misses: {c.misses}, memory: {len(c._memory)}/{c.memory_size}, dir: {c.disk_dir}', end='\r\n')
+
+
+def cmd_rpc(state, args):
+    """
+    显示或控制 RPC 服务（Unix 域套接字上的 JSON-RPC）
+
+    子命令：start [路径] 启动服务；stop 停止服务
+    """
+    import rpc
+    args = (args or '').split()
+    if args[:1] == ['start']:
+        try:
+            server = rpc.start(state, args[1] if len(args) > 1 else None)
+            print(f'rpc listening on {server.path}', end='\r\n')
+        except Exception as e:
+            print('error:', e, end='\r\n')
+            state.err = traceback.format_exc()
+    elif args[:1] == ['stop']:
+        rpc.stop()
+        print('rpc stopped', end='\r\n')
+    elif state.rpc is not None:
+        print(f'rpc listening on {state.rpc.path}, clients: {len(state.rpc.clients)}', end='\r\n')
+    else:
+        print('rpc is not running', end='\r\n')
+
+
+def cmd_stats(state, args):
+    """
+    显示各 AI 实例的生成统计
+
+    包括请求数、错误、重试、超时、对冲请求次数与首 token 耗时分位数，以及最近一次生成的终端输出字节数
+    """
+    from generate import get_stats
+    for id, ai in state.ai.ais.items():
+        print(f'{id}: {get_stats(ai).summary()}', end='\r\n')
+    if state.render_stats:
+        print(f'last render: {state.render_stats}', end='\r\n')
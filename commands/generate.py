@@ -7,8 +7,10 @@ import os
 import sys
 import time
 import traceback
-from display import show_line, read_line, read_lines, clear_lines, print_lines, record_line
+from display import show_line, read_line, read_lines, record_line, StreamRenderer
 from common import print_context, check_cancel, cancelable, save_history
+from completion import complete_command, suggest_command
+import frecency
 from commands.core import cmd_show
 
 
@@ -58,9 +60,12 @@ def cmd_exec_handler(state, prompt='cmd', cmd=None, id='cmd'):
     返回 (cmd, instruct)
     """
     if cmd is None:
-        cmd = read_line(f'({prompt}): ', cancel='', include_last=False, id=id)
+        cmd = read_line(f'({prompt}): ', cancel='', include_last=False, id=id,
+                        complete=lambda text: complete_command(state, text),
+                        suggest=lambda text: suggest_command(state, text))
     else:
         record_line(cmd, id=id)
+    frecency.get_index().add(cmd)
     
     instruct = None
     if '#' in cmd:
@@ -71,6 +76,57 @@ def cmd_exec_handler(state, prompt='cmd', cmd=None, id='cmd'):
     return cmd, instruct
 
 
+def format_candidates(prompt, candidates):
+    """
+    格式化 compare 模式下的多个候选结果，每个候选一行
+    """
+    lines = []
+    for i, (id, cmd, think) in enumerate(candidates):
+        if cmd:
+            text = cmd
+        elif think:
+            text = 'thinking...'
+        else:
+            text = 'waiting...'
+        lines.append(f'({prompt}-{i + 1}:{id}): {text}')
+    return '\n'.join(lines)
+
+
+def format_chunk(prompt, chunk):
+    """
+    格式化生成过程中的显示文本
+    """
+    if len(chunk) > 2:
+        # compare 模式：多个候选并列显示
+        return format_candidates(prompt, chunk[2])
+    gen_cmd, gen_think = chunk[0], chunk[1]
+    if gen_cmd:
+        return f'({prompt}-cmd): ' + gen_cmd
+    elif gen_think:
+        return f'({prompt}-think): ' + gen_think
+    else:
+        return f'({prompt}-cmd): waiting...'
+
+
+def pick_candidate(prompt, candidates, cmd, think):
+    """
+    compare 模式下由用户按数字键选择一个候选，直接回车选择第一个；Ctrl-C/Ctrl-D 放弃本次生成，返回 (None, None)
+    """
+    choices = [c for c in candidates if c[1]]
+    if len(choices) <= 1:
+        return cmd, think
+    text = format_candidates(prompt, choices) + f'\n({prompt}-pick): [1-{len(choices)}] '
+    while True:
+        pick = read_line(text, max_chars=1, cancel='cancel', exit='cancel', include_last=False)
+        if pick == 'cancel':
+            return None, None
+        if pick in ['', '\r', '\n']:
+            pick = '1'
+        if pick.isdigit() and 1 <= int(pick) <= len(choices):
+            _, cmd, think = choices[int(pick) - 1]
+            return cmd, think
+
+
 def cmd_generate(state, args):
     """
     AI 生成命令主流程
@@ -110,28 +166,24 @@ def cmd_generate(state, args):
     
     while True:
         if output is not None:
-            lines_all, lines_cur = 1, 1
-            os.write(sys.stdout.fileno(), f'\033[2K\r({prompt}-cmd): waiting...'.encode())
+            renderer = StreamRenderer()
+            renderer.render(f'({prompt}-cmd): waiting...')
             cancelled = False
-            gen_cmd, gen_think = '', ''
+            last, pending = ('', ''), None
             try:
-                prev_len = 0
-                for chunk in cancelable(output):
-                    gen_cmd, gen_think = chunk[0], chunk[1]
-                    if gen_cmd:
-                        text = f'({prompt}-cmd): ' + gen_cmd
-                    elif gen_think:
-                        text = f'({prompt}-think): ' + gen_think
-                    else:
-                        text = f'({prompt}-cmd): waiting...'
-                    clear_lines(lines_all, lines_cur, clear=len(text) < prev_len)
-                    lines_all, lines_cur = print_lines(text)
-                    prev_len = len(text)
-                del prev_len
+                for chunk in cancelable(output, idle=renderer.interval):
+                    if chunk is not None:
+                        last = pending = chunk
+                    if pending is not None and renderer.ready():
+                        renderer.render(format_chunk(prompt, pending))
+                        pending = None
             except KeyboardInterrupt:
                 cancelled = True
             
-            lines_all, lines_cur = clear_lines(lines_all, lines_cur)
+            renderer.clear()
+            state.render_stats = renderer.stats()
+            gen_cmd, gen_think = last[0], last[1]
+            candidates = last[2] if len(last) > 2 else None
             if not cancelled:
                 cmd, think = gen_cmd, gen_think
             else:
@@ -139,6 +191,11 @@ def cmd_generate(state, args):
                     cmd, think = gen_think, ''
                 else:
                     cmd, think = gen_cmd, gen_think
+            if candidates is not None and not cancelled:
+                cmd, think = pick_candidate(prompt, candidates, cmd, think)
+                if cmd is None:
+                    cmd = ''
+                    break
             gen_time = time.time()
             output = None
         
@@ -171,7 +228,7 @@ def cmd_generate(state, args):
         elif confirm in ['k', 'think']:
             show_think = True
         elif confirm in ['r', 're', 'retry']:
-            output = state.ai.generate(instruct, context)
+            output = state.ai.generate(instruct, context, retry=True)
         elif confirm in ['e', 'edit']:
             instruct = read_instruct(prompt, value=instruct, state=state)
             if instruct == '':
@@ -180,7 +237,9 @@ def cmd_generate(state, args):
             output = state.ai.generate(instruct, context)
         elif confirm in ['t', 'teach']:
             default = 'y'
-            cmd = read_line(f'({prompt}-cmd): ', include_last=False, id='cmd')
+            cmd = read_line(f'({prompt}-cmd): ', include_last=False, id='cmd',
+                            complete=lambda text: complete_command(state, text),
+                            suggest=lambda text: suggest_command(state, text))
             if cmd == '':
                 break
         elif confirm in ['s', 'show', 'status']:
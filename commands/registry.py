@@ -4,17 +4,21 @@ commands/registry.py
 """
 
 import traceback
+from completion import Trie
 
 # 全局命令表
 _commands = {}
+# 命令名与别名的前缀树，用于 Tab 补全
+command_trie = Trie()
 
 
-def register(names, func):
+def register(names, func, complete=None):
     """
     注册命令
     
     names: str 或 [str, ...] - 命令名称与别名
     func: 函数对象 - 前两个参数应为 (state, args)
+    complete: 可选，参数的补全函数 (state, args) -> (起始位置, 候选列表)，见 completion.py
     不返回任何东西
     """
     # 规范化 names 为列表
@@ -33,12 +37,14 @@ def register(names, func):
         'names': names,
         'summary': summary,
         'details': details,
-        'module': func.__module__
+        'module': func.__module__,
+        'complete': complete,
     }
     
     # 为每个别名都注册
     for name in names:
         _commands[name] = info
+        command_trie.insert(name)
 
 
 def get_command(name):
@@ -138,3 +138,57 @@ def cmd_esc(state, args):
         print(f'debug mode: {state.screen.esc_debug}', end='\r\n')
     else:
         print('usage: esc [err|saved|status|debug]', end='\r\n')
+
+
+def cmd_new(state, args):
+    """
+    新建会话并切换过去
+
+    可指定要运行的命令，默认与第一个会话相同（字符模式快捷键 Ctrl-] c）
+    """
+    command = args.split() if args else None
+    state.sessions.create(command)
+    return 'exit'
+
+
+def cmd_session(state, args):
+    """
+    列出会话，或切换到指定序号的会话
+
+    session 列出；session N 切换（字符模式快捷键 Ctrl-] 1-9、Ctrl-] l）
+    """
+    if not args:
+        for line in state.sessions.describe():
+            print(line, end='\r\n')
+        return None
+    state.sessions.select(int(args))
+    return 'exit'
+
+
+def cmd_next(state, args):
+    """
+    切换到下一个会话（字符模式快捷键 Ctrl-] n）
+    """
+    state.sessions.step(1)
+    return 'exit'
+
+
+def cmd_prev(state, args):
+    """
+    切换到上一个会话（字符模式快捷键 Ctrl-] p）
+    """
+    state.sessions.step(-1)
+    return 'exit'
+
+
+def cmd_detach(state, args):
+    """
+    断开当前客户端，会话继续在后台运行（仅 --detach 启动时可用）
+
+    之后用 python lls.py --attach NAME 重新连接
+    """
+    if state.detach is None:
+        print('not a detached session, start with: python lls.py --detach NAME', end='\r\n')
+        return None
+    state.detach.detach()
+    return 'exit'
@@ -1,11 +1,18 @@
 import os
+import time
 import traceback
 import sys
 import json
 import select
 import queue
 import threading
+import importlib.util
+import contextlib
+import concurrent.futures
 from terminal import Screen
+import workers
+import history
+import frecency
 from ai.mixed import MixedAI
 
 class TerminalState:
@@ -29,6 +36,123 @@ class LLSState(TerminalState):
         self.mode = 'char'
         self.bufs = None
         self.total_chars = 0
+        self.render_stats = None  # 最近一次生成的渲染统计
+        self.rpc = None  # RPC服务（rpc.RPCServer）
+        self.sessions = None  # 多会话管理（sessions.SessionManager）
+        self.detach = None  # 可分离会话的中继（detach.DetachServer），仅 --detach 启动时存在
+        self.ai_config = None  # 启动时载入的AI配置，退出时据此合并各会话的修改
+        self.loaded = threading.Event()  # 后台加载（配置、历史、命令模块）完成标志
+        self.calls = MainCalls()  # 交给主线程执行的调用（如RPC执行命令）
+
+class MainCalls:
+    """
+    交给主线程执行的调用。主线程在字符模式等待输入时执行它们，
+    使其他线程发起的命令不会与主线程争抢键盘输入、同时绘制终端。
+    """
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+
+    def submit(self, fn):
+        """提交调用，返回 concurrent.futures.Future。"""
+        future = concurrent.futures.Future()
+        self._queue.put((fn, future))
+        try:
+            os.write(self.wake_w, b'.')
+        except BlockingIOError:
+            pass
+        return future
+
+    def run(self):
+        """在主线程中执行已提交的调用。"""
+        try:
+            os.read(self.wake_r, 4096)
+        except BlockingIOError:
+            pass
+        while not self._queue.empty():
+            fn, future = self._queue.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn())
+                except BaseException as e:
+                    future.set_exception(e)
+
+class StartupProfile:
+    """
+    启动耗时分析，设置环境变量 LLS_STARTUP_PROFILE=1 时启用。
+    """
+    def __init__(self, enabled=False, start=None):
+        self.enabled = enabled
+        self.start = time.perf_counter() if start is None else start
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """计时上下文：with profile.phase('name'): ..."""
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            cost = time.perf_counter() - begin
+            with self._lock:
+                self.phases.append((name, begin - self.start, cost, threading.current_thread().name))
+
+    def report(self, end='\r\n'):
+        if not self.enabled:
+            return
+        lines = ['startup profile:']
+        with self._lock:
+            for name, begin, cost, thread in self.phases:
+                lines.append(f'  {name:<10} {cost * 1000:8.1f}ms  (at {begin * 1000:7.1f}ms, {thread})')
+        lines.append(f'  {"total":<10} {(time.perf_counter() - self.start) * 1000:8.1f}ms')
+        os.write(sys.stderr.fileno(), (end.join(lines) + end).encode())
+
+def char_mode(state):
+    """
+    字符模式，逐字符读取，支持模式切换
+    Ctrl-E 切换到 line_mode
+    Ctrl-G 切换到 prompt_mode
+    Ctrl-] 会话快捷键前缀（见 sessions.py）
+    粘贴的内容原样转发，不解释其中的快捷键；子进程未开启括号粘贴模式时去掉粘贴标记。
+    等待输入时执行其他线程交给主线程的调用（见 MainCalls）。
+    """
+    try:
+        from display import read_chars, paste_reader, paste_begin, paste_end
+        readable, _, _ = select.select([sys.stdin.fileno(), state.calls.wake_r], [], [])
+        if sys.stdin.fileno() not in readable:
+            state.calls.run()
+            return ''
+        output = ''
+        sessions = state.sessions
+        for kind, chars in paste_reader.feed(read_chars()):
+            if kind == 'paste':
+                output += chars
+                continue
+            if kind in ['begin', 'end']:
+                if state.screen.bracketed_paste:
+                    output += paste_begin if kind == 'begin' else paste_end
+                continue
+            for c in chars:
+                if sessions is not None and (sessions.prefix or c == '\035'):
+                    if output:
+                        # 切换会话前，先把已读的输入交给原会话
+                        os.write(state.master_fd, output.encode())
+                        output = ''
+                    output += sessions.key(c)
+                elif c in ['\005']:  # Ctrl-E
+                    state.mode = 'line'
+                elif c in ['\007']:  # Ctrl-G
+                    state.mode = 'prompt'
+                else:
+                    output += c
+        return output
+    except Exception as e:
+        print('error:', e, end='\r\n')
+        state.err = traceback.format_exc()
+        return ''
 
 def print_context(state):
     """
@@ -48,6 +172,7 @@ def save_history(state, prompt, context, cmd):
         with open(os.path.join(os.environ['HOME'], '.cmd_history'), 'a') as f:
             line = f"prompt: {prompt}\t{cmd}\n"
             f.write(line)
+        frecency.get_index().add(cmd, frecency.accept_boost)
     except Exception as e:
         print('error:', e, end='\r\n')
         state.err = traceback.format_exc()
@@ -64,84 +189,152 @@ def check_cancel(cancel_chars=['\x03','\x04']):
                 return True
     return False
 
-def cancelable(generator):
+def cancelable(generator, idle=None):
     """
     生成器包装，使其可被取消（如AI流式输出时可中断）
+    生成器在线程池中运行，每产出一项就写唤醒管道；本函数阻塞在 select(stdin, 管道) 上，不占用CPU
+    中断时若生成器支持 cancel（如 aio.to_sync 的结果），立即取消其进行中的请求，而不是等到下一项到达
+    指定idle（秒）时，若超过idle秒没有新数据则产出None，便于调用方刷新节流中的显示
     """
-    q = queue.Queue()
-    is_exit = False
+    q = queue.SimpleQueue()
+    stop = threading.Event()
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_w, False)
+    end = object()
+
+    def notify():
+        try:
+            os.write(wake_w, b'.')
+        except (BlockingIOError, OSError):
+            pass  # 管道已满（读端必然会被唤醒）或读端已关闭
+
     def read_fun():
         try:
             for i in generator:
-                if is_exit:
-                    generator.close()
-                    return
+                if stop.is_set():
+                    break
                 q.put(i)
+                notify()
+        except Exception as e:
+            q.put(e)
         finally:
-            q.put(generator) # End of generator
-    read_thread = threading.Thread(target=read_fun)
-    read_thread.start()
+            if stop.is_set():
+                generator.close()
+            q.put(end)
+            notify()
+            os.close(wake_w)
+
+    workers.submit(read_fun)
+    stdin = sys.stdin.fileno()
     try:
+        last_time = time.monotonic()
         while True:
-            if check_cancel():
+            timeout = None
+            if idle:
+                timeout = max(0, idle - (time.monotonic() - last_time))
+            f, _, _ = select.select([stdin, wake_r], [], [], timeout)
+            if stdin in f and check_cancel():
                 raise KeyboardInterrupt
-            if not q.empty():
-                i = q.get_nowait()
-                if i == generator: # End of generator
-                    break
-                else:
+            if wake_r in f:
+                os.read(wake_r, 4096)
+                while not q.empty():
+                    i = q.get()
+                    if i is end:
+                        return
+                    if isinstance(i, Exception):
+                        raise i
+                    last_time = time.monotonic()
                     yield i
-    except GeneratorExit:
-        generator.close()
+            elif not f and idle:
+                last_time = time.monotonic()
+                yield None
     finally:
-        is_exit = True
+        stop.set()
+        if hasattr(generator, 'cancel'):
+            generator.cancel()
+        os.close(wake_r)
 
-# ====== AI配置与历史加载/保存 ======
+# ====== 用户配置、AI配置与历史加载/保存 ======
+
+# 加载用户自定义配置 ~/.llsrc.py（如有）
+def load_config(state):
+    config_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.llsrc.py')
+    if os.path.exists(config_file_path):
+        try:
+            # 动态加载配置模块
+            spec = importlib.util.spec_from_file_location(name='lls_config', location=config_file_path)
+            lls_config_module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(lls_config_module)
+        except Exception as e:
+            print('error:', e, end='\r\n')
+            state.err = traceback.format_exc()
 
 # 加载AI配置与实例
 def load_ai(state):
+    import ai.chat, ai.text  # 注册AI类型
     config_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_ai_config')
-    state.ai = MixedAI.from_config(config_file_path)
+    ai = MixedAI.from_config(config_file_path)
+    state.ai_config = ai.save_config()
+    if state.sessions is not None:
+        state.sessions.adopt_ai(ai)  # 同时替换加载完成前创建的会话中的空AI
+    else:
+        state.ai = ai
+    # 后台预热少样本示例索引，避免首次生成时加载历史
+    from retrieval import get_index
+    threading.Thread(target=get_index().sync, daemon=True).start()
+    # 后台预热AI客户端，避免首次生成时导入openai与建立连接的延迟
+    from generate import warmup
+    warmup()
     #if len(state.ai.ais) == 0:
     #    cmd_create(state, 'text', 'text')
     #    cmd_create(state, 'chat', 'chat')
 
 # 保存AI配置与实例
 def save_ai(state):
+    """保存AI配置；有多个会话时合并各会话相对启动时配置的修改。"""
     config_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_ai_config')
-    state.ai.save_config(config_file_path)
+    if state.sessions is None or state.ai_config is None:
+        state.ai.save_config(config_file_path)
+        return
+    config = merge_ai_configs(state.ai_config, state.sessions.ai_configs())
+    with open(config_file_path, 'w') as f:
+        json.dump(config, f)
+
+def merge_ai_configs(base, configs):
+    """
+    以启动时的配置base为基础，依次合入各会话的AI配置（configs中后面的优先，当前会话在最后）：
+    与base不同的AI实例视为在该会话中修改或新建，base中有而该会话中没有的视为删除。
+    当前AI与并发模式取最后一个配置。
+    """
+    ais = dict(base['ai'])
+    for config in configs:
+        for id, c in config['ai'].items():
+            if base['ai'].get(id) != c:
+                ais[id] = c
+        for id in base['ai']:
+            if id not in config['ai']:
+                ais.pop(id, None)
+    merged = dict(configs[-1], ai=ais)
+    if merged.get('current_ai_id') not in ais:
+        merged['current_ai_id'] = next(iter(ais), None)
+    return merged
 
 # ====== 历史缓冲区管理 ======
 
 def load_bufs(state):
+    """准备历史日志（必要时迁移旧版历史文件）；各输入缓冲区在首次使用时按需载入，见 display.load_history_buf。"""
     try:
-        history_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_history')
-        with open(history_file_path, 'r') as f:
-            history = json.load(f)
-        for id in history.keys():
-            buf = Screen()
-            buf.insert_mode = True
-            buf.limit_move = True
-            buf.max_height = 1
-            buf.auto_move_to_end = True
-            buf.lines = history.get(id)
-            buf.x = 0
-            buf.y = len(buf.lines) - 1
-            state.bufs[id] = buf
+        history.get_history().prepare()
+        workers.submit(history.get_history().index)  # 在后台预先构建 Ctrl-R 搜索索引
+        workers.submit(frecency.load)  # 在后台载入命令补全的使用记录
     except Exception as e:
         print('error: load history failed', end='\r\n')
         state.err = 'load history failed\n' + traceback.format_exc()
 
 def save_bufs(state):
+    """历史在输入时已逐条写入日志，退出时只需关闭日志文件。"""
     try:
-        history_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_history')
-        history = {}
-        for id in state.bufs.keys():
-            buf = state.bufs.get(id)
-            history[id] = buf.lines
-        text = json.dumps(history)
-        with open(history_file_path, 'w') as f:
-            f.write(text)
+        history.get_history().close()
     except Exception as e:
         print('error: save history failed', end='\r\n')
         state.err = 'save history failed\n' + traceback.format_exc()
@@ -157,6 +350,8 @@ def sync_winsize(state):
     state.winsize = os.get_terminal_size()
     state.screen.max_height = state.winsize.lines
     set_winsize(state.slave_fd, state.winsize.lines, state.winsize.columns)
+    if state.sessions is not None:
+        state.sessions.sync_winsize()
 
 # 设置终端窗口大小
 def set_winsize(fd, row, col, xpix=0, ypix=0):
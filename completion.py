@@ -0,0 +1,131 @@
+"""
+completion.py
+Tab 补全：前缀树，以及行模式命令名、AI id、配置项、执行过的命令的补全函数。
+补全函数的形式为 complete(text) -> (被补全词的起始位置, 候选列表)，text 为光标之前的输入。
+"""
+
+class Trie:
+    """
+    前缀树。insert/remove 的开销与词长成正比，complete 按字典序返回以前缀开头的词，取够数量即停止。
+    节点为 dict：字符 -> 子节点，键 None 表示在此结束的词。
+    """
+    def __init__(self, words=()):
+        self.root = {}
+        self.size = 0
+        for word in words:
+            self.insert(word)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, word):
+        node = self._find(word)
+        return node is not None and None in node
+
+    def _find(self, prefix):
+        node = self.root
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return None
+        return node
+
+    def insert(self, word):
+        node = self.root
+        for c in word:
+            node = node.setdefault(c, {})
+        if None not in node:
+            node[None] = word
+            self.size += 1
+
+    def remove(self, word):
+        path = []
+        node = self.root
+        for c in word:
+            child = node.get(c)
+            if child is None:
+                return False
+            path.append((node, c))
+            node = child
+        if None not in node:
+            return False
+        del node[None]
+        self.size -= 1
+        for parent, c in reversed(path):  # 删除不再有词的分支
+            if parent[c]:
+                break
+            del parent[c]
+        return True
+
+    def complete(self, prefix, limit=None):
+        node = self._find(prefix)
+        if node is None:
+            return []
+        words = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if None in node:
+                words.append(node[None])
+                if limit is not None and len(words) >= limit:
+                    break
+            stack.extend(node[c] for c in sorted((c for c in node if c is not None), reverse=True))
+        return words
+
+def complete_word(trie, text, sep=' '):
+    """补全 text 中最后一个词（以sep分隔）。"""
+    start = max(text.rfind(s) for s in sep) + 1
+    return start, trie.complete(text[start:])
+
+_config_tries = {}
+
+def config_trie(ai):
+    """当前AI配置项名称的前缀树，按配置项集合缓存。"""
+    configs = ai.configs() if ai is not None else None
+    keys = tuple(key for key, _ in configs or [])
+    trie = _config_tries.get(keys)
+    if trie is None:
+        trie = _config_tries[keys] = Trie(keys)
+    return trie
+
+def complete_ai_id(state, text):
+    """补全AI id。"""
+    return complete_word(state.ai.id_trie, text, sep=' ,')
+
+def complete_config_key(state, text):
+    """补全当前AI的配置项名称（只补全第一个参数）。"""
+    if ' ' in text:
+        return len(text), []
+    return complete_word(config_trie(state.ai), text)
+
+fanout_modes = Trie(['race', 'compare', 'off'])
+
+def complete_fanout(state, text):
+    """补全 fanout 的模式，以及之后以逗号分隔的AI id。"""
+    if ' ' not in text:
+        return complete_word(fanout_modes, text)
+    return complete_ai_id(state, text)
+
+def complete_line(state, text):
+    """
+    line_mode 输入的补全：第一个词补全命令名，之后交给命令注册时提供的补全函数。
+    """
+    from commands.registry import get_command, command_trie
+    if ' ' not in text:
+        return 0, command_trie.complete(text)
+    name, args = text.split(' ', 1)
+    info = get_command(name)
+    if info is None or info.get('complete') is None:
+        return len(text), []
+    start, candidates = info['complete'](state, args)
+    return len(name) + 1 + start, candidates
+
+def complete_command(state, text):
+    """补全整条命令（exec/input 提示符），按使用频率与最近程度排序，见 frecency.py。"""
+    from frecency import get_index
+    return 0, get_index().complete(text)
+
+def suggest_command(state, text):
+    """输入时在光标后以灰色显示的建议命令。"""
+    from frecency import get_index
+    return get_index().suggest(text)
@@ -0,0 +1,106 @@
+"""
+conn.py
+非阻塞套接字连接的读写缓冲，供 rpc.py 与 detach.py 中以 selectors 处理客户端的服务线程使用。
+"""
+
+import os
+import stat
+import socket
+import tempfile
+import selectors
+
+max_buffer = 4 * 1024 * 1024
+
+class Conn:
+    """
+    一个客户端连接。send 把数据追加到写缓冲并尽量写出，未写完的部分在套接字可写时由 flush 继续。
+    send/flush 返回 False 表示连接应由调用方断开：写出出错，或客户端长期不读取使写缓冲超过 max_buffer。
+    """
+    def __init__(self, sock, sel, data=None, max_buffer=max_buffer):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.sel = sel
+        self.data = data  # 在 sel 中注册时附带的数据
+        self.max_buffer = max_buffer
+        self.rbuf = b''
+        self.wbuf = bytearray()
+
+    def recv(self):
+        """读取一次，返回数据；连接已关闭时返回 b''，暂无数据时返回 None。"""
+        try:
+            return self.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return None
+        except OSError:
+            return b''
+
+    def send(self, data):
+        self.wbuf += data
+        if len(self.wbuf) > self.max_buffer:
+            return False
+        return self.flush()
+
+    def flush(self):
+        try:
+            n = self.sock.send(self.wbuf)
+            del self.wbuf[:n]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            return False
+        self.sel.modify(self.sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if self.wbuf else 0), self.data)
+        return True
+
+def probe(path):
+    """路径上的套接字是否有服务在监听（能否连接）。"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def prepare_path(path):
+    """
+    准备监听路径：目录不存在时创建（仅本用户可访问）；删除上次异常退出遗留的套接字文件。
+    路径上已有其他类型的文件或仍在监听的套接字时抛出异常，不会删除。
+    """
+    dir = os.path.dirname(path)
+    if dir:
+        os.makedirs(dir, mode=0o700, exist_ok=True)
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f'{path} exists and is not a socket')
+    if probe(path):
+        raise FileExistsError(f'{path} is in use')
+    os.remove(path)
+
+def listen(path, backlog=16):
+    """
+    在path上监听（非阻塞）。套接字先在同目录下仅本用户可访问的临时目录中创建并设为0600，再改名到path，
+    任何时刻其他用户都无法连接；不修改进程的umask，不影响其他线程创建的文件。
+    """
+    prepare_path(path)
+    tmp = tempfile.mkdtemp(prefix='.lls-', dir=os.path.dirname(path) or None)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        tmp_path = os.path.join(tmp, 'sock')
+        sock.bind(tmp_path)
+        os.chmod(tmp_path, 0o600)
+        os.rename(tmp_path, path)
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except Exception:
+        sock.close()
+        raise
+    finally:
+        try:
+            os.rmdir(tmp)
+        except OSError:
+            pass
+    return sock
@@ -0,0 +1,133 @@
+"""
+context.py
+控制台上下文构建，按近似token预算压缩发送给AI的控制台输出。
+"""
+
+import re
+
+_digits = re.compile(r'\d+')
+_spaces = re.compile(r'\s+')
+_repeats = re.compile(r'([^\w\s])\1+')
+_error = re.compile(r'error|fail|fatal|exception|traceback|denied|not found|no such|错误|失败|异常', re.I)
+
+def estimate_tokens(text):
+    """估算token数：ASCII约4字符一个token，其他字符（如中文）约一字一个token。"""
+    ascii_chars = sum(1 for c in text if c < '\x80')
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+def similar_key(line):
+    """相似行判定键：忽略数字、空白与重复符号的差异（如进度条重绘）。"""
+    return _spaces.sub(' ', _repeats.sub(r'\1', _digits.sub('#', line))).strip()
+
+def collapse_lines(lines):
+    """去除行尾空白、首尾空行，合并连续空行与连续相似行（保留首尾两行）。"""
+    lines = [line.rstrip() for line in lines]
+    while lines and lines[-1] == '':
+        lines.pop()
+    start = 0
+    while start < len(lines) and lines[start] == '':
+        start += 1
+    res = []
+    prev_key = None
+    run = 0
+    mid = None
+
+    def flush():
+        if run == 2:
+            res.insert(len(res) - 1, mid)
+        elif run > 2:
+            res.insert(len(res) - 1, f'[... {run - 1} similar lines omitted ...]')
+
+    for line in lines[start:]:
+        key = similar_key(line)
+        if key == prev_key:
+            if key == '':
+                continue
+            run += 1
+            if run == 1:
+                res.append(line)
+            else:
+                if run == 2:
+                    mid = res[-1]
+                res[-1] = line
+            continue
+        flush()
+        prev_key = key
+        run = 0
+        res.append(line)
+    flush()
+    return res
+
+def truncate_line(line, max_tokens):
+    """截断超长单行，保留首尾。"""
+    if estimate_tokens(line) <= max_tokens:
+        return line
+    keep = max(max_tokens, 8)
+    return line[:keep] + ' [... line truncated ...] ' + line[-keep:]
+
+def build_context(console, max_tokens=2000, max_lines=None, head_lines=3):
+    """
+    压缩控制台输出到约max_tokens个token以内（省略标记也计入预算）。
+    保留最近的输出（含当前提示符行），优先保留中间被省略部分的错误行，以及开头几行，省略处插入标记。
+    max_tokens<=0 时只做清理与合并，不限制预算。
+    """
+    lines = console.split('\n')
+    if max_tokens > 0:
+        # 先截断超长行再合并，合并产生的省略标记不会被截断
+        lines = [truncate_line(line.rstrip(), max_tokens // 4) for line in lines]
+    lines = collapse_lines(lines)
+    if max_lines is not None and len(lines) > max_lines:
+        lines = lines[-max_lines:]
+    if max_tokens <= 0:
+        return '\n'.join(lines)
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    if sum(costs) <= max_tokens:
+        return '\n'.join(lines)
+
+    n = len(lines)
+    marker_cost = estimate_tokens(f'[... {n} lines omitted ...]') + 1  # 每个省略标记的开销（上限）
+    keep = set()
+    used = marker_cost  # 尚未保留任何行时，全部内容是一段省略
+
+    def take(i, limit):
+        nonlocal used
+        if i in keep:
+            return False
+        # 保留第i行后省略段数的变化：两侧都已保留（或到头）时该段消失，都未保留时一分为二
+        left = i == 0 or i - 1 in keep
+        right = i == n - 1 or i + 1 in keep
+        cost = costs[i] + marker_cost * ((not left and not right) - (left and right))
+        if used + cost > limit:
+            return False
+        keep.add(i)
+        used += cost
+        return True
+
+    take(n - 1, max_tokens)
+    # 最近输出占预算的60%
+    i = n - 2
+    while i >= 0 and take(i, max_tokens * 0.6):
+        i -= 1
+    tail_start = i + 1
+    # 中间部分的错误行（从新到旧）
+    for j in range(tail_start - 1, -1, -1):
+        if _error.search(lines[j]):
+            take(j, max_tokens * 0.85)
+    # 开头几行
+    for j in range(min(head_lines, tail_start)):
+        take(j, max_tokens * 0.95)
+    # 剩余预算继续向前扩展最近输出
+    while i >= 0 and (i in keep or take(i, max_tokens)):
+        i -= 1
+
+    res = []
+    skipped = 0
+    for j in range(n):
+        if j in keep:
+            if skipped:
+                res.append(f'[... {skipped} lines omitted ...]')
+                skipped = 0
+            res.append(lines[j])
+        else:
+            skipped += 1
+    return '\n'.join(res)
@@ -0,0 +1,363 @@
+"""
+detach.py
+可分离会话：lls 在后台进程中运行（持有子进程终端、屏幕与AI上下文），客户端通过本地套接字连接与断开。
+
+用法：
+    python lls.py --detach work [-- bash]   # 在后台启动名为 work 的会话并连接
+    python lls.py --attach work             # 重新连接（Ctrl-\\ 断开，可用 LLS_DETACH_KEY 修改）
+    python lls.py --list                    # 列出会话
+
+后台进程把自己的标准输入输出接到一个外层伪终端上，中继线程始终读取外层终端的输出并写入一个 Screen，
+再转发给当前连接的客户端。客户端连接时先收到按该 Screen 生成的屏幕快照，之后是实时输出，
+不需要回放历史输出。
+
+客户端发往服务端的消息格式为：1字节类型 + 4字节长度 + 内容；类型 i 为输入，w 为窗口大小，d 为断开。
+服务端发往客户端的是原始终端输出。
+"""
+
+import os
+import sys
+import pty
+import glob
+import tty
+import atexit
+import fcntl
+import signal
+import socket
+import struct
+import select
+import termios
+import selectors
+import threading
+from terminal import Screen, render_screen
+from conn import Conn, probe, listen
+
+detach_key = os.environ.get('LLS_DETACH_KEY', '\034').encode()  # 默认 Ctrl-\
+header = struct.Struct('!cI')
+
+def socket_dir():
+    return os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_sessions')
+
+def socket_path(name):
+    return os.path.join(socket_dir(), f'{name}.sock')
+
+def frame(kind, data=b''):
+    return header.pack(kind, len(data)) + data
+
+class DetachServer:
+    """
+    运行在后台 lls 进程中的中继：外层伪终端输出 -> Screen + 当前客户端，客户端输入 -> 外层伪终端。
+    同一时刻只有一个客户端；新客户端发送第一个窗口大小消息后成为当前客户端，旧客户端被断开。
+    """
+    def __init__(self, master_fd, path):
+        self.master_fd = master_fd
+        self.path = path
+        self.screen = Screen()
+        self.screen.keep_logs_when_clean_screen = True
+        self.client = None
+        self.conns = {}  # sock -> conn.Conn
+        self.running = False
+        self._sel = selectors.DefaultSelector()
+        self._sock = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.path) and probe(self.path):
+            raise RuntimeError(f'session {os.path.basename(self.path)[:-5]} already exists')
+        sock = listen(self.path, 4)
+        self._sock = sock
+        self._sel.register(sock, selectors.EVENT_READ, 'accept')
+        self._sel.register(self.master_fd, selectors.EVENT_READ, 'master')
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name='lls-detach', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+        return self
+
+    def shutdown(self):
+        """进程退出时：先删除套接字文件（客户端据此判断会话已结束），转发剩余输出后断开客户端。"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            try:
+                sys.stdout.flush()
+                os.remove(self.path)
+            except OSError:
+                pass
+            os.set_blocking(self.master_fd, False)
+            try:
+                while True:
+                    data = os.read(self.master_fd, 65536)
+                    if not data:
+                        break
+                    self._output(data)
+            except OSError:
+                pass
+            for sock, conn in list(self.conns.items()):
+                try:
+                    sock.setblocking(True)
+                    sock.settimeout(1)
+                    sock.sendall(conn.wbuf)
+                except OSError:
+                    pass
+                sock.close()
+            self.conns.clear()
+            self.client = None
+            self._sock.close()
+
+    def _loop(self):
+        while self.running:
+            events = self._sel.select(1)
+            with self._lock:
+                if not self.running:
+                    return
+                for key, mask in events:
+                    if key.data == 'accept':
+                        self._accept()
+                    elif key.data == 'master':
+                        try:
+                            data = os.read(self.master_fd, 65536)
+                        except OSError:
+                            data = b''
+                        if not data:
+                            self._sel.unregister(self.master_fd)
+                            continue
+                        self._output(data)
+                    elif key.fileobj in self.conns:
+                        if mask & selectors.EVENT_READ:
+                            self._read(key.fileobj)
+                        if mask & selectors.EVENT_WRITE and key.fileobj in self.conns:
+                            self._flush(key.fileobj)
+
+    def _accept(self):
+        try:
+            sock, _ = self._sock.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self.conns[sock] = Conn(sock, self._sel)
+        self._sel.register(sock, selectors.EVENT_READ)
+
+    def _drop(self, sock):
+        if sock is self.client:
+            self.client = None
+        self.conns.pop(sock, None)
+        try:
+            self._sel.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+    def _output(self, data):
+        self.screen.write(data)
+        if self.client is not None:
+            self._send(self.client, data)
+
+    def _send(self, sock, data):
+        if not self.conns[sock].send(data):
+            self._drop(sock)  # 客户端长期不读取，重新连接时会收到快照
+
+    def _flush(self, sock):
+        if not self.conns[sock].flush():
+            self._drop(sock)
+
+    def _read(self, sock):
+        conn = self.conns[sock]
+        data = conn.recv()
+        if data is None:
+            return
+        if not data:
+            return self._drop(sock)
+        conn.rbuf += data
+        while len(conn.rbuf) >= header.size and sock in self.conns:
+            kind, size = header.unpack_from(conn.rbuf)
+            if len(conn.rbuf) < header.size + size:
+                break
+            payload = conn.rbuf[header.size:header.size + size]
+            conn.rbuf = conn.rbuf[header.size + size:]
+            self._message(sock, kind, payload)
+
+    def _message(self, sock, kind, payload):
+        if kind == b'w':
+            rows, cols = struct.unpack('!HH', payload)
+            self.attach(sock, rows, cols)
+        elif kind == b'i':
+            if sock is self.client:
+                os.write(self.master_fd, payload)
+        elif kind == b'd':
+            self._drop(sock)
+
+    def attach(self, sock, rows, cols):
+        """设置窗口大小；新客户端成为当前客户端并收到屏幕快照。"""
+        if sock is not self.client:
+            if self.client is not None:
+                old = self.client
+                self._send(old, b'\r\n[detached by another client]\r\n')
+                if old in self.conns:
+                    self._drop(old)
+            self.client = sock
+        size = struct.unpack('HHHH', fcntl.ioctl(self.master_fd, termios.TIOCGWINSZ, b'\0' * 8))
+        if size[:2] != (rows, cols):
+            # 大小变化时 lls 收到 SIGWINCH 并同步到子进程，由子进程自行重绘
+            fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+        self.screen.max_height = rows
+        snapshot = render_screen(self.screen, rows, cols)
+        if self.screen.bracketed_paste:
+            snapshot += '\033[?2004h'
+        self._send(sock, snapshot.encode())
+
+    def detach(self):
+        """断开当前客户端（会话继续在后台运行）。"""
+        with self._lock:
+            if self.client is not None:
+                self._send(self.client, b'\r\n')
+                if self.client is not None:
+                    self._flush(self.client)
+                    self._drop(self.client)
+
+def daemonize(name, attach=True):
+    """
+    创建后台会话进程。父进程等待后台进程就绪后连接（attach为假时只打印套接字路径）并以其结果退出；
+    后台进程以外层伪终端作为控制终端，从本函数返回后继续正常的 lls 启动流程，返回 DetachServer。
+    """
+    path = socket_path(name)
+    if os.path.exists(path) and probe(path):
+        print(f'error: session {name} already exists', file=sys.stderr)
+        exit(1)
+    try:
+        cols, rows = os.get_terminal_size(sys.stdin.fileno())
+    except OSError:
+        rows, cols = 0, 0
+    rows, cols = rows or 24, cols or 80
+    ready_r, ready_w = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(ready_w)
+        ok = b''
+        while True:
+            data = os.read(ready_r, 4096)
+            if not data:
+                break
+            ok += data
+        os.close(ready_r)
+        if ok != b'ok':
+            print(f'error: failed to start session {name}: {ok.decode(errors="replace")}', file=sys.stderr)
+            exit(1)
+        if not attach:
+            print(path)
+            exit(0)
+        exit(attach_session(name))
+
+    os.close(ready_r)
+    try:
+        os.setsid()
+        master_fd, slave_fd = pty.openpty()
+        fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+        fcntl.ioctl(slave_fd, termios.TIOCSCTTY, 0)
+        server = DetachServer(master_fd, path).start()
+    except Exception as e:
+        os.write(ready_w, str(e).encode())
+        os._exit(1)
+    for fd in [0, 1, 2]:
+        os.dup2(slave_fd, fd)
+    os.close(slave_fd)
+    os.write(ready_w, b'ok')
+    os.close(ready_w)
+    return server
+
+def attach_session(name):
+    """连接到会话，返回退出码。"""
+    path = socket_path(name)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        print(f'error: cannot attach to {name}: {e}', file=sys.stderr)
+        return 1
+    stdin, stdout = sys.stdin.fileno(), sys.stdout.fileno()
+    old_tty = termios.tcgetattr(stdin)
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_w, False)
+
+    def winsize():
+        cols, rows = os.get_terminal_size(stdin)
+        return frame(b'w', struct.pack('!HH', rows, cols))
+
+    def on_winch(signum, frame):
+        try:
+            os.write(wake_w, b'.')
+        except OSError:
+            pass
+    old_handler = signal.signal(signal.SIGWINCH, on_winch)
+    detached = False
+    try:
+        tty.setraw(stdin)
+        sock.sendall(winsize())
+        while True:
+            readable, _, _ = select.select([stdin, sock, wake_r], [], [])
+            if wake_r in readable:
+                os.read(wake_r, 4096)
+                sock.sendall(winsize())
+            if stdin in readable:
+                data = os.read(stdin, 4096)
+                if detach_key in data:
+                    data = data[:data.index(detach_key)]
+                    if data:
+                        sock.sendall(frame(b'i', data))
+                    sock.sendall(frame(b'd'))
+                    detached = True
+                    break
+                sock.sendall(frame(b'i', data))
+            if sock in readable:
+                try:
+                    data = sock.recv(65536)
+                except OSError:
+                    data = b''
+                if not data:
+                    detached = os.path.exists(path)  # 会话结束时服务端先删除套接字文件
+                    break
+                os.write(stdout, data)
+    except OSError as e:
+        print(f'error: {e}', end='\r\n')
+    finally:
+        signal.signal(signal.SIGWINCH, old_handler)
+        os.write(stdout, b'\033[?2004l')
+        termios.tcsetattr(stdin, termios.TCSADRAIN, old_tty)
+        sock.close()
+        os.close(wake_r)
+        os.close(wake_w)
+    print(f'\n[detached from {name}]' if detached else f'\n[session {name} ended]')
+    return 0
+
+def list_sessions():
+    """列出存活的会话，清理失效的套接字文件。"""
+    names = []
+    for path in sorted(glob.glob(os.path.join(socket_dir(), '*.sock'))):
+        if probe(path):
+            names.append(os.path.basename(path)[:-len('.sock')])
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return names
+
+def parse_name(argv):
+    """解析 --detach 之后的参数，返回 (会话名, 剩余参数)。"""
+    if argv and not argv[0].startswith('-'):
+        return argv[0], argv[1:]
+    return 'default', argv
+
+def main(argv):
+    """处理 --attach [NAME] 与 --list。"""
+    if argv[0] == '--list':
+        for name in list_sessions():
+            print(name)
+        return 0
+    name, _ = parse_name(argv[1:])
+    if not sys.stdin.isatty():
+        print('error: --attach requires a terminal', file=sys.stderr)
+        return 1
+    return attach_session(name)
@@ -6,8 +6,47 @@ display.py
 
 import os
 import sys
+import time
+import codecs
+import threading
+import contextlib
 import unicodedata
+import history
 from terminal import Screen
+from editor import Editor
+
+# 流式输出渲染的最大帧率
+render_fps = float(os.environ.get('LLS_RENDER_FPS', '30'))
+# 累计写入终端的字节数（供调优统计）
+bytes_written = 0
+
+# 当前线程合并写入时的缓冲区，见 batched()
+_batch = threading.local()
+
+def write(data):
+    """写入终端并计数；在 batched() 中时先放入缓冲区。"""
+    global bytes_written
+    buffer = getattr(_batch, 'buffer', None)
+    if buffer is not None:
+        buffer += data
+        return
+    bytes_written += len(data)
+    os.write(sys.stdout.fileno(), data)
+
+@contextlib.contextmanager
+def batched():
+    """将其中的所有 write 合并为一次系统调用（可嵌套，最外层结束时写出）。"""
+    if getattr(_batch, 'buffer', None) is not None:
+        yield
+        return
+    _batch.buffer = bytearray()
+    try:
+        yield
+    finally:
+        data = bytes(_batch.buffer)
+        _batch.buffer = None
+        if data:
+            write(data)
 
 _char_widths = [
     (126,    1), (159,    0), (687,     1), (710,   0), (711,   1), 
@@ -52,35 +91,264 @@ def wrap_multi_lines(display, width=None, padding=0, end='\r\n'):
         n += c_width
     return output, lines
 
+def wrap_continue(text, width, col=0, end='\r\n'):
+    """从第col列开始续写文本并按宽度换行，返回 (输出, 新增行数, 结束列)。"""
+    output = ''
+    lines = 0
+    n = col
+    for c in text:
+        if c == '\n':
+            output += end
+            lines += 1
+            n = 0
+            continue
+        c_width = get_width(c)
+        if n + c_width > width:
+            output += end
+            lines += 1
+            n = 0
+        output += c
+        n += c_width
+    return output, lines, n
+
+def wrap_rows(text, width):
+    """按宽度折行，返回各行文本及文本末尾所在的 (行, 列)；列达到宽度时视为下一行行首。"""
+    rows = []
+    row = ''
+    n = 0
+    for c in text:
+        if c == '\n':
+            rows.append(row)
+            row = ''
+            n = 0
+            continue
+        c_width = get_width(c)
+        if n + c_width > width:
+            rows.append(row)
+            row = ''
+            n = 0
+        row += c
+        n += c_width
+    rows.append(row)
+    if n >= width:
+        return rows, (len(rows), 0)
+    return rows, (len(rows) - 1, n)
+
 def clear_lines(lines_all, lines_cur, clear=True):
     """清除多行终端输出。"""
+    out = b''
     if lines_all != lines_cur:
-        for _ in range(lines_all - lines_cur):
-            os.write(sys.stdout.fileno(), b'\r\033[1B')
-    for _ in range(lines_all - 1):
-        if clear:
-            os.write(sys.stdout.fileno(), b'\033[2K')
-        os.write(sys.stdout.fileno(), b'\r\033[1A')
+        out += b'\r\033[1B' * (lines_all - lines_cur)
+    out += ((b'\033[2K' if clear else b'') + b'\r\033[1A') * (lines_all - 1)
     if clear:
-        os.write(sys.stdout.fileno(), b'\033[2K')
-    os.write(sys.stdout.fileno(), b'\r')
+        out += b'\033[2K'
+    write(out + b'\r')
     return 1, 1
 
 def print_lines(text, cursor=None):
     """打印多行文本并高亮光标位置。"""
     line, lines_all = wrap_multi_lines(text)
-    os.write(sys.stdout.fileno(), b'\033[2K\r')
-    os.write(sys.stdout.fileno(), line.encode())
+    out = b'\033[2K\r' + line.encode()
     if cursor is not None and cursor != len(text):
-        for _ in range(lines_all - 1):
-            os.write(sys.stdout.fileno(), b'\r\033[1A')
+        out += b'\r\033[1A' * (lines_all - 1)
         line_prev, lines_cur = wrap_multi_lines(text[:cursor])
-        os.write(sys.stdout.fileno(), b'\r')
-        os.write(sys.stdout.fileno(), line_prev.encode())
+        out += b'\r' + line_prev.encode()
     else:
         lines_cur = lines_all
+    write(out)
     return lines_all, lines_cur
 
+class LineView:
+    """
+    行编辑器的增量重绘：记住上次输出的各行（按终端宽度折行后），只重写内容变化的行，
+    每次重绘（清除、文本、光标定位）只写入一次。
+    """
+    def __init__(self):
+        self.rows = []
+        self.row = 0  # 终端光标所在行，相对于第一行
+        self.height = 0  # 已占用的终端行数
+        self.width = None
+
+    def _move(self, out, row):
+        """移动到第row行行首；超出已占用的行时换行新增。"""
+        if row < self.row:
+            out.append(f'\033[{self.row - row}A')
+        elif row > self.row:
+            down = min(row, self.height - 1) - self.row
+            if down > 0:
+                out.append(f'\033[{down}B')
+            out.append('\r\n' * (row - self.row - max(down, 0)))
+        out.append('\r')
+        self.row = row
+        self.height = max(self.height, row + 1)
+
+    def render(self, text, cursor=None, ghost=''):
+        """ghost 为接在文本之后以灰色显示的提示，不影响光标位置。"""
+        width = os.get_terminal_size().columns
+        out = []
+        if width != self.width:
+            if self.rows:
+                self._clear(out)  # 宽度变化后旧的折行位置失效，整体重绘
+            self.width = width
+        rows, end = wrap_rows(text, width)
+        if cursor is not None and cursor != len(text):
+            end = wrap_rows(text[:cursor], width)[1]
+        if ghost:
+            # 逐字符折行，文本各行是加上提示后各行的前缀
+            text_rows = rows
+            rows = wrap_rows(text + ghost, width)[0]
+            for i, line in enumerate(rows):
+                n = len(text_rows[i]) if i < len(text_rows) else 0
+                if n < len(line):
+                    rows[i] = line[:n] + '\033[2m' + line[n:] + '\033[0m'
+        for i, line in enumerate(rows):
+            if i >= len(self.rows) or self.rows[i] != line:
+                self._move(out, i)
+                out.append('\033[2K' + line)
+        for i in range(len(rows), len(self.rows)):
+            self._move(out, i)
+            out.append('\033[2K')
+        self._move(out, end[0])
+        if end[1]:
+            out.append(f'\033[{end[1]}C')
+        self.rows = rows
+        write(''.join(out).encode())
+
+    def _clear(self, out):
+        self._move(out, 0)
+        out.append('\033[J')
+        self.rows = []
+        self.height = 1
+
+    def clear(self):
+        """清除已输出的内容，光标回到第一行行首。"""
+        out = []
+        self._clear(out)
+        write(''.join(out).encode())
+
+class StreamRenderer:
+    """
+    流式输出的节流增量渲染器。
+    文本只在末尾增长时只输出新增部分，之前的内容变化时才清除重绘；帧率不超过fps。
+    """
+    def __init__(self, fps=None):
+        if fps is None:
+            fps = render_fps
+        self.interval = 1 / fps if fps > 0 else 0
+        self.text = ''
+        self.lines_all, self.lines_cur = 1, 1
+        self.col = 0
+        self.width = None
+        self.last_time = 0
+        self.frames = 0
+        self.redraws = 0
+        self.start_bytes = bytes_written
+
+    def ready(self):
+        """是否已到下一帧的时间。"""
+        return time.monotonic() - self.last_time >= self.interval
+
+    def render(self, text):
+        """立即渲染文本。"""
+        self.last_time = time.monotonic()
+        if text == self.text:
+            return
+        width = os.get_terminal_size().columns
+        self.frames += 1
+        if self.text and text.startswith(self.text) and width == self.width and self.lines_cur == self.lines_all:
+            output, lines, self.col = wrap_continue(text[len(self.text):], width, self.col)
+            write(output.encode())
+            self.lines_all += lines
+            self.lines_cur = self.lines_all
+        else:
+            self.redraws += 1
+            with batched():
+                clear_lines(self.lines_all, self.lines_cur)
+                self.lines_all, self.lines_cur = print_lines(text)
+            self.col = wrap_continue(text, width)[2]
+        self.text = text
+        self.width = width
+
+    def clear(self):
+        """清除已渲染的内容。"""
+        self.text = ''
+        self.col = 0
+        self.lines_all, self.lines_cur = clear_lines(self.lines_all, self.lines_cur)
+        return self.lines_all, self.lines_cur
+
+    def stats(self):
+        return f'{self.frames} frames ({self.redraws} redraws), {bytes_written - self.start_bytes} bytes'
+
+paste_begin = '\033[200~'
+paste_end = '\033[201~'
+enable_paste = b'\033[?2004h'
+disable_paste = b'\033[?2004l'
+
+class PasteReader:
+    """
+    从输入中分离括号粘贴的内容。feed 返回事件列表：('key', 按键文本)、('begin', '')、('paste', 粘贴文本)、('end', '')；
+    粘贴内容随读随出，被拆在两次读取之间的标记暂存到下次。
+    """
+    def __init__(self):
+        self.pasting = False
+        self.pending = ''
+
+    def feed(self, chars):
+        data = self.pending + chars
+        self.pending = ''
+        events = []
+        while data:
+            marker = paste_end if self.pasting else paste_begin
+            kind = 'paste' if self.pasting else 'key'
+            i = data.find(marker)
+            if i < 0:
+                keep = self._partial(data, marker)
+                text, self.pending = data[:len(data) - keep], data[len(data) - keep:]
+                if text:
+                    events.append((kind, text))
+                break
+            if i:
+                events.append((kind, data[:i]))
+            events.append(('end' if self.pasting else 'begin', ''))
+            self.pasting = not self.pasting
+            data = data[i + len(marker):]
+        return events
+
+    def _partial(self, data, marker):
+        """data 末尾是标记的前缀时返回其长度；不在粘贴中时不暂存过短的前缀，以免延迟单独的Esc键。"""
+        for n in range(min(len(marker) - 1, len(data)), 0, -1):
+            if data.endswith(marker[:n]):
+                return n if self.pasting or n >= 3 else 0
+        return 0
+
+# 标准输入的粘贴状态在字符模式与行编辑之间共享
+paste_reader = PasteReader()
+_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+def read_chars():
+    """读取一次标准输入并解码（多字节字符被拆开时留到下次）。"""
+    return _decoder.decode(os.read(sys.stdin.fileno(), 10240))
+
+def read_input():
+    """读取一次输入，返回事件列表：('key', 单个字符) 或 ('paste', 整段粘贴文本)。"""
+    events = []
+    for kind, text in paste_reader.feed(read_chars()):
+        if kind == 'key':
+            events.extend(('key', c) for c in text)
+        elif kind == 'paste':
+            events.append(('paste', text))
+    return events
+
+def clean_paste(text, multiline=False):
+    """统一换行并去掉控制字符；单行输入时各行以空格连接。"""
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if not multiline:
+        text = ' '.join(line for line in text.split('\n') if line)
+    return ''.join(c for c in text if c == '\n' or unicodedata.category(c)[0] != "C")
+
+# 历史缓冲区首次使用时载入的条目数，向上翻过最早一条时再载入同样数量的更早条目
+history_page = int(os.environ.get('LLS_HISTORY_PAGE', '200'))
+
 bufs = {}
 
 def get_bufs():
@@ -88,6 +356,137 @@ def get_bufs():
     global bufs
     return bufs
 
+def load_history_buf(id):
+    """创建历史缓冲区，只载入最近一页历史。"""
+    entries, cursor = history.get_history().recent(id, history_page)
+    buf = Screen()
+    buf.insert_mode = True
+    buf.limit_move = True
+    buf.max_height = 1
+    buf.auto_move_to_end = True
+    buf.max_lines = 1 << 30  # 不丢弃行，已载入的条目需与 cursor 保持连续
+    buf.lines = entries + ['']
+    buf.x = 0
+    buf.y = len(buf.lines) - 1
+    buf.older = cursor
+    return buf
+
+def page_older(buf):
+    """光标在已载入的最早一条历史上时，从日志载入更早的一页。"""
+    older = getattr(buf, 'older', None)
+    if older is None or not older.more():
+        return
+    entries = older.older(history_page)
+    if entries:
+        buf.lines = entries + buf.lines
+        buf.y += len(entries)
+
+def search_loaded(query, id=None, limit=50):
+    """在已载入的历史缓冲区中搜索（搜索索引构建完成前使用），结果由近到远。"""
+    q = query.lower()
+    results = []
+    seen = set()
+    for key, buf in list(bufs.items()):
+        if id is not None and key != id:
+            continue
+        for text in reversed(buf.lines):
+            if text and text not in seen and q in text.lower():
+                seen.add(text)
+                results.append(text)
+                if len(results) >= limit:
+                    return results
+    return results
+
+def search_history(id, line='', events=None):
+    """
+    Ctrl-R 增量搜索历史：输入即搜索，再按 Ctrl-R 切换到更早的匹配，Ctrl-T 在当前id与所有id之间切换。
+    回车接受并提交，Esc/Tab/方向键接受后继续编辑，Ctrl-C/Ctrl-G 取消。
+    搜索索引在后台构建完成前，只搜索已载入的历史缓冲区（提示中显示 indexing）。
+    返回 (文本, 是否提交, 未处理的输入事件)，取消时文本为None。events 为已读取但尚未处理的输入事件。
+    """
+    h = history.get_history()
+    query = ''
+    scope = id
+    n = 0
+    match = ''
+    view = LineView()
+    while True:
+        results = h.search(query, scope, n + 1) if query else []
+        indexing = results is None
+        if indexing:
+            results = search_loaded(query, scope, n + 1)
+        failing = query and len(results) <= n
+        if failing and results:
+            n = len(results) - 1
+        match = results[n] if n < len(results) else ''
+        label = f"({'failing ' if failing else ''}reverse-i-search{' all' if scope is None else ''}{', indexing' if indexing else ''})'"
+        view.render(f"{label}{query}': {match}", len(label) + len(query))
+        if not events:
+            events = read_input()
+        (kind, c), events = events[0], events[1:]
+        if kind == 'paste':
+            query += clean_paste(c)
+            n = 0
+            continue
+        if c == '\x12':
+            n += 1
+            continue
+        if c == '\x14':
+            scope = None if scope is not None else id
+            n = 0
+            continue
+        if c == '\x7f':
+            query = query[:-1]
+            n = 0
+            continue
+        if unicodedata.category(c)[0] != "C":
+            query += c
+            n = 0
+            continue
+        view.clear()
+        if c in ['\x03', '\x07']:
+            return None, False, events
+        text = match if match else line
+        if c in ['\r', '\n']:
+            return text, True, events
+        if c != '\033' or events[:1] in [[('key', '[')], [('key', 'O')]]:
+            events = [(kind, c)] + events  # 方向键等交回编辑器处理
+        return text, False, events
+
+def tab_complete(buf, complete, tab=None):
+    """
+    Tab 补全当前行光标前的词。唯一候选时直接补全并加空格；多个候选时先补全公共前缀并列出候选，
+    再按 Tab 依次换成下一个候选。tab 为上一次的补全状态，返回新的状态（无候选列表时为None）。
+    """
+    line = buf.lines[buf.y]
+    if tab is None:
+        start, candidates = complete(line[:buf.x])
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            text, tab = candidates[0] + ' ', None
+        else:
+            prefix = os.path.commonprefix(candidates)
+            if len(prefix) > buf.x - start:
+                text, tab = prefix, (start, candidates, -1)
+            else:
+                text, tab = candidates[0], (start, candidates, 0)
+    else:
+        start, candidates, index = tab
+        index = (index + 1) % len(candidates)
+        text, tab = candidates[index], (start, candidates, index)
+    buf.lines[buf.y] = line[:start] + text + line[buf.x:]
+    buf.x = start + len(text)
+    return tab
+
+def format_candidates(tab, limit=50):
+    """候选列表的显示文本，当前选中的候选加方括号。"""
+    _, candidates, index = tab
+    items = [f'[{c}]' if i == index else c for i, c in enumerate(candidates[:limit])]
+    if len(candidates) > limit:
+        items.append(f'... ({len(candidates)})')
+    return '  '.join(items)
+
 def record_line(value, id):
     """记录一行内容到缓冲区。"""
     read_line(value=value, id=id, skip_input=True)
@@ -97,27 +496,22 @@ def show_line(msg):
     read_line(msg, max_chars=1, backspace='b')
 
 def read_lines(prompt='> ', include_last=False, value='', begin=None, cancel='', exit=None, backspace=None, buf=None):
-    """多行输入，支持编辑和撤销。"""
+    """多行输入，支持编辑和撤销。buf 为 editor.Editor，默认新建。"""
     if buf is None:
-        buf = Screen()
-    buf.insert_mode = True
-    buf.limit_move = True
-    buf.max_height = 1
-    buf.auto_remove_line = True
-    buf.auto_move_between_line = True
-    buf.write_chars(value)
+        buf = Editor()
+    buf.insert(value)
     cmd = None
     cancelled = False
     if begin:
         os.write(sys.stdout.fileno(), begin.encode())
-    cursor = 0
-    for line in buf.lines[:buf.y]:
-        cursor += len(prompt) + len(line) + 1
-    cursor += len(prompt) + buf.x
-    lines_all, lines_cur = print_lines(buf.text(begin=prompt), cursor)
+    write(enable_paste)
+    view = LineView()
+    view.render(*buf.render(prompt))
     while True:
-        chars = os.read(sys.stdin.fileno(), 10240).decode()
-        for c in chars:
+        for kind, c in read_input():
+            if kind == 'paste':
+                buf.insert(clean_paste(c, multiline=True))
+                continue
             if c in ['\x03']:
                 if cancel is not None:
                     cancelled = True
@@ -134,39 +528,47 @@ def read_lines(prompt='> ', include_last=False, value='', begin=None, cancel='',
                     lines += c
                 cmd = lines
                 break
+            if buf.esc:
+                if buf.esc != '\033' or c in '[O':
+                    buf.key(c)
+                    continue
+                buf.esc = ''  # 单独的Esc，之后的按键照常处理
             if c in ['\r','\n']:
-                buf.write_chars('\n')
+                buf.insert('\n')
             elif c in ['\x7f']:
                 if backspace is not None:
-                    buf.write_chars(backspace)
+                    for b in backspace:
+                        buf.key(b)
                 else:
-                    buf.write_chars('\b')
+                    buf.backspace()
             elif c in ['\033']:
-                buf.write_char(c)
+                buf.key(c)
             elif unicodedata.category(c)[0] == "C":
                 pass
             else:
-                buf.write_char(c)
+                buf.insert(c)
         if cmd is not None:
             break
-        clear_lines(lines_all, lines_cur)
-        cursor = 0
-        for line in buf.lines[:buf.y]:
-            cursor += len(prompt) + len(line) + 1
-        cursor += len(prompt) + buf.x
-        lines_all, lines_cur = print_lines(buf.text(begin=prompt), cursor)
-    clear_lines(lines_all, lines_cur)
+        view.render(*buf.render(prompt))
+    view.clear()
     return cmd
 
-def read_line(prompt=':', include_last=True, max_chars=-1, value='', begin=None, cancel=None, exit=None, backspace=None, id=None, no_save=None, skip_input=False, buf=None):
-    """单行输入，支持历史、撤销、编辑等。"""
+def read_line(prompt=':', include_last=True, max_chars=-1, value='', begin=None, cancel=None, exit=None, backspace=None, id=None, no_save=None, skip_input=False, buf=None, complete=None, suggest=None):
+    """
+    单行输入，支持历史、撤销、编辑等。complete 为 Tab 补全函数，见 completion.py。
+    suggest(text) 返回以当前输入开头的建议，多出的部分以灰色显示在光标后，在行尾按右方向键或 Ctrl-F 采用。
+    """
     global bufs
     if buf is not None:
         pass
     elif id is not None:
         buf = bufs.get(id)
         if buf is None:
-            buf = Screen()
+            try:
+                buf = load_history_buf(id)
+            except Exception as e:
+                print('error: load history failed:', e, end='\r\n')
+                buf = Screen()
             bufs[id] = buf
     else:
         buf = Screen()
@@ -187,10 +589,28 @@ def read_line(prompt=':', include_last=True, max_chars=-1, value='', begin=None,
     else:
         if begin:
             os.write(sys.stdout.fileno(), begin.encode())
-        lines_all, lines_cur = print_lines(prompt + buf.current_line(), len(prompt) + buf.x)
+        write(enable_paste)
+        view = LineView()
+        view.render(prompt + buf.current_line(), len(prompt) + buf.x)
+        pending = []
+        tab = None
+        ghost = ''
         while True:
-            chars = os.read(sys.stdin.fileno(), 10240).decode()
-            for c in chars:
+            events, pending = pending or read_input(), []
+            for i, (kind, c) in enumerate(events):
+                if kind == 'key' and c == '\t' and complete is not None and buf.mode == 'normal':
+                    tab = tab_complete(buf, complete, tab)
+                    continue
+                tab = None
+                if kind == 'paste':
+                    text = clean_paste(c)
+                    line = buf.lines[buf.y]
+                    buf.lines[buf.y] = line[:buf.x] + text + line[buf.x:]
+                    buf.x += len(text)
+                    if max_chars != -1 and len(buf.current_line()) >= max_chars:
+                        cmd = buf.current_line()
+                        break
+                    continue
                 if c in ['\x03']:
                     if cancel is not None:
                         cancelled = True
@@ -214,18 +634,45 @@ def read_line(prompt=':', include_last=True, max_chars=-1, value='', begin=None,
                         buf.write_chars('\b')
                 elif c in ['\033']:
                     buf.write_char(c)
+                elif c == '\x06' and ghost:
+                    buf.lines[buf.y] += ghost
+                    buf.x = len(buf.lines[buf.y])
+                elif c == '\x12' and id is not None and buf.mode == 'normal':
+                    view.clear()
+                    buf.y = len(buf.lines) - 1
+                    text, accept, pending = search_history(id, buf.current_line(), events[i+1:])
+                    if text is not None:
+                        buf.lines[buf.y] = text
+                        buf.x = len(text)
+                    if accept:
+                        cmd = text + '\r' if include_last else text
+                    break
                 elif unicodedata.category(c)[0] == "C":
                     pass
                 else:
+                    if c == 'A' and buf.y == 0 and buf.esc in ['\033[', '\033O']:
+                        page_older(buf)  # 向上翻过已载入的最早一条
+                    if c == 'C' and ghost and buf.esc in ['\033[', '\033O']:
+                        buf.lines[buf.y] += ghost  # 采用建议，之后的右移在行尾不起作用
+                        buf.x = len(buf.lines[buf.y])
                     buf.write_char(c)
                 if max_chars != -1 and len(buf.current_line()) >= max_chars:
                     cmd = buf.current_line()
                     break
             if cmd is not None:
                 break
-            clear_lines(lines_all, lines_cur)
-            lines_all, lines_cur = print_lines(prompt + buf.current_line(), len(prompt) + buf.x)
-        clear_lines(lines_all, lines_cur)
+            line = buf.current_line()
+            ghost = ''
+            if suggest is not None and tab is None and buf.mode == 'normal' and not buf.esc \
+                    and buf.y == len(buf.lines) - 1 and line and buf.x == len(line):
+                suggestion = suggest(line)
+                if suggestion and suggestion.startswith(line):
+                    ghost = suggestion[len(line):]
+            text = prompt + line
+            if tab is not None:
+                text += '\n' + format_candidates(tab)
+            view.render(text, len(prompt) + buf.x, ghost)
+        view.clear()
     buf.y = len(buf.lines) - 1
     if cancelled or cmd == '' or (len(buf.lines) > 1 and buf.lines[buf.y - 1] == cmd
             ) or (no_save is not None and cmd in no_save):
@@ -235,6 +682,11 @@ def read_line(prompt=':', include_last=True, max_chars=-1, value='', begin=None,
         buf.lines[buf.y] = cmd
         buf.x = len(buf.lines[buf.y])
         buf.write_char('\n')
+        if id is not None:
+            try:
+                history.get_history().append(id, cmd)
+            except Exception as e:
+                print('error: save history failed:', e, end='\r\n')
     return cmd
 
 if __name__ == '__main__':
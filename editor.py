@@ -0,0 +1,194 @@
+"""
+editor.py
+多行输入的编辑缓冲区（间隙缓冲区），供 display.read_lines 使用。
+在光标处插入、删除的均摊开销为常数，光标所在行列随编辑增量维护。
+"""
+
+import re
+
+# 编辑器处理的转义序列，其余的忽略
+_esc_keys = {
+    'A': 'up', 'B': 'down', 'C': 'right', 'D': 'left',
+    'H': 'home', 'F': 'end', '1~': 'home', '7~': 'home', '4~': 'end', '8~': 'end', '3~': 'delete',
+}
+_esc_end = re.compile(r'\033(\[[0-9;]*[~A-Za-z]|O[A-Za-z])')
+
+class GapBuffer:
+    """
+    间隙缓冲区：文本存放在列表中，光标处留有空隙。插入写入空隙，移动光标时把字符搬到空隙另一侧。
+    line/col 为光标所在的行与列（从0开始），随编辑与移动增量更新。
+    """
+    def __init__(self, text='', capacity=64):
+        self.buf = [''] * max(capacity, len(text) * 2)
+        self.start = 0  # 空隙起点（即光标位置）
+        self.end = len(self.buf)  # 空隙终点
+        self.lines = 1  # 总行数
+        self.line = 0
+        self.col = 0
+        if text:
+            self.insert(text)
+
+    def __len__(self):
+        return len(self.buf) - (self.end - self.start)
+
+    @property
+    def cursor(self):
+        return self.start
+
+    def text(self):
+        return ''.join(self.buf[:self.start]) + ''.join(self.buf[self.end:])
+
+    def _grow(self, need):
+        size = len(self.buf)
+        tail = size - self.end
+        new_size = max(size * 2, len(self) + need + 64)
+        self.buf[self.start:self.end] = [''] * (new_size - size + self.end - self.start)
+        self.end = new_size - tail
+
+    def insert(self, text):
+        """在光标处插入文本，光标移到插入内容之后。"""
+        if len(text) > self.end - self.start:
+            self._grow(len(text))
+        self.buf[self.start:self.start + len(text)] = text
+        self.start += len(text)
+        newlines = text.count('\n')
+        if newlines:
+            self.lines += newlines
+            self.line += newlines
+            self.col = len(text) - text.rindex('\n') - 1
+        else:
+            self.col += len(text)
+
+    def _col_at(self, pos):
+        """pos（在空隙之前）所在行的列号。"""
+        i = pos
+        while i > 0 and self.buf[i - 1] != '\n':
+            i -= 1
+        return pos - i
+
+    def backspace(self):
+        """删除光标前的字符（行首时与上一行合并）。"""
+        if self.start == 0:
+            return
+        self.start -= 1
+        if self.buf[self.start] == '\n':
+            self.lines -= 1
+            self.line -= 1
+            self.col = self._col_at(self.start)
+        else:
+            self.col -= 1
+
+    def delete(self):
+        """删除光标后的字符。"""
+        if self.end == len(self.buf):
+            return
+        if self.buf[self.end] == '\n':
+            self.lines -= 1
+        self.end += 1
+
+    def left(self):
+        if self.start == 0:
+            return
+        self.start -= 1
+        self.end -= 1
+        c = self.buf[self.start]
+        self.buf[self.end] = c
+        if c == '\n':
+            self.line -= 1
+            self.col = self._col_at(self.start)
+        else:
+            self.col -= 1
+
+    def right(self):
+        if self.end == len(self.buf):
+            return
+        c = self.buf[self.end]
+        self.buf[self.start] = c
+        self.start += 1
+        self.end += 1
+        if c == '\n':
+            self.line += 1
+            self.col = 0
+        else:
+            self.col += 1
+
+    def line_length(self):
+        """光标所在行的长度。"""
+        n = self.col
+        i = self.end
+        while i < len(self.buf) and self.buf[i] != '\n':
+            i += 1
+        return n + i - self.end
+
+    def home(self):
+        for _ in range(self.col):
+            self.left()
+
+    def end_of_line(self):
+        for _ in range(self.line_length() - self.col):
+            self.right()
+
+    def up(self):
+        """移到上一行的同一列（不超过该行长度）。"""
+        if self.line == 0:
+            return
+        col = self.col
+        self.home()
+        self.left()
+        self.home()
+        for _ in range(min(col, self.line_length())):
+            self.right()
+
+    def down(self):
+        """移到下一行的同一列（不超过该行长度）。"""
+        if self.line == self.lines - 1:
+            return
+        col = self.col
+        self.end_of_line()
+        self.right()
+        for _ in range(min(col, self.line_length())):
+            self.right()
+
+class Editor(GapBuffer):
+    """
+    在间隙缓冲区上处理按键：可打印字符插入，回车换行，退格删除，方向键/Home/End/Delete 编辑。
+    不完整的转义序列暂存，等后续输入补全。
+    """
+    def __init__(self, text=''):
+        super().__init__(text)
+        self.esc = ''
+
+    def key(self, c):
+        if self.esc:
+            self.esc += c
+            if len(self.esc) == 2 and c not in '[O':
+                self.esc = ''  # 单独的Esc，之后的按键照常处理
+                return self.key(c)
+            match = _esc_end.fullmatch(self.esc)
+            if match:
+                params = self.esc[2:]
+                self.esc = ''
+                # ~ 结尾的序列以第一个参数区分按键（之后的参数为修饰键，如 \033[3;5~），其余以结尾字母区分
+                self.action(_esc_keys.get(params.split(';')[0].rstrip('~') + '~' if params[-1] == '~' else params[-1]))
+            elif len(self.esc) > 16:
+                self.esc = ''
+            return
+        if c == '\033':
+            self.esc = c
+        elif c in ['\r', '\n']:
+            self.insert('\n')
+        elif c == '\b':
+            self.backspace()
+        else:
+            self.insert(c)
+
+    def action(self, name):
+        if name == 'end':
+            self.end_of_line()
+        elif name is not None:
+            getattr(self, name)()
+
+    def render(self, prompt):
+        """返回带提示符的显示文本及光标在其中的位置。"""
+        text = prompt + self.text().replace('\n', '\n' + prompt)
+        return text, self.cursor + (self.line + 1) * len(prompt)
@@ -0,0 +1,165 @@
+"""
+frecency.py
+命令补全的频率/最近程度（frecency）排序索引，供 exec/input 提示符的 Tab 补全与灰色提示使用。
+数据来自输入历史中执行过的命令（cmd、cmd_input）以及 ~/.cmd_history 中确认采用的AI命令。
+"""
+
+import os
+import math
+import heapq
+import threading
+import history
+
+history_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.cmd_history')
+# 半衰期（以命令条数计）：每执行这么多条命令，之前的使用记录权重减半
+half_life = float(os.environ.get('LLS_FRECENCY_HALF_LIFE', '200'))
+# 为前缀缓存排序结果的最大前缀长度，更长的前缀在该长度的桶内扫描
+max_depth = int(os.environ.get('LLS_FRECENCY_DEPTH', '24'))
+# ~/.cmd_history 最多读取末尾的字节数
+max_file_bytes = 4 << 20
+# 确认采用的AI命令相当于执行的次数
+accept_boost = 2
+
+def log_add(a, b):
+    """log2(2**a + 2**b)，避免权重随时间增长溢出。"""
+    if a < b:
+        a, b = b, a
+    return a + math.log2(1 + 2 ** (b - a))
+
+class FrecencyIndex:
+    """
+    命令的前缀索引，权重为各次使用按半衰期衰减后的总和（以log2保存）。
+    以命令序号而非时间计算衰减：新的使用相当于给所有旧记录打折，因此权重只增不减，
+    每个前缀可以缓存权重最高的top条命令，增量更新，查询只需查表。
+    超过max_depth的前缀在桶内最多扫描max_scan条，单次查询的开销有界。
+    """
+    def __init__(self, half_life=half_life, max_depth=max_depth, top=16, max_scan=2000):
+        self.half_life = half_life
+        self.max_depth = max_depth
+        self.top = top
+        self.max_scan = max_scan
+        self.commands = []  # 编号 -> 命令
+        self.weights = []  # 编号 -> log2权重
+        self.ids = {}  # 命令 -> 编号
+        self.prefixes = {}  # 前缀 -> 编号列表：短于max_depth时为按权重降序的top条，等于max_depth时为全部
+        self.clock = 0  # 本进程内新增使用的序号
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.commands)
+
+    def _add(self, text, seq, count=1):
+        n = self.ids.get(text)
+        new = n is None
+        weight = seq / self.half_life + math.log2(count)
+        if new:
+            n = self.ids[text] = len(self.commands)
+            self.commands.append(text)
+            self.weights.append(weight)
+        else:
+            self.weights[n] = weight = log_add(self.weights[n], weight)
+        weights = self.weights
+        prefixes = self.prefixes
+        for i in range(min(len(text), self.max_depth) + 1):
+            prefix = text[:i]
+            ids = prefixes.get(prefix)
+            if ids is None:
+                prefixes[prefix] = [n]
+            elif i == self.max_depth:
+                if new:
+                    ids.append(n)
+            elif n in ids:
+                ids.sort(key=weights.__getitem__, reverse=True)
+            elif len(ids) < self.top or weight > weights[ids[-1]]:
+                if len(ids) >= self.top:
+                    ids.pop()
+                ids.append(n)
+                ids.sort(key=weights.__getitem__, reverse=True)
+
+    def add(self, text, count=1):
+        """记录一次使用（count为相当的次数）。"""
+        text = text.strip()
+        if not text or '\n' in text:
+            return
+        with self._lock:
+            self.clock += 1
+            self._add(text, self.clock, count)
+
+    def build(self, entries):
+        """
+        加入已有的使用记录，entries 为 [(命令, 次数), ...]，按时间顺序，最后一条视为最近一次。
+        分批持有锁，构建期间的查询与 add 不会长时间等待。
+        """
+        total = len(entries)
+        for start in range(0, total, 1000):
+            with self._lock:
+                for i in range(start, min(start + 1000, total)):
+                    text, count = entries[i]
+                    text = text.strip()
+                    if text and '\n' not in text:
+                        self._add(text, i - total, count)
+
+    def complete(self, prefix, limit=None):
+        """以prefix开头的命令，按权重降序。锁被占用时返回空列表，不阻塞输入。"""
+        if not self._lock.acquire(blocking=False):
+            return []
+        try:
+            limit = limit or self.top
+            if len(prefix) < self.max_depth:
+                ids = self.prefixes.get(prefix, [])[:limit]
+            else:
+                bucket = self.prefixes.get(prefix[:self.max_depth], [])
+                commands = self.commands
+                ids = heapq.nlargest(limit, (n for n in bucket[-self.max_scan:] if commands[n].startswith(prefix)),
+                                     key=self.weights.__getitem__)
+            return [self.commands[n] for n in ids]
+        finally:
+            self._lock.release()
+
+    def suggest(self, prefix):
+        """权重最高的、比prefix更长的命令，没有时返回None。"""
+        if not prefix:
+            return None
+        for text in self.complete(prefix, 2):
+            if len(text) > len(prefix):
+                return text
+        return None
+
+def read_accepted(path=history_file_path, max_bytes=max_file_bytes):
+    """~/.cmd_history 末尾max_bytes字节中确认采用的AI命令。"""
+    try:
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            f.seek(max(0, size - max_bytes))
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    lines = data.decode(errors='replace').split('\n')
+    if size > max_bytes:
+        lines.pop(0)  # 开头可能是半行
+    cmds = []
+    for line in lines:
+        if line.startswith('prompt: ') and '\t' in line:
+            cmds.append(line.split('\t', 1)[1])
+    return cmds
+
+def load_entries(ids=('cmd', 'cmd_input')):
+    """读取已有的使用记录：先是确认采用的AI命令，之后是输入历史中的命令。"""
+    entries = [(cmd, accept_boost) for cmd in read_accepted()]
+    h = history.get_history()
+    for id in ids:
+        entries.extend((cmd, 1) for cmd in h.load(id))
+    return entries
+
+_index = None
+
+def get_index():
+    """获取全局命令索引实例（首次需调用 load 在后台载入已有记录）。"""
+    global _index
+    if _index is None:
+        _index = FrecencyIndex()
+    return _index
+
+def load():
+    """载入已有记录到全局索引。"""
+    get_index().build(load_entries())
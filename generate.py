@@ -4,24 +4,77 @@ OpenAI接口、AI配置管理底层。
 """
 
 import os
+import time
+import random
+import asyncio
+import inspect
+import threading
+import http.client
+from contextlib import aclosing
+from collections import deque
+import aio
 
 default_model = os.environ.get('LLS_OPENAI_MODEL', 'gpt-4o-mini')
 base_url = os.environ.get('LLS_OPENAI_BASE_URL', 'https://api.openai.com')
 api_key = os.environ.get('LLS_OPENAI_API_KEY', '')
+# openai: 使用openai库; builtin: 使用内置的 http.client 流式客户端
+http_client = os.environ.get('LLS_HTTP_CLIENT', 'openai')
+# 空闲长连接保持时间（秒）
+keepalive = float(os.environ.get('LLS_HTTP_KEEPALIVE', '300'))
 
 client = None
+_clients = {}
+_clients_lock = threading.Lock()
 
-def get_openai_client():
+def create_client(base_url, api_key):
     """
-    获取OpenAI客户端实例。
+    创建（异步）客户端实例。
     """
-    global client
-    from openai import OpenAI
-    client = OpenAI(
+    if http_client == 'builtin':
+        from http_client import HTTPClient
+        return HTTPClient(base_url, api_key)
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    return AsyncOpenAI(
        base_url=base_url,
-       api_key=api_key, 
+       api_key=api_key,
+       http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+           max_connections=100,
+           max_keepalive_connections=20,
+           keepalive_expiry=keepalive,
+       )),
     )
-    return client
+
+def get_openai_client(base_url=None, api_key=None):
+    """
+    获取OpenAI异步客户端实例，按 (base_url, api_key) 复用长期存活的客户端及其连接池。
+    未指定时使用调用时的模块变量（可在 ~/.llsrc.py 中修改）。客户端只在 aio 的共享事件循环中使用。
+    """
+    global client
+    if base_url is None:
+        base_url = globals()['base_url']
+    if api_key is None:
+        api_key = globals()['api_key']
+    key = (http_client, base_url, api_key)
+    with _clients_lock:
+        c = _clients.get(key)
+        if c is None:
+            c = _clients[key] = create_client(base_url, api_key)
+    client = c
+    return c
+
+def warmup():
+    """
+    后台预热客户端：提前导入依赖、创建客户端，内置客户端还会预先建立连接。
+    """
+    async def fun():
+        try:
+            c = get_openai_client()
+            if hasattr(c, 'connect'):
+                await c.connect()
+        except Exception:
+            pass
+    aio.submit(fun())
 
 def convert_output(output):
     """
@@ -36,3 +89,320 @@ def convert_output(output):
     think = think.strip()
     return output, think
 
+
+class StrippedBuffer:
+    """
+    追加式文本缓冲，增量维护与 text.strip() 等价的结果：开头空白直接丢弃，结尾空白暂存到出现后续内容时再追加。
+    内容按片段保存，只在读取时拼接（并缓存已拼接的前缀），追加的开销只与新增内容有关。
+    生产方追加、消费方经 StreamOutput 读取可能在不同线程，拼接缓存由锁保护。
+    """
+    def __init__(self):
+        self.parts = []
+        self.pending = ''
+        self._text = ''
+        self._joined = 0
+        self._lock = threading.Lock()
+
+    def append(self, s):
+        if not self.parts:
+            s = s.lstrip()
+        if not s:
+            return
+        stripped = s.rstrip()
+        if stripped:
+            self.parts.append(self.pending + stripped)
+            self.pending = s[len(stripped):]
+        else:
+            self.pending += s
+
+    def value(self, n=None):
+        """返回前n个片段拼接的文本（默认全部）。"""
+        if n is None:
+            n = len(self.parts)
+        with self._lock:
+            if n < self._joined:
+                return ''.join(self.parts[:n])
+            if n > self._joined:
+                self._text += ''.join(self.parts[self._joined:n])
+                self._joined = n
+            return self._text
+
+    def raw(self):
+        return self.value() + self.pending
+
+class StreamOutput:
+    """
+    (cmd, think) 的惰性快照，行为与二元组一致；只有在被访问时才拼接字符串，
+    消费方跳过的中间结果不产生拼接开销。
+    """
+    __slots__ = ['_cmd', '_cmd_n', '_think', '_think_n']
+
+    def __init__(self, cmd, think):
+        self._cmd, self._cmd_n = cmd, len(cmd.parts)
+        self._think, self._think_n = think, len(think.parts)
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, i):
+        if i in [0, -2]:
+            return self._cmd.value(self._cmd_n)
+        if i in [1, -1]:
+            return self._think.value(self._think_n)
+        raise IndexError(i)
+
+    def __iter__(self):
+        yield self[0]
+        yield self[1]
+
+    def __repr__(self):
+        return repr(tuple(self))
+
+class ThinkParser:
+    """
+    流式输出的增量<think>标签解析器，结果与 convert_output(完整输出) 一致。
+    跨chunk边界跟踪标签状态（包括被截断的半个标签），每次只处理新增部分。
+    与 convert_output 相同：出现<think>后去掉所有<think>（去掉后两侧拼成的<think>保留），
+    以第一个</think>分开思考与命令，第二个</think>之后丢弃；出现<think>之前的</think>也参与切分。
+    """
+    open_tag = '<think>'
+    close_tag = '</think>'
+
+    def __init__(self):
+        self.cmd = StrippedBuffer()
+        self.think = StrippedBuffer()
+        self.state = 'cmd'  # cmd: 未出现<think>; think: 思考中; after: </think>之后; drop: 第二个</think>之后的内容被丢弃
+        self.hold = ''  # 可能是标签开头的未决尾部
+        self.open_from = 0  # hold 中从此位置起才可能是<think>（之前的字符是去掉标签后拼出的）
+
+    def _split_hold(self, text, open_from):
+        """
+        分出未决尾部：形如 </think>的开头 + <think>的开头，后者若补全为<think>并被去掉，前者可能与之后的内容拼成</think>。
+        """
+        max_close, max_open = len(self.close_tag) - 1, len(self.open_tag) - 1
+        for k in range(min(len(text), max_close + max_open), 0, -1):
+            tail = text[-k:]
+            for m in range(max(0, k - max_open), min(k, max_close) + 1):
+                if (self.close_tag.startswith(tail[:m]) and self.open_tag.startswith(tail[m:])
+                        and (m == k or len(text) - k + m >= open_from)):
+                    return text[:-k], tail
+        return text, ''
+
+    def feed(self, delta):
+        """处理新增内容，返回当前的 (cmd, think)（StreamOutput惰性快照）。"""
+        text = self.hold + (delta or '')
+        open_from, close_from = self.open_from, 0
+        self.hold, self.open_from = '', 0
+        while text and self.state != 'drop':
+            i = text.find(self.open_tag, open_from)
+            if self.state == 'cmd':
+                if i == -1:
+                    break
+                # 第一次出现<think>：之前的全部内容去掉该标签后，从头按思考中重新解析
+                raw = self.cmd.raw()
+                self.cmd = StrippedBuffer()
+                self.state = 'think'
+                text = raw + text[:i] + text[i + len(self.open_tag):]
+                open_from, close_from = len(raw) + i, 0
+                continue
+            j = text.find(self.close_tag, close_from)
+            if i != -1 and (j == -1 or i < j):
+                # 去掉<think>，两侧可能拼成</think>，从稍前的位置重新查找
+                text = text[:i] + text[i + len(self.open_tag):]
+                open_from, close_from = i, max(0, i - len(self.close_tag) + 1)
+                continue
+            if j == -1:
+                break
+            self._append(text[:j])
+            text = text[j + len(self.close_tag):]
+            open_from, close_from = max(0, open_from - j - len(self.close_tag)), 0
+            self.state = 'after' if self.state == 'think' else 'drop'
+        if self.state != 'drop':
+            text, self.hold = self._split_hold(text, open_from)
+            self.open_from = max(0, open_from - len(text))
+            self._append(text)
+        return StreamOutput(self.cmd, self.think)
+
+    def flush(self):
+        """输出结束，处理剩余的未决内容，返回最终的 (cmd, think)。"""
+        text, self.hold = self.hold, ''
+        self._append(text)
+        return self.cmd.value(), self.think.value()
+
+    def _append(self, text):
+        if not text:
+            return
+        if self.state == 'think':
+            self.think.append(text)
+        elif self.state in ['cmd', 'after']:
+            self.cmd.append(text)
+
+# ====== 流式请求：超时、对冲请求与重试 ======
+
+class GenerateStats:
+    """
+    单个AI的生成统计：请求数、重试、超时、对冲请求及首token耗时样本。
+    """
+    def __init__(self, samples=100):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.ttfts = deque(maxlen=samples)
+
+    def percentile(self, p):
+        if not self.ttfts:
+            return None
+        values = sorted(self.ttfts)
+        i = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+        return values[i]
+
+    def summary(self):
+        text = (f'requests: {self.requests}, errors: {self.errors}, retries: {self.retries}, '
+                f'timeouts: {self.timeouts}, hedges: {self.hedges} (won {self.hedge_wins})')
+        if self.ttfts:
+            text += f', ttft p50/p90: {self.percentile(50):.2f}s/{self.percentile(90):.2f}s'
+        return text
+
+def get_stats(ai):
+    """获取（创建）AI实例上的统计对象。"""
+    stats = getattr(ai, '_stats', None)
+    if stats is None:
+        stats = ai._stats = GenerateStats()
+    return stats
+
+def is_transient(e):
+    """判断是否为可重试的临时错误（超时、连接错误、限流、服务端错误）。"""
+    if isinstance(e, (TimeoutError, asyncio.TimeoutError, ConnectionError, EOFError, http.client.HTTPException)):
+        return True
+    if type(e).__name__ in ['APIConnectionError', 'APITimeoutError']:
+        return True
+    status = getattr(e, 'status_code', None)
+    return status in [408, 409, 429] or (isinstance(status, int) and status >= 500)
+
+class StreamAttempt:
+    """
+    在事件循环中发起一次流式请求，将 chunk/end/error 事件放入队列。
+    """
+    def __init__(self, create, q, hedge=False):
+        self.create = create
+        self.q = q
+        self.hedge = hedge
+        self.stream = None
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        try:
+            self.stream = await self.create()
+            async for chunk in self.stream:
+                self.q.put_nowait(('chunk', self, chunk))
+            self.q.put_nowait(('end', self, None))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.q.put_nowait(('error', self, e))
+        finally:
+            await self.close()
+
+    def stop(self):
+        """停止本次请求，取消任务并关闭流以释放连接。"""
+        self.task.cancel()
+
+    async def close(self):
+        stream, self.stream = self.stream, None
+        if stream is not None and hasattr(stream, 'close'):
+            try:
+                res = stream.close()
+                if inspect.isawaitable(res):
+                    await res
+            except Exception:
+                pass
+
+async def stream_once(create, ai, stats, progress):
+    """
+    发起一次（可能带对冲的）流式请求并逐个产出chunk。
+    首token超时与chunk间超时抛出TimeoutError；开启对冲时，等待超过历史首token耗时的
+    hedge_percentile分位数后发出一个重复请求，先产出数据的请求胜出，另一个被取消。
+    """
+    q = asyncio.Queue()
+    attempts = [StreamAttempt(create, q)]
+    start = time.monotonic()
+    hedge_at = None
+    if getattr(ai, 'hedge_percentile', 0) > 0 and len(stats.ttfts) >= 5:
+        hedge_at = start + stats.percentile(ai.hedge_percentile)
+    first_token_timeout = getattr(ai, 'first_token_timeout', 0)
+    chunk_timeout = getattr(ai, 'chunk_timeout', 0)
+    winner = None
+    failed = 0
+    try:
+        while True:
+            now = time.monotonic()
+            if winner is None:
+                deadline = start + first_token_timeout if first_token_timeout > 0 else None
+                if hedge_at is not None and (deadline is None or hedge_at < deadline):
+                    deadline = hedge_at
+            else:
+                deadline = now + chunk_timeout if chunk_timeout > 0 else None
+            try:
+                kind, attempt, payload = await asyncio.wait_for(q.get(), None if deadline is None else max(0, deadline - now))
+            except asyncio.TimeoutError:
+                if winner is None and hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    stats.hedges += 1
+                    attempts.append(StreamAttempt(create, q, hedge=True))
+                    continue
+                stats.timeouts += 1
+                if winner is None:
+                    raise TimeoutError(f'no response in {first_token_timeout}s')
+                raise TimeoutError(f'stream stalled for {chunk_timeout}s')
+            if winner is None:
+                if kind == 'error':
+                    failed += 1
+                    if failed < len(attempts):
+                        continue  # 还有其他请求在进行
+                    raise payload
+                winner = attempt
+                stats.ttfts.append(time.monotonic() - start)
+                if attempt.hedge:
+                    stats.hedge_wins += 1
+                for a in attempts:
+                    if a is not winner:
+                        a.stop()
+            if attempt is not winner:
+                continue
+            if kind == 'chunk':
+                progress[0] = True
+                yield payload
+            elif kind == 'end':
+                return
+            else:
+                raise payload
+    finally:
+        for a in attempts:
+            a.stop()
+
+async def stream_chunks(create, ai):
+    """
+    按AI的超时、对冲与重试配置异步产出流式chunk，create 返回可等待的流。
+    尚未产出任何数据时，临时错误按带抖动的指数退避重试，最多 max_retries 次。
+    """
+    stats = get_stats(ai)
+    stats.requests += 1
+    retries = 0
+    while True:
+        progress = [False]
+        try:
+            async with aclosing(stream_once(create, ai, stats, progress)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+            return
+        except Exception as e:
+            if progress[0] or retries >= getattr(ai, 'max_retries', 0) or not is_transient(e):
+                stats.errors += 1
+                raise
+            retries += 1
+            stats.retries += 1
+            backoff = getattr(ai, 'retry_backoff', 0.5) * 2 ** (retries - 1)
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
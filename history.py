@@ -0,0 +1,414 @@
+"""
+history.py
+输入历史的追加式日志：每个历史id一个JSONL文件，read_line 每接受一行就追加一条，无需退出时整体重写。
+读取时从文件末尾向前按页读取，启动与内存开销不随历史总量增长。
+"""
+
+import os
+import json
+import fcntl
+import heapq
+import threading
+import contextlib
+import workers
+from array import array
+from urllib.parse import quote, unquote
+
+history_dir = os.environ.get('LLS_HISTORY_DIR', os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_history.d'))
+legacy_file = os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_history')
+max_entries = int(os.environ.get('LLS_HISTORY_MAX', '10000'))
+suffix = '.jsonl'
+
+def parse_lines(data):
+    """
+    解析日志内容，返回条目列表。
+    容忍崩溃留下的残缺内容：没有换行结尾的最后一行及无法解析的行都会被跳过。
+    """
+    entries = []
+    lines = data.split(b'\n')
+    for line in lines[:-1]:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, str):
+            entries.append(entry)
+    return entries
+
+class Journal:
+    """
+    单个历史id的日志文件。条目数超过上限的1.5倍时压缩为最近的 max_entries 条，追加的均摊开销为常数。
+    多个 lls 进程可同时写同一日志：追加持有锁文件的共享锁，压缩持有排他锁；
+    其他进程压缩替换文件后，追加前发现文件已不是打开的那个，重新打开。
+    """
+    def __init__(self, path, max_entries=max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.count = None  # 文件中的条目数（含残缺行），首次需要时统计
+        self.removed = 0  # 本进程内压缩时从文件开头删除的字节数，用于修正分页位置
+        self._file = None
+        self._lock_fd = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _flock(self, op):
+        """进程间的文件锁（锁文件为日志路径加 .lock）。"""
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._lock_fd, op)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if self.count is None:
+                self.count = data.count(b'\n')
+        return parse_lines(data)
+
+    def tail(self, n, end=None):
+        """
+        从文件偏移end（默认文件末尾）向前读取最多n个完整条目，不读取整个文件。
+        返回 (条目列表, 第一个条目的起始偏移)，偏移为0表示已到文件开头。
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return [], 0
+        with f:
+            if end is None:
+                end = f.seek(0, 2)
+            pos = end
+            chunks = []
+            newlines = 0
+            while pos > 0 and newlines <= n:
+                size = min(65536, pos)
+                pos -= size
+                f.seek(pos)
+                data = f.read(size)
+                chunks.insert(0, data)
+                newlines += data.count(b'\n')
+        data = b''.join(chunks)
+        lines = data.split(b'\n')
+        end -= len(lines.pop())  # 没有换行结尾的残缺行
+        if pos > 0:
+            lines.pop(0)  # 块开头可能是半行
+        lines = lines[-n:] if n > 0 else []
+        start = end - sum(len(line) + 1 for line in lines)
+        return parse_lines(b'\n'.join(lines) + b'\n' if lines else b''), start
+
+    def _replaced(self):
+        """打开的文件是否已被其他进程的压缩替换（或删除）。"""
+        try:
+            return os.fstat(self._file.fileno()).st_ino != os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _open(self):
+        if self._file is not None and self._replaced():
+            self.close_file()
+            self.count = None
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+            size = self._file.tell()
+            if size:
+                # 上次写入被中断时补上换行，使残缺行不影响新条目
+                with open(self.path, 'rb') as f:
+                    f.seek(size - 1)
+                    if f.read(1) != b'\n':
+                        self._file.write(b'\n')
+            if self.count is None:
+                with open(self.path, 'rb') as f:
+                    self.count = f.read().count(b'\n')
+        return self._file
+
+    def append(self, entry):
+        self.extend([entry])
+
+    def extend(self, entries):
+        with self._lock:
+            with self._flock(fcntl.LOCK_SH):
+                f = self._open()
+                f.write(b''.join(json.dumps(entry, ensure_ascii=False).encode() + b'\n' for entry in entries))
+                f.flush()
+                self.count += len(entries)
+            if self.count > self.max_entries * 3 // 2:
+                self._compact()
+
+    def _compact(self):
+        """只保留最近的 max_entries 条，写入临时文件后原子替换。"""
+        self.close_file()
+        with self._flock(fcntl.LOCK_EX):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            entries = parse_lines(data)[-self.max_entries:]
+            compacted = b''.join(json.dumps(entry, ensure_ascii=False).encode() + b'\n' for entry in entries)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(compacted)
+            os.replace(tmp, self.path)
+        self.count = len(entries)
+        self.removed += len(data) - len(compacted)
+
+    def compact(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                self._compact()
+
+    def close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self.close_file()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+class Cursor:
+    """
+    已加载条目中最早一条在日志文件中的位置，用于向前分页读取更早的条目。
+    """
+    def __init__(self, journal, start):
+        self.journal = journal
+        self.start = start
+        self.removed = journal.removed
+
+    def more(self):
+        return self.start > 0
+
+    def older(self, n):
+        """读取更早的最多n个条目（按时间顺序）。"""
+        start = self.start - (self.journal.removed - self.removed)
+        self.removed = self.journal.removed
+        if start <= 0:
+            self.start = 0  # 更早的条目已被压缩掉
+            return []
+        entries, self.start = self.journal.tail(n, end=start)
+        return entries
+
+class Index:
+    """
+    所有历史条目的倒排索引（长度1到3的子串），用于增量搜索（不区分大小写）。
+    同一id中相同文本只保留最近一次出现；结果按加入顺序由近到远排列，取够数量即停止。
+    短于3个字符的查询直接取对应子串的倒排表，不需要逐条扫描。
+    """
+    def __init__(self):
+        self.texts = []  # 条目序号 -> 文本，被更新的重复条目为None
+        self.lowers = []
+        self.ids = []  # 条目序号 -> 历史id
+        self.latest = {}  # (历史id, 文本) -> 最近一次的条目序号
+        self.postings = {}  # 长度1到3的子串 -> 条目序号（升序）
+
+    def __len__(self):
+        return len(self.latest)
+
+    def add(self, id, text):
+        if not text:
+            return
+        key = (id, text)
+        old = self.latest.get(key)
+        if old is not None:
+            self.texts[old] = None
+        n = len(self.texts)
+        lower = text.lower()
+        self.texts.append(text)
+        self.lowers.append(lower)
+        self.ids.append(id)
+        self.latest[key] = n
+        postings = self.postings
+        grams = {lower[i:i+k] for k in (1, 2, 3) for i in range(len(lower) - k + 1)}
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array('I')
+            posting.append(n)
+
+    def search(self, query, id=None, limit=50):
+        """返回包含query的最近limit个不同条目；id为None时搜索所有id。"""
+        q = query.lower()
+        if not q:
+            candidates = range(len(self.texts) - 1, -1, -1)
+        elif len(q) <= 3:
+            candidates = reversed(self.postings.get(q, ()))
+        else:
+            shortest = None
+            for i in range(len(q) - 2):
+                posting = self.postings.get(q[i:i+3])
+                if posting is None:
+                    return []
+                if shortest is None or len(posting) < len(shortest):
+                    shortest = posting
+            candidates = reversed(shortest)
+        texts, lowers, ids = self.texts, self.lowers, self.ids
+        results = []
+        seen = set()
+        for n in candidates:
+            text = texts[n]
+            if text is None or (id is not None and ids[n] != id) or q not in lowers[n] or text in seen:
+                continue
+            seen.add(text)
+            results.append(text)
+            if len(results) >= limit:
+                break
+        return results
+
+class History:
+    """
+    所有历史id的日志。首次使用时把旧版 ~/.lls_history（整体JSON）迁移为日志文件。
+    """
+    def __init__(self, dir=history_dir, max_entries=max_entries, legacy=legacy_file):
+        self.dir = dir
+        self.max_entries = max_entries
+        self.legacy = legacy
+        self._journals = {}
+        self._index = None
+        self._pending = None  # 构建索引期间追加的条目，构建完成后补入
+        self._index_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _path(self, id):
+        return os.path.join(self.dir, quote(str(id), safe='') + suffix)
+
+    def prepare(self):
+        with self._lock:
+            self._prepare()
+
+    def _prepare(self):
+        if self._ready:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        self._ready = True
+        if self.legacy and os.path.exists(self.legacy):
+            try:
+                self.migrate(self.legacy)
+            except Exception as e:
+                # 无法解析的旧版历史文件移到一边，不影响之后的历史记录
+                os.replace(self.legacy, self.legacy + '.corrupt')
+                print(f'error: migrate {self.legacy} failed ({e}), moved to {self.legacy}.corrupt', end='\r\n')
+
+    def journal(self, id):
+        with self._lock:
+            self._prepare()
+            journal = self._journals.get(id)
+            if journal is None:
+                journal = Journal(self._path(id), self.max_entries)
+                self._journals[id] = journal
+            return journal
+
+    def ids(self):
+        with self._lock:
+            self._prepare()
+        return [unquote(name[:-len(suffix)]) for name in sorted(os.listdir(self.dir)) if name.endswith(suffix)]
+
+    def load(self, id):
+        """读取一个id的全部条目（按时间顺序）。"""
+        return self.journal(id).read()
+
+    def recent(self, id, n):
+        """读取一个id最近的n个条目，返回 (条目列表, Cursor)。"""
+        journal = self.journal(id)
+        entries, start = journal.tail(n)
+        return entries, Cursor(journal, start)
+
+    def load_all(self):
+        return {id: self.load(id) for id in self.ids()}
+
+    def append(self, id, entry):
+        self.journal(id).append(entry)
+        with self._index_lock:
+            if self._index is not None:
+                self._index.add(id, entry)
+            elif self._pending is not None:
+                self._pending.append((id, entry))
+
+    def _merged(self):
+        """
+        所有id的条目，由远到近。日志中没有时间戳，按各条目在本id日志中的相对位置合并：
+        各id最后的条目视为同样最近，相对位置相同时最近修改的日志在后。
+        """
+        journals = []
+        for id in self.ids():
+            try:
+                mtime = os.path.getmtime(self._path(id))
+            except FileNotFoundError:
+                continue
+            journals.append((mtime, id, self.load(id)))
+        journals.sort(key=lambda j: j[0])
+        def keyed(rank, id, entries):
+            count = len(entries)
+            for i, entry in enumerate(entries):
+                yield (i + 1) / count, rank, id, entry
+        merged = heapq.merge(*(keyed(rank, id, entries) for rank, (_, id, entries) in enumerate(journals)))
+        return ((id, entry) for _, _, id, entry in merged)
+
+    def index(self):
+        """
+        获取搜索索引，首次使用时从所有日志构建（可在后台线程中预先构建），之后随 append 更新。
+        构建时不持有 _index_lock，期间 append 的条目记入 _pending，构建完成后补入。
+        """
+        with self._build_lock:
+            with self._index_lock:
+                if self._index is not None:
+                    return self._index
+                self._pending = []
+            index = Index()
+            for id, entry in self._merged():
+                index.add(id, entry)
+            with self._index_lock:
+                # 构建前已写入日志的条目可能再次补入，Index.add 会去重
+                for id, entry in self._pending:
+                    index.add(id, entry)
+                self._pending = None
+                self._index = index
+            return index
+
+    def search(self, query, id=None, limit=50):
+        """
+        在一个id（id为None时所有id）的历史中搜索，结果由近到远。
+        索引尚未构建完成时不等待，返回None（尚未开始构建时在后台开始）。
+        """
+        with self._index_lock:
+            index = self._index
+            building = self._pending is not None
+            if index is not None:
+                return index.search(query, id, limit)
+        if not building:
+            workers.submit(self.index)
+        return None
+
+    def migrate(self, path):
+        """把旧版历史文件转换为日志文件，完成后改名为 .bak。"""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        for id, lines in data.items():
+            entries = [line for line in lines if isinstance(line, str) and line]
+            if entries:
+                journal = Journal(self._path(id), self.max_entries)
+                journal.extend(entries[-self.max_entries:])
+                journal.close()
+        os.replace(path, path + '.bak')
+
+    def close(self):
+        with self._lock:
+            for journal in self._journals.values():
+                journal.close()
+
+_history = None
+
+def get_history():
+    """获取全局历史日志实例。"""
+    global _history
+    if _history is None:
+        _history = History()
+    return _history
@@ -0,0 +1,248 @@
+"""
+http_client.py
+基于 asyncio 的轻量 OpenAI 兼容流式客户端（SSE），带长连接复用。
+只实现 lls 用到的 chat.completions.create / completions.create 流式接口，不支持代理。
+客户端及其连接绑定在 aio 的共享事件循环上使用。
+"""
+
+import ssl
+import json
+import asyncio
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+class APIError(Exception):
+    """接口返回非200状态码。"""
+    def __init__(self, status_code, message):
+        super().__init__(f'{status_code} {message}')
+        self.status_code = status_code
+        self.message = message
+
+class Object(dict):
+    """JSON对象的属性访问包装，缺失字段返回None（与openai返回对象的用法一致）。"""
+    def __getattr__(self, key):
+        return wrap(self.get(key))
+
+def wrap(value):
+    if isinstance(value, dict):
+        return Object(value)
+    if isinstance(value, list):
+        return [wrap(v) for v in value]
+    return value
+
+def parse_sse_line(line):
+    """
+    解析一行SSE数据，返回 (done, data)。
+    非 data 行返回 (False, None)，data: [DONE] 返回 (True, None)。
+    """
+    line = line.strip()
+    if not line.startswith(b'data:'):
+        return False, None
+    data = line[5:].strip()
+    if data == b'[DONE]':
+        return True, None
+    return False, wrap(json.loads(data))
+
+class ResponseBody:
+    """响应体读取，支持 chunked、Content-Length 与读到连接关闭三种方式。"""
+    def __init__(self, reader, headers):
+        self.reader = reader
+        self.chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        self.remaining = None
+        if not self.chunked and 'content-length' in headers:
+            self.remaining = int(headers['content-length'])
+        self.buffer = b''
+        self.eof = False
+
+    async def _fill(self):
+        """读取下一段数据到缓冲区，响应体结束时返回False。"""
+        if self.eof:
+            return False
+        if self.chunked:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError('connection closed before end of response')
+            size = int(line.split(b';')[0].strip(), 16)
+            if size == 0:
+                while (await self.reader.readline()) not in [b'\r\n', b'\n', b'']:
+                    pass  # trailer
+                self.eof = True
+                return False
+            data = (await self.reader.readexactly(size + 2))[:-2]
+        elif self.remaining is not None:
+            if self.remaining == 0:
+                self.eof = True
+                return False
+            data = await self.reader.read(min(65536, self.remaining))
+            if not data:
+                raise ConnectionError('connection closed before end of response')
+            self.remaining -= len(data)
+        else:
+            data = await self.reader.read(65536)
+            if not data:
+                self.eof = True
+                return False
+        self.buffer += data
+        return True
+
+    async def readline(self):
+        while b'\n' not in self.buffer:
+            if not await self._fill():
+                line, self.buffer = self.buffer, b''
+                return line
+        i = self.buffer.index(b'\n') + 1
+        line, self.buffer = self.buffer[:i], self.buffer[i:]
+        return line
+
+    async def read(self):
+        while await self._fill():
+            pass
+        data, self.buffer = self.buffer, b''
+        return data
+
+class Stream:
+    """SSE响应流，异步迭代得到chunk对象；完整读完后连接归还连接池。"""
+    def __init__(self, client, conn, body, keep_alive=True):
+        self._client = client
+        self._conn = conn
+        self._body = body
+        self._keep_alive = keep_alive
+        self._done = False
+
+    async def __aiter__(self):
+        try:
+            while True:
+                line = await self._body.readline()
+                if not line:
+                    break
+                done, chunk = parse_sse_line(line)
+                if done:
+                    await self._body.read()
+                    self._done = True
+                    break
+                if chunk is not None:
+                    if chunk.get('error'):
+                        raise APIError(500, chunk.error.get('message', str(chunk.error)))
+                    yield chunk
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        if self._done and self._keep_alive:
+            self._client._release(conn)
+        else:
+            conn[1].close()
+
+class HTTPClient:
+    """
+    OpenAI兼容接口的异步流式客户端。
+    空闲连接保存在池中复用，避免每次请求重新进行TCP+TLS握手。
+    """
+    def __init__(self, base_url, api_key, timeout=600, max_idle=4):
+        url = urlsplit(base_url)
+        self.https = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port or (443 if self.https else 80)
+        self.prefix = url.path.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._ssl = None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat_completion))
+        self.completions = SimpleNamespace(create=self._create_completion)
+
+    async def _new_connection(self):
+        if self.https and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self._ssl if self.https else None),
+            self.timeout,
+        )
+
+    async def _acquire(self):
+        while self._idle:
+            conn = self._idle.pop()
+            if not conn[0].at_eof():
+                return conn, True
+            conn[1].close()
+        return await self._new_connection(), False
+
+    def _release(self, conn):
+        if len(self._idle) < self.max_idle:
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+
+    async def connect(self):
+        """预先建立一条连接放入连接池。"""
+        self._release(await self._new_connection())
+
+    def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn[1].close()
+
+    async def _request(self, conn, path, data, headers):
+        reader, writer = conn
+        lines = [f'POST {self.prefix + path} HTTP/1.1'] + [f'{k}: {v}' for k, v in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + data)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in [b'\r\n', b'\n', b'']:
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            response_headers[key.strip().lower()] = value.strip()
+        return status, response_headers
+
+    async def _post(self, path, body):
+        data = json.dumps(body).encode()
+        host = self.host if self.port in [80, 443] else f'{self.host}:{self.port}'
+        headers = {
+            'Host': host,
+            'Content-Type': 'application/json',
+            'Content-Length': len(data),
+            'Accept': 'text/event-stream',
+            'Authorization': f'Bearer {self.api_key}',
+        }
+        while True:
+            conn, reused = await self._acquire()
+            try:
+                status, response_headers = await self._request(conn, path, data, headers)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn[1].close()
+                if not reused:
+                    raise
+                # 复用的连接可能已被服务端关闭，换新连接重试
+            except BaseException:
+                conn[1].close()
+                raise
+        body = ResponseBody(conn[0], response_headers)
+        keep_alive = response_headers.get('connection', '').lower() != 'close'
+        if status != 200:
+            try:
+                text = (await body.read()).decode(errors='replace')
+            finally:
+                conn[1].close()
+            try:
+                text = json.loads(text)['error']['message']
+            except Exception:
+                pass
+            raise APIError(status, text)
+        return Stream(self, conn, body, keep_alive)
+
+    async def _create_chat_completion(self, model, messages, stream=True, **kwargs):
+        return await self._post('/chat/completions', dict(model=model, messages=messages, stream=True, **kwargs))
+
+    async def _create_completion(self, model, prompt, stream=True, **kwargs):
+        return await self._post('/completions', dict(model=model, prompt=prompt, stream=True, **kwargs))
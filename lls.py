@@ -2,30 +2,49 @@
 """
 lls.py
 主入口模块，负责流程控制、命令分发、AI管理、终端交互。
+
+python lls.py --batch 为非交互批量生成模式，见 batch.py；--detach/--attach/--list 为可分离会话，见 detach.py。
+
+启动顺序：先执行用户配置 ~/.llsrc.py（其中对 os.environ 的修改由子进程继承），再启动子进程并开始转发输入输出，
+之后在后台线程中加载命令模块、历史缓冲区与AI配置。~/.llsrc.py 较慢且不修改环境变量时，
+可设置 LLS_RC_BACKGROUND=1 改为在后台加载（此时其中的环境变量修改只对之后新建的会话生效）。
+设置 LLS_STARTUP_PROFILE=1 可打印各阶段耗时。
 """
 
 # ====== 标准库与自定义模块导入 ======
-import importlib.util
+import time
+startup_time = time.perf_counter()
 import subprocess
 import traceback
 import sys
 import os
-from common import LLSState
+from common import LLSState, StartupProfile, load_config
+
+# 启动耗时分析
+profile = StartupProfile(bool(os.environ.get('LLS_STARTUP_PROFILE')), start=startup_time)
 
 # 初始化状态对象
 state = LLSState()
 
-# ====== 加载用户自定义配置（如有） ======
-config_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.llsrc.py')
-if os.path.exists(config_file_path):
-    try:
-        # 动态加载配置模块
-        spec = importlib.util.spec_from_file_location(name='lls_config', location=config_file_path)
-        lls_config_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(lls_config_module)
-    except Exception as e:
-        print('error:', e, file=sys.stderr)
-        state.err = traceback.format_exc()
+# ====== 批量模式：python lls.py --batch [input.jsonl] ======
+if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+    import batch
+    exit(batch.main(state, sys.argv[2:]))
+
+# ====== 可分离会话：--detach [NAME] 在后台运行，--attach [NAME] 重新连接，--list 列出会话 ======
+if len(sys.argv) > 1 and sys.argv[1] in ['--attach', '--list']:
+    import detach
+    exit(detach.main(sys.argv[1:]))
+if len(sys.argv) > 1 and sys.argv[1] == '--detach':
+    import detach
+    name, sys.argv[1:] = detach.parse_name(sys.argv[2:])
+    state.detach = detach.daemonize(name, attach=sys.stdin.isatty())  # 父进程在此连接并退出
+
+# ====== 用户配置：在确定主命令与启动子进程之前执行，使其中设置的环境变量（含非交互模式）被子进程继承 ======
+rc_in_background = bool(os.environ.get('LLS_RC_BACKGROUND')) and sys.stdin.isatty()
+if not rc_in_background:
+    with profile.phase('llsrc'):
+        load_config(state)
 
 # ====== 解析命令行参数，确定主命令 ======
 if len(sys.argv) > 2 and sys.argv[1] == '--':
@@ -47,91 +66,87 @@ if not sys.stdin.isatty():
     result_code = subprocess.call(state.command)
     exit(result_code)
 
-# ====== 终端与AI环境初始化 ======
-import threading
-import termios
-import tty
-import pty
-import signal
-
-from ai.mixed import MixedAI
-from ai.text import TextCompletionAI
-from ai.chat import ChatAI
-from terminal import Screen
-from display import *
-from commands import *
-from common import *
-
-# 保存原始终端设置，便于恢复
-state.old_tty = termios.tcgetattr(sys.stdin)
-# 设置终端为原始模式，便于逐字符读取
-tty.setraw(sys.stdin.fileno())
-# 创建伪终端对，主从fd
-state.master_fd, state.slave_fd = pty.openpty()
-# 获取终端窗口大小
-state.winsize = os.get_terminal_size()
-# 初始化AI对象（混合AI，支持多种模式）
-state.ai = MixedAI()
-# 屏幕历史文件路径
-state.screen_history_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_screen_history')
-# 屏幕对象，负责内容显示与缓冲
-state.screen = Screen(state.screen_history_file_path)
-state.screen.keep_logs_when_clean_screen = True  # 清屏时保留日志
-
-sync_winsize(state)
-signal.signal(signal.SIGWINCH, lambda x, y: sync_winsize(state))  # 监听窗口大小变化
-
-# ====== 启动主命令子进程 ======
-try:
-    state.proc = subprocess.Popen(
-        state.command,
-        preexec_fn=os.setsid,
-        stdin=state.slave_fd,
-        stdout=state.slave_fd,
-        stderr=state.slave_fd,
-        shell=False,
-        text=False,
-        bufsize=0,
-    )
-except Exception as e:
-    termios.tcsetattr(sys.stdin, termios.TCSADRAIN, state.old_tty)
-    raise e
+# ====== 终端初始化 ======
+with profile.phase('import'):
+    import threading
+    import termios
+    import tty
+    import signal
+
+    from ai.mixed import MixedAI
+    from sessions import SessionManager
+    from common import *
+
+with profile.phase('tty'):
+    # 保存原始终端设置，便于恢复
+    state.old_tty = termios.tcgetattr(sys.stdin)
+    # 设置终端为原始模式，便于逐字符读取
+    tty.setraw(sys.stdin.fileno())
+    os.write(sys.stdout.fileno(), b'\033c\033[?2004h')  # 复位终端，开启括号粘贴模式
+    # 获取终端窗口大小
+    state.winsize = os.get_terminal_size()
+    # 初始化AI对象（混合AI，支持多种模式），后台加载完成前为空
+    state.ai = MixedAI()
+    # 屏幕历史文件路径
+    state.screen_history_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_screen_history')
+    # 会话管理：每个会话有自己的伪终端、屏幕对象与AI上下文，当前会话的字段放在 state 上
+    state.sessions = SessionManager(state)
+
+# ====== 启动主命令子进程（第一个会话） ======
+with profile.phase('spawn'):
+    try:
+        state.sessions.switch(state.sessions.spawn(ai=state.ai), redraw=False)
+    except Exception as e:
+        termios.tcsetattr(sys.stdin, termios.TCSADRAIN, state.old_tty)
+        raise e
+    signal.signal(signal.SIGWINCH, lambda x, y: sync_winsize(state))  # 监听窗口大小变化
 
 state.mode = 'char'  # 输入模式：char/line/prompt
 state.running = True  # 主循环运行标志
 state.slave_callback = None  # 从终端回调
-state.slave_tty = termios.tcgetattr(state.slave_fd)  # 保存从终端设置
 
-# ====== 子线程异步读取子进程输出，写入主终端与屏幕缓冲 ======
-def read_stdout(state):
-    while state.running:
-        try:
-            chars = os.read(state.master_fd, 10240)
-            if chars:
-                if state.mode != 'line':
-                    os.write(sys.stdout.fileno(), chars)
-                state.screen.write(chars)
-            if state.slave_callback is not None:
-                state.slave_callback()
-        except Exception as e:
-            print('error:', e, end='\r\n')
-            state.err = traceback.format_exc()
+# ====== IO线程读取所有会话的输出，当前会话的输出写入主终端 ======
+state.sessions.start()
 
-stdout_thread = threading.Thread(target=read_stdout, args=(state,))
-stdout_thread.daemon = True
-stdout_thread.start()
+# ====== 后台加载：命令模块、历史缓冲区、AI实例（以及 LLS_RC_BACKGROUND 时的用户配置） ======
+def load_in_background(state):
+    try:
+        if rc_in_background:
+            with profile.phase('llsrc'):
+                load_config(state)
+        with profile.phase('commands'):
+            import commands
+            from display import get_bufs
+        with profile.phase('bufs'):
+            state.bufs = get_bufs()
+            load_bufs(state)
+        with profile.phase('ai'):
+            load_ai(state)
+        if os.environ.get('LLS_RPC_SOCKET'):
+            with profile.phase('rpc'):
+                import rpc
+                rpc.start_from_env(state)
+    except Exception as e:
+        print('error:', e, end='\r\n')
+        state.err = traceback.format_exc()
+    finally:
+        state.loaded.set()
+        profile.report()
 
-# ====== 历史缓冲区管理 & AI实例管理 ======
-state.bufs = get_bufs()
-load_bufs(state)
-load_ai(state)
+loader_thread = threading.Thread(target=load_in_background, args=(state,), name='loader')
+loader_thread.daemon = True
+loader_thread.start()
 
 # ====== 启动主循环 ======
 try:
-    os.write(sys.stdout.fileno(), b'\033c')  # 复位终端
-    while state.proc.poll() is None:
+    while state.sessions.alive():
         try:
-            cmd = read_command(state)  # 读取用户输入
+            if state.mode == 'char' and not state.loaded.is_set():
+                cmd = char_mode(state)  # 加载完成前只转发输入
+            else:
+                state.loaded.wait()
+                from commands import read_command
+                cmd = read_command(state)  # 读取用户输入
             os.write(state.master_fd, cmd.encode())  # 发送到子进程
         except Exception as e:
             print('error:', e, end='\r\n')
@@ -139,9 +154,13 @@ try:
             state.mode = 'char'
 finally:
     # 退出时清理资源，保存历史，恢复终端
-    state.screen.close()
+    state.sessions.close()
+    if state.rpc is not None:
+        state.rpc.stop()
+    state.loaded.wait()  # 等待后台加载结束，避免用空配置覆盖已保存的配置
     save_bufs(state)
     save_ai(state)
+    os.write(sys.stdout.fileno(), b'\033[?2004l')
     termios.tcsetattr(sys.stdin, termios.TCSADRAIN, state.old_tty)
     state.running = False
     print('exited, if not exit, please input ctrl-c again')
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+mock_server.py
+本地 OpenAI 兼容模拟服务器，用于离线测试与压测流式生成、取消和渲染流程。
+
+实现流式 chat.completions / completions（SSE），响应可按规则文件编排：
+首 token 延迟、token 速率、中途停顿、错误与 <think> 段落。
+
+用法：
+    python mock_server.py --port 8765 --rules rules.json
+    LLS_OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python lls.py
+    python mock_server.py --bench 100 --concurrency 8   # 内置压测（直接调用AI类）
+    python mock_server.py --bench 20 --cli              # 经 cmd_generate 的交互路径压测
+
+规则文件为JSON，可以是规则列表，也可以是 {"defaults": {...}, "rules": [...]}：
+    [
+      {"match": "list", "response": "ls -la", "think": "列出文件", "ttft": 0.5, "rate": 20},
+      {"match": "flaky", "status": 503, "times": 1},
+      {"match": "slow", "stall_after": 3, "stall": 5},
+      {"match": "broken", "error_after": 2, "error": "upstream reset"},
+      {"response": "echo {instruct}"}
+    ]
+按顺序用 match（正则）搜索最后一条用户消息（或补全的prompt），第一条匹配的规则生效；
+没有 match 的规则匹配所有请求。times 限制规则生效次数，用于模拟先失败后成功。
+"""
+
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+default_script = dict(
+    response='echo {instruct}',  # 命令内容，{instruct} 替换为请求的指令（最后一条用户消息）
+    think=None,          # 非空时以 <think>...</think> 输出在命令之前
+    ttft=0.0,            # 首 token 延迟（秒）
+    rate=0.0,            # token/秒，0为不限速
+    chunk=1,             # 每个SSE事件包含的token数
+    stall_after=None,    # 输出第N个token后停顿
+    stall=0.0,           # 停顿时长（秒）
+    status=200,          # 非200时直接返回错误状态码
+    error=None,          # 流中错误信息
+    error_after=None,    # 输出第N个token后发送错误事件（drop为真时直接断开连接）
+    drop=False,
+)
+
+_token = re.compile(r'\s*\S+|\s+')
+
+def tokenize(text):
+    """按空白切分为近似token（保留空白）。"""
+    return _token.findall(text)
+
+class Rule:
+    def __init__(self, match=None, times=None, **script):
+        unknown = set(script) - set(default_script)
+        if unknown:
+            raise ValueError(f'unknown rule keys: {", ".join(sorted(unknown))}')
+        self.pattern = re.compile(match) if match else None
+        self.times = times
+        self.script = script
+        self.count = 0
+
+    def matches(self, text):
+        if self.times is not None and self.count >= self.times:
+            return False
+        return self.pattern is None or self.pattern.search(text) is not None
+
+class Script:
+    """一次请求的响应编排。"""
+    def __init__(self, instruct='', **kwargs):
+        for key, value in {**default_script, **kwargs}.items():
+            setattr(self, key, value)
+        self.instruct = instruct
+
+    def tokens(self):
+        text = self.response.replace('{instruct}', self.instruct)
+        if self.think:
+            text = '<think>' + self.think + '</think>' + text
+        return tokenize(text)
+
+def load_rules(path):
+    """读取规则文件，返回 (defaults, rules)。"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = dict(rules=data)
+    return data.get('defaults', {}), [Rule(**r) for r in data.get('rules', [])]
+
+def request_text(body):
+    """取出用于匹配规则的文本：最后一条用户消息或补全prompt。"""
+    if 'messages' in body:
+        for m in reversed(body['messages']):
+            if m.get('role') == 'user':
+                return str(m.get('content', ''))
+        return ''
+    return str(body.get('prompt', ''))
+
+def extract_instruct(text):
+    """从 lls 的用户模板中取出指令；不符合模板时返回最后一行。"""
+    m = re.search(r'以下是当前user的指令:\n(.*?)\n', text)
+    if m:
+        return m.group(1)
+    lines = text.strip().split('\n')
+    return lines[-1] if lines else ''
+
+class MockServer(ThreadingHTTPServer):
+    """
+    模拟服务器。daemon_threads 保证断开的客户端不阻塞退出。
+    requests / active 记录请求统计，便于测试断言。
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0, rules=None, defaults=None, verbose=False):
+        super().__init__((host, port), Handler)
+        self.rules = rules or []
+        self.defaults = defaults or {}
+        self.verbose = verbose
+        self.requests = 0
+        self.active = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def script(self, body):
+        text = request_text(body)
+        kwargs = dict(self.defaults)
+        with self.lock:
+            for rule in self.rules:
+                if rule.matches(text):
+                    rule.count += 1
+                    kwargs.update(rule.script)
+                    break
+        return Script(extract_instruct(text), **kwargs)
+
+    def start(self):
+        """在后台线程中运行，返回self。"""
+        self.thread = threading.Thread(target=self.serve_forever, name='mock-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持长连接复用
+    disable_nagle_algorithm = True  # 否则每个SSE块都要等延迟确认（约40ms），压测结果失真
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_event(self, data):
+        payload = b'data: ' + (data if isinstance(data, bytes) else json.dumps(data).encode()) + b'\n\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(payload), payload))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self.send_json(200, dict(object='list', data=[dict(id='mock', object='model', owned_by='lls')]))
+        else:
+            self.send_json(404, dict(error=dict(message=f'no such path {self.path}')))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self.send_json(400, dict(error=dict(message='invalid json')))
+        path = self.path.rstrip('/')
+        if path.endswith('/chat/completions'):
+            chat = True
+        elif path.endswith('/completions'):
+            chat = False
+        else:
+            return self.send_json(404, dict(error=dict(message=f'no such path {self.path}')))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.active += 1
+        try:
+            self.respond(self.server.script(body), body.get('model', 'mock'), chat)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端取消请求
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def respond(self, script, model, chat):
+        if script.status != 200:
+            return self.send_json(script.status, dict(error=dict(message=script.error or f'mock error {script.status}')))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.flush()
+
+        created = int(time.time())
+        def chunk(text, finish=None):
+            if chat:
+                delta = dict(content=text) if text is not None else {}
+                choice = dict(index=0, delta=delta, finish_reason=finish)
+                obj = 'chat.completion.chunk'
+            else:
+                choice = dict(index=0, text=text or '', finish_reason=finish)
+                obj = 'text_completion'
+            return dict(id='mock', object=obj, created=created, model=model, choices=[choice])
+
+        start = time.monotonic()
+        if script.ttft > 0:
+            time.sleep(script.ttft)
+            start = time.monotonic()
+        tokens = script.tokens()
+        step = max(1, int(script.chunk))
+        sent = 0
+        for i in range(0, len(tokens), step):
+            if script.error_after is not None and sent >= script.error_after:
+                if script.drop:
+                    self.close_connection = True
+                    return
+                self.send_event(dict(error=dict(message=script.error or 'mock stream error')))
+                break
+            if script.rate > 0:
+                # 按全局节奏计算，避免sleep误差累积
+                delay = start + sent / script.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self.send_event(chunk(''.join(tokens[i:i + step])))
+            sent += len(tokens[i:i + step])
+            if script.stall_after is not None and sent - len(tokens[i:i + step]) < script.stall_after <= sent:
+                time.sleep(script.stall)
+                start += script.stall
+        else:
+            self.send_event(chunk(None, 'stop'))
+        self.send_event(b'[DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def bench_ai(server, ai_type='chat'):
+    """指向模拟服务器的AI实例（须在导入 generate 之前调用）。"""
+    import os
+    import tempfile
+    if 'generate' in sys.modules:
+        raise RuntimeError('bench must run before generate is imported')
+    # generate 在导入时读取接口地址；输入历史写到临时目录，不影响用户的历史
+    os.environ['LLS_OPENAI_BASE_URL'] = server.url
+    os.environ.setdefault('LLS_OPENAI_API_KEY', 'mock')
+    os.environ['LLS_HISTORY_DIR'] = tempfile.mkdtemp(prefix='lls-bench-')
+    if ai_type == 'chat':
+        from ai.chat import ChatAI as T
+    else:
+        from ai.text import TextCompletionAI as T
+    ai = T()
+    ai.example_count = 0
+    return ai
+
+def report(count, elapsed, ttfts, totals, errors, ai, concurrency=1):
+    import generate
+    ms = lambda x: f'{x * 1000:.1f}ms'
+    print(f'{count} requests, concurrency {concurrency}, {elapsed:.2f}s, {count / elapsed:.1f} req/s')
+    print(f'ttft p50 {ms(percentile(ttfts, 50))} p95 {ms(percentile(ttfts, 95))}; '
+          f'total p50 {ms(percentile(totals, 50))} p95 {ms(percentile(totals, 95))}')
+    print(f'errors {len(errors)}' + (f' (first: {errors[0]})' if errors else ''))
+    print(f'client: {generate.get_stats(ai).summary()}')
+
+def bench(server, count=100, concurrency=8, ai_type='chat'):
+    """
+    压测：用 lls 的AI类（agenerate）对模拟服务器并发生成count次，统计首个非空输出与完成耗时。
+    """
+    import asyncio
+    import aio
+    ai = bench_ai(server, ai_type)
+    ttfts, totals, errors = [], [], []
+
+    async def run(i, semaphore):
+        async with semaphore:
+            begin = time.monotonic()
+            first = None
+            cmd = ''
+            async for chunk in ai.agenerate(f'bench {i}', f'$ bench {i}'):
+                if first is None and (chunk[0] or chunk[1]):
+                    first = time.monotonic() - begin
+                cmd = chunk[0]
+            totals.append(time.monotonic() - begin)
+            if first is not None:
+                ttfts.append(first)
+            if str(cmd).startswith('error:'):
+                errors.append(str(cmd))
+
+    async def run_all():
+        # 所有请求共享 aio 的事件循环，并发数由信号量限制
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*[run(i, semaphore) for i in range(count)])
+
+    begin = time.monotonic()
+    aio.run(run_all())
+    report(count, time.monotonic() - begin, ttfts, totals, errors, ai, concurrency)
+
+def bench_cli(server, count=20, ai_type='chat'):
+    """
+    经交互界面的完整路径压测：依次调用 commands.generate.cmd_generate 生成count次，
+    流式输出经 cancelable 与 StreamRenderer 绘制到一个伪终端，生成结束后在确认提示处回答 n（不执行）。
+    首 token 耗时在主线程从 cancelable 取到第一个非空输出时计，完成耗时到确认提示返回为止。
+    """
+    import os
+    import pty
+    import tty
+    import threading
+    ai = bench_ai(server, ai_type)
+    from common import LLSState, set_winsize
+    from terminal import Screen
+    from ai.mixed import MixedAI
+    import commands.generate as g
+    state = LLSState()
+    state.screen = Screen()
+    state.ai = MixedAI()
+    state.ai.add('bench', ai)
+    state.ai.switch('bench')
+
+    master, slave = pty.openpty()
+    set_winsize(slave, 24, 80)
+    tty.setraw(slave)
+    drained = [0]
+
+    def drain():
+        while True:
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+            drained[0] += len(data)
+    threading.Thread(target=drain, daemon=True).start()
+
+    ttfts, totals, errors = [], [], []
+    first = [None]
+    real_cancelable = g.cancelable
+
+    def cancelable(generator, idle=None):
+        for chunk in real_cancelable(generator, idle):
+            if first[0] is None and chunk is not None and (chunk[0] or chunk[1]):
+                first[0] = time.monotonic()
+            if chunk is not None and str(chunk[0]).startswith('error:'):
+                errors.append(str(chunk[0]))
+            yield chunk
+        os.write(master, b'n\r')  # 生成结束后回答确认提示
+
+    saved = os.dup(0), os.dup(1)
+    sys.stdout.flush()
+    os.dup2(slave, 0)
+    os.dup2(slave, 1)
+    g.cancelable = cancelable
+    begin = time.monotonic()
+    try:
+        for i in range(count):
+            first[0] = None
+            start = time.monotonic()
+            cmd, _ = g.cmd_generate(state, f'bench {i}')
+            totals.append(time.monotonic() - start)
+            if first[0] is not None:
+                ttfts.append(first[0] - start)
+            if state.err is not None:
+                errors.append(state.err.strip().split('\n')[-1])
+                state.err = None
+    finally:
+        elapsed = time.monotonic() - begin
+        g.cancelable = real_cancelable
+        sys.stdout.flush()
+        os.dup2(saved[0], 0)
+        os.dup2(saved[1], 1)
+        for fd in saved:
+            os.close(fd)
+    report(count, elapsed, ttfts, totals, errors, ai)
+    print(f'terminal output: {drained[0]} bytes')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='OpenAI-compatible mock server for lls')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rules', help='JSON rules file')
+    parser.add_argument('--response', help='default response')
+    parser.add_argument('--think', help='default <think> section')
+    parser.add_argument('--ttft', type=float, help='default time to first token (s)')
+    parser.add_argument('--rate', type=float, help='default tokens per second')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--bench', type=int, metavar='N', help='run N generations against the server and exit')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--type', choices=['chat', 'text'], default='chat')
+    parser.add_argument('--cli', action='store_true', help='bench through cmd_generate (sequential, rendered to a pty)')
+    args = parser.parse_args(argv)
+
+    defaults, rules = load_rules(args.rules) if args.rules else ({}, [])
+    for key in ['response', 'think', 'ttft', 'rate']:
+        if getattr(args, key) is not None:
+            defaults[key] = getattr(args, key)
+    port = 0 if args.bench else args.port
+    server = MockServer(args.host, port, rules, defaults, verbose=args.verbose)
+    if args.bench:
+        server.start()
+        try:
+            if args.cli:
+                bench_cli(server, args.bench, args.type)
+            else:
+                bench(server, args.bench, args.concurrency, args.type)
+        finally:
+            server.stop()
+        return
+    print(f'LLS_OPENAI_BASE_URL={server.url}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
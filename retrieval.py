@@ -0,0 +1,134 @@
+"""
+retrieval.py
+历史生成记录检索，为提示词组装少样本示例。
+基于 ~/.cmd_history 增量构建 BM25 倒排索引。
+"""
+
+import os
+import re
+import math
+import heapq
+import threading
+from array import array
+
+history_file_path = os.path.join(os.environ.get('HOME', os.getcwd()), '.cmd_history')
+
+_word = re.compile(r'[a-z0-9_]+|[^\x00-\x7f\s]+')
+
+def tokenize(text):
+    """分词：ASCII按单词切分，非ASCII（如中文）按字符二元组切分。"""
+    tokens = []
+    for w in _word.findall(text.lower()):
+        if w.isascii() or len(w) == 1:
+            tokens.append(w)
+        else:
+            tokens.extend(w[i:i+2] for i in range(len(w) - 1))
+    return tokens
+
+class ExampleIndex:
+    """
+    (instruct, cmd) 示例对的倒排索引。
+    增量读取历史文件新追加的内容，相同的示例对只索引一次。
+    """
+    def __init__(self, path=history_file_path, k1=1.2, b=0.75, max_postings=1000):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings  # 每个词最多扫描的（最新）倒排项数，保证查询耗时有界
+        self.docs = []
+        self._keys = {}
+        self._lengths = array('I')
+        self._postings = {}
+        self._total_length = 0
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def add(self, instruct, cmd):
+        """添加一条示例，返回其编号。"""
+        key = (instruct, cmd)
+        doc_id = self._keys.get(key)
+        if doc_id is not None:
+            return doc_id
+        doc_id = len(self.docs)
+        self._keys[key] = doc_id
+        self.docs.append(key)
+        tokens = tokenize(instruct + ' ' + cmd)
+        tf = {}
+        for t in tokens:
+            tf[t] = tf.get(t, 0) + 1
+        for t, n in tf.items():
+            p = self._postings.get(t)
+            if p is None:
+                p = self._postings[t] = (array('I'), array('H'))
+            p[0].append(doc_id)
+            p[1].append(min(n, 65535))
+        self._lengths.append(len(tokens))
+        self._total_length += len(tokens)
+        return doc_id
+
+    def sync(self):
+        """读取历史文件中新追加的记录。"""
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                return
+            if size < self._offset:
+                self._offset = 0  # 文件被截断或替换，重新读取
+            if size == self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+            end = data.rfind(b'\n') + 1
+            self._offset += end
+            for line in data[:end].decode(errors='replace').split('\n'):
+                if not line.startswith('prompt: ') or '\t' not in line:
+                    continue
+                instruct, cmd = line[len('prompt: '):].split('\t', 1)
+                if instruct.strip() and cmd.strip():
+                    self.add(instruct.strip(), cmd.strip())
+
+    def search(self, query, k=3):
+        """返回与query最相似的k条示例 [(score, instruct, cmd), ...]。"""
+        self.sync()
+        n = len(self.docs)
+        if n == 0 or k <= 0:
+            return []
+        base = self.k1 * (1 - self.b)
+        scale = self.k1 * self.b * n / max(self._total_length, 1)
+        lengths = self._lengths
+        scores = {}
+        for t in set(tokenize(query)):
+            p = self._postings.get(t)
+            if p is None:
+                continue
+            ids, tfs = p
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5)) * (self.k1 + 1)
+            start = max(0, len(ids) - self.max_postings)
+            for d, tf in zip(ids[start:], tfs[start:]):
+                scores[d] = scores.get(d, 0) + idf * tf / (tf + base + scale * lengths[d])
+        best = heapq.nlargest(k, scores.items(), key=lambda x: (x[1], x[0]))
+        return [(s, *self.docs[d]) for d, s in best]
+
+    def examples(self, query, k=3, max_chars=1000):
+        """返回不超过max_chars总长度的示例 [(instruct, cmd), ...]，按相似度降序。"""
+        res = []
+        size = 0
+        for _, instruct, cmd in self.search(query, k):
+            size += len(instruct) + len(cmd)
+            if size > max_chars:
+                break
+            res.append((instruct, cmd))
+        return res
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """获取全局示例索引。"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ExampleIndex()
+    return _index
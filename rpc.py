@@ -0,0 +1,358 @@
+"""
+rpc.py
+Unix 域套接字上的 JSON-RPC 2.0 服务（每行一个JSON消息），供编辑器插件、看板等读取屏幕与驱动会话。
+
+启用：设置环境变量 LLS_RPC_SOCKET=路径（为1时使用 ~/.lls_rpc/<pid>.sock），或在命令模式中执行 rpc start [路径]。
+
+方法：
+    ping                              -> "pong"
+    snapshot                          -> {lines, cursor: [x, y], mode, offset}
+    delta {since}                     -> {data, offset}；since 已超出缓冲区时为 {reset: true, ...snapshot}
+    subscribe {since?} / unsubscribe  -> 订阅后以通知 {"method": "output", "params": {data, offset}} 推送子进程输出
+    input {data}                      -> 写入子进程终端
+    command {name, args?}             -> 执行已注册的命令，返回命令返回值（会提示输入的命令需给出args）；
+                                         命令在主线程中执行，主线程处于字符模式等待输入时才开始
+    generate {instruct, console?, stream?} -> {cmd, think}；stream 为真时先推送 generate.chunk 通知
+
+所有套接字IO在一个线程中以 selectors 处理；子进程输出只追加到环形缓冲区，不会因客户端读取缓慢而阻塞终端。
+"""
+
+import os
+import json
+import queue
+import selectors
+import threading
+import traceback
+from conn import Conn, listen
+
+buffer_size = int(os.environ.get('LLS_RPC_BUFFER', str(1024 * 1024)))
+
+def default_socket_path():
+    return os.path.join(os.environ.get('HOME', os.getcwd()), '.lls_rpc', f'{os.getpid()}.sock')
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+class Client(Conn):
+    def __init__(self, sock, sel):
+        super().__init__(sock, sel)
+        self.data = self
+        self.offset = None  # 订阅时为已推送到的输出位置
+
+class RPCServer:
+    """
+    RPC服务。feed() 由读取子进程输出的线程调用，其余工作都在服务线程中完成；
+    command 交给主线程、generate 在 aio 事件循环中执行，结果经队列交回服务线程发送。
+    """
+    def __init__(self, state, path=None, buffer_size=buffer_size):
+        self.state = state
+        self.path = path or default_socket_path()
+        self.buffer_size = buffer_size
+        self.output = bytearray()
+        self.offset = 0  # 子进程输出的总字节数
+        self.clients = {}
+        self.running = False
+        self._lock = threading.Lock()
+        self._results = queue.SimpleQueue()
+        self._sel = None
+        self._sock = None
+        self._thread = None
+        self._wake_r, self._wake_w = None, None
+
+    # ====== 子进程输出 ======
+
+    def feed(self, data):
+        """记录子进程输出并唤醒服务线程。"""
+        with self._lock:
+            self.output += data
+            self.offset += len(data)
+            if len(self.output) > self.buffer_size:
+                del self.output[:len(self.output) - self.buffer_size]
+        self._wake()
+
+    def read_output(self, since):
+        """返回 (data, offset)；since 已不在缓冲区内时 data 为None。"""
+        with self._lock:
+            start = self.offset - len(self.output)
+            if since < start or since > self.offset:
+                return None, self.offset
+            return bytes(self.output[since - start:]), self.offset
+
+    # ====== 启动与停止 ======
+
+    def start(self):
+        sock = listen(self.path)
+        self._sock = sock
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._sel = selectors.DefaultSelector()
+        self._sel.register(sock, selectors.EVENT_READ, 'accept')
+        self._sel.register(self._wake_r, selectors.EVENT_READ, 'wake')
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name='lls-rpc', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self._wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(1)
+
+    def _close(self):
+        for client in list(self.clients.values()):
+            self._drop(client)
+        self._sel.close()
+        self._sock.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'.')
+        except (BlockingIOError, OSError, TypeError):
+            pass
+
+    # ====== 服务线程 ======
+
+    def _loop(self):
+        try:
+            while self.running:
+                for key, events in self._sel.select():
+                    if key.data == 'accept':
+                        self._accept()
+                    elif key.data == 'wake':
+                        try:
+                            os.read(self._wake_r, 4096)
+                        except BlockingIOError:
+                            pass
+                    else:
+                        client = key.data
+                        if events & selectors.EVENT_READ:
+                            self._read(client)
+                        if events & selectors.EVENT_WRITE and self._alive(client):
+                            self._flush(client)
+                while not self._results.empty():
+                    client, message = self._results.get()
+                    if self._alive(client):
+                        self._send(client, message)
+                self._push_output()
+        except Exception:
+            self.state.err = traceback.format_exc()
+        finally:
+            self._close()
+
+    def _accept(self):
+        try:
+            sock, _ = self._sock.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = Client(sock, self._sel)
+        self.clients[client.fd] = client
+        self._sel.register(sock, selectors.EVENT_READ, client)
+
+    def _alive(self, client):
+        return self.clients.get(client.fd) is client
+
+    def _drop(self, client):
+        if self._alive(client):
+            del self.clients[client.fd]
+        try:
+            self._sel.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def _read(self, client):
+        data = client.recv()
+        if data is None:
+            return
+        if not data:
+            return self._drop(client)
+        client.rbuf += data
+        while b'\n' in client.rbuf and self._alive(client):
+            line, client.rbuf = client.rbuf.split(b'\n', 1)
+            if line.strip():
+                self._dispatch(client, line)
+        if len(client.rbuf) > client.max_buffer and self._alive(client):
+            self._drop(client)
+
+    def _send(self, client, message):
+        if not self._alive(client):
+            return
+        if not client.send(json.dumps(message, ensure_ascii=False).encode() + b'\n'):
+            self._drop(client)  # 写出出错，或客户端长期不读取
+
+    def _flush(self, client):
+        if not client.flush():
+            self._drop(client)
+
+    def _push_output(self):
+        for client in list(self.clients.values()):
+            if client.offset is None or client.offset == self.offset or len(client.wbuf) > client.max_buffer // 2:
+                continue
+            data, offset = self.read_output(client.offset)
+            if data is None:
+                params = dict(reset=True, **self.snapshot())
+            else:
+                params = dict(data=data.decode(errors='replace'), offset=offset)
+            client.offset = offset
+            self._send(client, dict(jsonrpc='2.0', method='output', params=params))
+
+    # ====== 方法分发 ======
+
+    def _dispatch(self, client, line):
+        id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise RPCError(-32700, 'parse error')
+            if not isinstance(request, dict):
+                raise RPCError(-32600, 'invalid request')
+            id = request.get('id')
+            params = request.get('params') or {}
+            method = getattr(self, 'rpc_' + str(request.get('method')).replace('.', '_'), None)
+            if method is None:
+                raise RPCError(-32601, f"method not found: {request.get('method')}")
+            result = method(client, id, **params)
+            if result is not self._deferred:
+                self._reply(client, id, result)
+        except RPCError as e:
+            if e.code in [-32700, -32600]:
+                # 无法确定请求id时也要回复（id为null）
+                return self._send(client, dict(jsonrpc='2.0', id=None, error=dict(code=e.code, message=e.message)))
+            self._reply(client, id, error=dict(code=e.code, message=e.message))
+        except TypeError as e:
+            self._reply(client, id, error=dict(code=-32602, message=str(e)))
+        except Exception as e:
+            self._reply(client, id, error=dict(code=-32000, message=str(e)))
+
+    _deferred = object()  # 方法稍后经 _results 回复
+
+    def _reply(self, client, id, result=None, error=None):
+        if id is None:
+            return  # 通知不需要回复
+        message = dict(jsonrpc='2.0', id=id)
+        if error is not None:
+            message['error'] = error
+        else:
+            message['result'] = result
+        self._send(client, message)
+
+    def _reply_later(self, client, id, result=None, error=None):
+        if id is not None:
+            message = dict(jsonrpc='2.0', id=id)
+            if error is not None:
+                message['error'] = error
+            else:
+                message['result'] = result
+            self._results.put((client, message))
+        self._wake()
+
+    def snapshot(self):
+        screen = self.state.screen
+        return dict(lines=list(screen.lines), cursor=[screen.x, screen.y], mode=self.state.mode, offset=self.offset)
+
+    def rpc_ping(self, client, id):
+        return 'pong'
+
+    def rpc_snapshot(self, client, id):
+        return self.snapshot()
+
+    def rpc_delta(self, client, id, since):
+        data, offset = self.read_output(int(since))
+        if data is None:
+            return dict(reset=True, **self.snapshot())
+        return dict(data=data.decode(errors='replace'), offset=offset)
+
+    def rpc_subscribe(self, client, id, since=None):
+        client.offset = self.offset if since is None else int(since)
+        return dict(offset=self.offset)
+
+    def rpc_unsubscribe(self, client, id):
+        client.offset = None
+        return True
+
+    def rpc_input(self, client, id, data):
+        os.write(self.state.master_fd, str(data).encode())
+        return True
+
+    def rpc_command(self, client, id, name, args=None):
+        from commands.registry import get_command, execute_command
+        if get_command(name) is None:
+            raise RPCError(-32602, f'{name}: command not found')
+        state = self.state
+
+        def run():
+            err = state.err
+            result = execute_command(name, state, args)
+            if state.err is not err:
+                raise RuntimeError(state.err.strip().split('\n')[-1])
+            return result
+
+        def done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                return self._reply_later(client, id, error=dict(code=-32000, message=str(e)))
+            self._reply_later(client, id, result if result is None or isinstance(result, (str, int, float, bool)) else str(result))
+        # 命令可能读取键盘输入、绘制终端，交给主线程在字符模式空闲时执行
+        state.calls.submit(run).add_done_callback(done)
+        return self._deferred
+
+    def rpc_generate(self, client, id, instruct, console=None, stream=False):
+        import aio
+        if console is None:
+            console = self.state.screen.text()
+        ai = self.state.ai
+
+        async def run():
+            chunk = ('', '')
+            try:
+                async for chunk in ai.agenerate(instruct, console):
+                    if stream and (chunk[0] or chunk[1]):
+                        self._results.put((client, dict(jsonrpc='2.0', method='generate.chunk',
+                                                         params=dict(id=id, cmd=str(chunk[0]), think=str(chunk[1])))))
+                        self._wake()
+                self._reply_later(client, id, dict(cmd=str(chunk[0]), think=str(chunk[1])))
+            except Exception as e:
+                self._reply_later(client, id, error=dict(code=-32000, message=str(e)))
+        aio.submit(run())
+        return self._deferred
+
+_server = None
+
+def get_server():
+    return _server
+
+def start(state, path=None):
+    """启动（或重启）RPC服务，返回服务实例。"""
+    global _server
+    stop()
+    _server = RPCServer(state, path).start()
+    state.rpc = _server
+    return _server
+
+def stop():
+    global _server
+    if _server is not None:
+        _server.state.rpc = None
+        _server.stop()
+        _server = None
+
+def start_from_env(state):
+    """按 LLS_RPC_SOCKET 环境变量启动服务。"""
+    path = os.environ.get('LLS_RPC_SOCKET')
+    if path:
+        return start(state, None if path == '1' else path)
+    return None
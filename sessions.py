@@ -0,0 +1,356 @@
+"""
+sessions.py
+多会话PTY复用：一个lls进程内管理多个子进程终端，每个会话有独立的屏幕与AI对话上下文。
+
+当前会话的字段（command/master_fd/slave_fd/slave_tty/proc/screen/ai/bufs）直接放在 LLSState 上，
+切换会话时整体换入换出，因此其他模块无需感知多会话。所有会话的输出由一个IO线程统一读取。
+各会话的输入历史缓冲区（display.bufs）相互独立，接受的输入都追加到共享的历史日志中（类似多个shell共用 HISTFILE）。
+
+快捷键（字符模式下先按 Ctrl-]）：c 新建会话，n/p 下一个/上一个，1-9 切换到指定会话，
+l 列出会话，Ctrl-] 发送 Ctrl-] 本身。
+"""
+
+import os
+import sys
+import pty
+import signal
+import selectors
+import threading
+import traceback
+import subprocess
+import termios
+from terminal import Screen, render_screen
+from common import set_winsize
+
+prefix_key = '\035'  # Ctrl-]
+
+class Session:
+    fields = ['command', 'master_fd', 'slave_fd', 'slave_tty', 'proc', 'screen', 'ai', 'bufs']
+
+    def __init__(self, id, command):
+        self.id = id
+        self.command = command
+        self.master_fd = None
+        self.slave_fd = None
+        self.slave_tty = None
+        self.proc = None
+        self.screen = None
+        self.ai = None
+        self.bufs = {}  # 输入历史缓冲区，见 display.bufs
+        self.closed = False
+
+    def alive(self):
+        return not self.closed and self.proc is not None and self.proc.poll() is None
+
+    def close(self):
+        self.closed = True
+        for fd in [self.master_fd, self.slave_fd]:
+            try:
+                os.close(fd)
+            except (OSError, TypeError):
+                pass
+        if self.screen is not None:
+            self.screen.close()
+
+    def name(self):
+        return os.path.basename(self.command[0]) if self.command else '?'
+
+class SessionManager:
+    """
+    会话管理器。spawn 在主线程中创建会话，IO线程以 selectors 读取所有会话的输出：
+    当前会话的输出同时写到终端，其余会话只写入各自的 Screen。
+    """
+    def __init__(self, state):
+        self.state = state
+        self.sessions = []
+        self.current = None
+        self.prefix = False
+        self._next_id = 1
+        self._lock = threading.RLock()
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_w, False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = None
+        self._ended = False
+
+    # ====== 会话创建与切换 ======
+
+    def spawn(self, command=None, screen=None, ai=None):
+        """启动新的子进程会话（不切换）。"""
+        state = self.state
+        command = command or state.command
+        session = Session(self._next_id, command)
+        self._next_id += 1
+        session.master_fd, session.slave_fd = pty.openpty()
+        if screen is None:
+            screen = Screen(self.history_file(session.id))
+            screen.keep_logs_when_clean_screen = True
+        session.screen = screen
+        if ai is None:
+            ai = self.new_ai()
+        session.ai = ai
+        if state.winsize is not None:
+            set_winsize(session.slave_fd, state.winsize.lines, state.winsize.columns)
+            screen.max_height = state.winsize.lines
+        try:
+            session.proc = subprocess.Popen(
+                command,
+                preexec_fn=os.setsid,
+                stdin=session.slave_fd,
+                stdout=session.slave_fd,
+                stderr=session.slave_fd,
+                shell=False,
+                text=False,
+                bufsize=0,
+            )
+        except Exception:
+            session.close()
+            raise
+        session.slave_tty = termios.tcgetattr(session.slave_fd)
+        with self._lock:
+            self.sessions.append(session)
+            self._sel.register(session.master_fd, selectors.EVENT_READ, session)
+        self._wake()
+        return session
+
+    def history_file(self, id):
+        """会话的屏幕历史文件：第一个会话为 ~/.lls_screen_history，其余会话在其后加上会话编号。"""
+        path = self.state.screen_history_file_path
+        if path and id > 1:
+            path = f'{path}.{id}'
+        return path
+
+    def adopt_ai(self, ai):
+        """后台加载AI配置完成：当前会话使用加载的AI，加载完成前创建的会话（AI为空的占位）复制其配置。"""
+        from ai.mixed import MixedAI
+        with self._lock:
+            self.state.ai = ai
+            for s in self.sessions:
+                if s is not self.current and (s.ai is None or not s.ai.ais):
+                    s.ai = MixedAI.from_config(config=ai.save_config())
+
+    def ai_configs(self):
+        """各会话的AI配置，当前会话在最后。"""
+        with self._lock:
+            ais = [s.ai for s in self.sessions if s is not self.current and s.ai is not None]
+            ais.append(self.state.ai)
+            return [ai.save_config() for ai in ais]
+
+    def new_ai(self):
+        """新会话的AI：复制当前AI配置，对话历史为空；AI客户端全局共享。"""
+        from ai.mixed import MixedAI
+        current = self.state.ai
+        if current is None or not current.ais:
+            return MixedAI()
+        return MixedAI.from_config(config=current.save_config())
+
+    def switch(self, session, redraw=True):
+        """切换当前会话：保存当前会话的字段，换入目标会话的字段。只在主线程中调用。"""
+        state = self.state
+        with self._lock:
+            if self.current is not None and self.current is not session:
+                for key in Session.fields:
+                    setattr(self.current, key, getattr(state, key))
+            for key in Session.fields:
+                setattr(state, key, getattr(session, key))
+            self.current = session
+        display = sys.modules.get('display')
+        if display is not None:
+            display.bufs = state.bufs  # 未载入时 display 载入后由 get_bufs 取得自己的缓冲区
+        if redraw:
+            self.redraw()
+
+    def create(self, command=None):
+        """新建会话并切换过去。"""
+        session = self.spawn(command)
+        self.switch(session)
+        return session
+
+    def step(self, n):
+        """切换到后（n>0）或前（n<0）第n个会话。"""
+        with self._lock:
+            if not self.sessions or self.current not in self.sessions:
+                return
+            i = (self.sessions.index(self.current) + n) % len(self.sessions)
+            session = self.sessions[i]
+        if session is not self.current:
+            self.switch(session)
+
+    def select(self, index):
+        """按1开始的序号切换会话。"""
+        with self._lock:
+            if not 1 <= index <= len(self.sessions):
+                raise ValueError(f'no such session {index} [1-{len(self.sessions)}]')
+            session = self.sessions[index - 1]
+        if session is not self.current:
+            self.switch(session)
+
+    def describe(self):
+        """会话列表，每项一行。"""
+        lines = []
+        with self._lock:
+            for i, s in enumerate(self.sessions, 1):
+                mark = '*' if s is self.current else ' '
+                lines.append(f'{mark}{i}: {s.name()} (pid {s.proc.pid}, {len(s.screen.lines)} lines)')
+        return lines
+
+    def redraw(self):
+        """清屏并按当前会话的屏幕内容重绘，然后通知子进程重绘（如全屏程序）。"""
+        state = self.state
+        with self._lock:
+            index = self.sessions.index(self.current) + 1 if self.current in self.sessions else 0
+            total = len(self.sessions)
+        out = f'\033]0;lls [{index}/{total}] {self.current.name()}\007'
+        out += render_screen(state.screen, state.winsize.lines, state.winsize.columns)
+        os.write(sys.stdout.fileno(), out.encode())
+        try:
+            os.killpg(state.proc.pid, signal.SIGWINCH)
+        except OSError:
+            pass
+
+    # ====== 快捷键 ======
+
+    def key(self, c):
+        """
+        处理 Ctrl-] 前缀快捷键，返回需要转发给子进程的字符。
+        """
+        if not self.prefix:
+            if c == prefix_key:
+                self.prefix = True
+                return ''
+            return c
+        self.prefix = False
+        try:
+            if c == prefix_key:
+                return c
+            elif c == 'c':
+                self.create()
+            elif c == 'n':
+                self.step(1)
+            elif c == 'p':
+                self.step(-1)
+            elif c.isdigit() and c != '0':
+                self.select(int(c))
+            elif c == 'l':
+                from display import show_line
+                show_line(' | '.join(self.describe()))
+                from common import print_context
+                print_context(self.state)
+        except Exception as e:
+            print('error:', e, end='\r\n')
+            self.state.err = traceback.format_exc()
+        return ''
+
+    # ====== IO线程 ======
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='lls-sessions', daemon=True)
+        self._thread.start()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'.')
+        except OSError:
+            pass
+
+    def alive(self):
+        """是否还有存活的会话。"""
+        with self._lock:
+            return any(s.alive() for s in self.sessions)
+
+    def _loop(self):
+        state = self.state
+        while state.running:
+            try:
+                events = self._sel.select(0.5)
+            except OSError:
+                continue
+            for key, _ in events:
+                session = key.data
+                if session is None:
+                    os.read(self._wake_r, 4096)
+                    continue
+                try:
+                    chars = os.read(session.master_fd, 10240)
+                except OSError:
+                    chars = b''
+                if not chars:
+                    self._unregister(session)
+                    continue
+                try:
+                    self.output(session, chars)
+                except Exception as e:
+                    print('error:', e, end='\r\n')
+                    state.err = traceback.format_exc()
+            self._reap()
+
+    def output(self, session, chars):
+        state = self.state
+        if session is self.current:
+            if state.mode != 'line':
+                os.write(sys.stdout.fileno(), chars)
+            session.screen.write(chars)
+            if state.rpc is not None:
+                state.rpc.feed(chars)
+            if state.slave_callback is not None:
+                state.slave_callback()
+        else:
+            session.screen.write(chars)
+
+    def _unregister(self, session):
+        with self._lock:
+            try:
+                self._sel.unregister(session.master_fd)
+            except (KeyError, ValueError):
+                pass
+
+    def _reap(self):
+        """
+        移除已退出的会话。当前会话退出时，切换（改写 state 上的字段并重绘终端）交给主线程执行，
+        主线程可能正在使用旧会话的fd与屏幕，旧会话在切换之后才关闭。
+        """
+        with self._lock:
+            dead = [s for s in self.sessions if not s.alive()]
+            if dead and len(dead) == len(self.sessions):
+                # 全部退出时保留当前会话，唤醒等待输入的主线程，由主循环结束程序
+                if not self._ended:
+                    self._ended = True
+                    self.state.calls.submit(lambda: None)
+                return
+            if not dead:
+                return
+            for s in dead:
+                i = self.sessions.index(s)
+                self.sessions.remove(s)
+                self._unregister(s)
+                if s is self.current:
+                    self.state.calls.submit(lambda s=s, i=i: self._replace(s, i))
+                else:
+                    s.close()
+
+    def _replace(self, dead, i):
+        """（主线程）当前会话已退出，切换到原位置附近存活的会话后关闭它。"""
+        with self._lock:
+            if self.current is not dead:
+                return
+            target = self.sessions[min(i, len(self.sessions) - 1)] if self.sessions else None
+        if target is not None:
+            self.switch(target)
+            dead.close()
+
+    def close(self):
+        """退出时关闭所有会话的屏幕（写入历史结束标记）。"""
+        with self._lock:
+            sessions = self.sessions if self.current in self.sessions else self.sessions + [self.current]
+            for s in sessions:
+                if s is not None and s.screen is not None:
+                    s.screen.close()
+
+    def sync_winsize(self):
+        state = self.state
+        with self._lock:
+            for s in self.sessions:
+                if s is not self.current:
+                    s.screen.max_height = state.winsize.lines
+                    set_winsize(s.slave_fd, state.winsize.lines, state.winsize.columns)
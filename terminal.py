@@ -105,6 +105,9 @@ def esc_use_alter_buffer(s):
 def esc_use_main_buffer(s):
     s.buffer = 'main'
 
+def esc_bracketed_paste(s, mode):
+    s.bracketed_paste = mode == 'h'
+
 def esc_raw(s, chars):
     return '^' + chars
 
@@ -164,6 +167,7 @@ esc_patterns = {
     # 设置幕缓冲区
     r'\033\[\?(?:1049|47)h': esc_use_alter_buffer, # 使用备用屏幕缓冲区
     r'\033\[\?(?:1049|47)l': esc_use_main_buffer, # 使用主用屏幕缓冲区
+    r'\033\[\?2004([hl])': esc_bracketed_paste, # 括号粘贴模式
     # 光标可见性,设置窗口宽度
     r'\033\[\?[0-9;]*[hl]': '',
     # 换行模式设置
@@ -209,6 +213,7 @@ class Screen:
         self.total_chars = 0
         self.keep_logs_when_clean_screen = False
         self.insert_mode = False  # 插入模式
+        self.bracketed_paste = False  # 程序是否开启了括号粘贴模式
         self.limit_move = False
         self.auto_move_to_end = False
         self.auto_move_between_line = False
@@ -531,6 +536,28 @@ def print_screen_perfect(screen, end='\n', tail='', width=None, height=None, fra
             print(', esc=', screen.esc.encode(), end='')
         print('', end=end)
 
+def render_screen(screen, rows, cols):
+    """
+    生成重绘屏幕的紧凑转义序列：清屏、输出最后rows行（按显示宽度截断到cols列）、恢复光标位置。
+    用于切换会话或重新连接时代替回放原始输出。
+    """
+    from display import get_width
+
+    def fit(line):
+        n = 0
+        for i, c in enumerate(line):
+            n += get_width(c)
+            if n > cols:
+                return line[:i]
+        return line
+    lines = screen.lines[-rows:]
+    top = len(screen.lines) - len(lines)
+    out = '\033[H\033[2J' + '\r\n'.join(fit(line) for line in lines)
+    line = screen.lines[screen.y] if 0 <= screen.y < len(screen.lines) else ''
+    col = sum(get_width(c) for c in line[:screen.x]) + max(screen.x - len(line), 0)
+    out += f'\033[{max(screen.y - top, 0) + 1};{min(col, cols - 1) + 1}H'
+    return out
+
 print_wait = False
 
 def write_and_print(screen, chars, msg='', delay=0.05, sleep=0.5):
@@ -0,0 +1,94 @@
+"""
+workers.py
+可复用的后台工作线程池，用于流式生成等短时任务，避免每次请求新建线程。
+"""
+
+import os
+import queue
+import threading
+
+idle_timeout = float(os.environ.get('LLS_WORKER_IDLE_TIMEOUT', '60'))
+
+class WorkerPool:
+    """
+    按需扩容的守护线程池：有空闲线程时复用，否则新建；空闲超过idle_timeout秒的线程自动退出。
+    线程数不设上限，因为流式任务大多阻塞在网络IO上，排队等待会拖慢并发请求。
+    """
+    def __init__(self, idle_timeout=idle_timeout, name='lls-worker'):
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self._tasks = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._idle = 0
+        self._threads = set()
+        self._closed = False
+
+    def submit(self, fn, *args, **kwargs):
+        """提交任务，异常由任务自身处理。"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('worker pool is shut down')
+            if self._idle > 0:
+                self._idle -= 1
+            else:
+                thread = threading.Thread(target=self._run, name=f'{self.name}-{len(self._threads)}', daemon=True)
+                self._threads.add(thread)
+                thread.start()
+        self._tasks.put((fn, args, kwargs))
+
+    def _run(self):
+        while True:
+            try:
+                task = self._tasks.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    # 退出前再确认一次，避免刚分配给本线程的任务无人执行
+                    if self._idle > 0 and self._tasks.empty():
+                        self._idle -= 1
+                        self._threads.discard(threading.current_thread())
+                        return
+                continue
+            if task is None:
+                with self._lock:
+                    self._threads.discard(threading.current_thread())
+                return
+            fn, args, kwargs = task
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                pass
+            finally:
+                fn = args = kwargs = task = None
+                with self._lock:
+                    self._idle += 1
+
+    def size(self):
+        """返回 (线程数, 空闲线程数)。"""
+        with self._lock:
+            return len(self._threads), self._idle
+
+    def shutdown(self, wait=False, timeout=None):
+        """不再接受新任务，空闲线程执行完已提交任务后退出。"""
+        with self._lock:
+            self._closed = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._tasks.put(None)
+        if wait:
+            for thread in threads:
+                thread.join(timeout)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """获取全局线程池。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+    return _pool
+
+def submit(fn, *args, **kwargs):
+    """在全局线程池中执行任务。"""
+    get_pool().submit(fn, *args, **kwargs)